@@ -1,12 +1,32 @@
 from dotenv import load_dotenv
-import pulp
 import pandas as pd
 import numpy as np
-import requests
 import os
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, has_request_context
 from flask_cors import CORS
 from functools import wraps
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import hashlib
+import json
+import requests
+import metrics
+from optimizer import (
+    BENCH_WEIGHT,
+    SQUAD_COMPOSITION,
+    OptimizationError,
+    SolverBusy,
+    SolverPool,
+    select_squad_ids,
+)
+from ownership import OwnershipCounter
+from predictions import MAX_HORIZON
+from player_index import QUERY_PARAMS, QueryError
+from seasons import SeasonCache, UnknownSeason
+from snapshots import snapshot_cache
+import storage
+from transfers import MAX_FREE_TRANSFERS, plan_transfers
+from upstream import RateLimiter, SingleFlight, TTLCache, fpl_client
 
 load_dotenv()
 
@@ -14,14 +34,100 @@ load_dotenv()
 current_directory = os.getcwd()
 # Define the path to the directories within the current directory
 models_directory = os.path.join(current_directory, "models")
-data_directory = os.path.join(current_directory, "data2425")
 
 
 api_keys = os.environ
 
 
+def env(name, default, cast=int):
+    """Setting from the environment, `default` when unset or empty"""
+    value = os.environ.get(name, "")
+    return default if value == "" else cast(value)
+
+
+def env_flag(value):
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def env_optional(cast):
+    # "none" or "off" unsets a setting whose default is a value
+    def parse(value):
+        return None if value.strip().lower() in ("none", "off") else cast(value)
+
+    return parse
+
+
 app = Flask(__name__)
 CORS(app)
+# every setting can be overridden by the environment variable of its name
+app.config.update(
+    # upper bounds for /api/fpl/batch and for all calls to the FPL API
+    BATCH_MAX_ENTRIES=env("BATCH_MAX_ENTRIES", 500),
+    BATCH_CONCURRENCY=env("BATCH_CONCURRENCY", 8),
+    UPSTREAM_RATE_LIMIT=env("UPSTREAM_RATE_LIMIT", 20, env_optional(float)),
+    # Prometheus scrape route, METRICS_PATH=none disables it
+    METRICS_PATH=env("METRICS_PATH", "/metrics", env_optional(str)),
+    METRICS_AUTH_REQUIRED=env("METRICS_AUTH_REQUIRED", False, env_flag),
+    # directory the worker processes share their metrics through, so any
+    # of them can answer a scrape for all of them (see gunicorn.conf.py)
+    METRICS_DIRECTORY=env("METRICS_DIRECTORY", None, str),
+    # add a Server-Timing header with per-stage durations to every response
+    SERVER_TIMING=env("SERVER_TIMING", False, env_flag),
+    # /api/optimize: solver processes, jobs queued before answering 503, the
+    # solver's own time limit and how long a request waits for it
+    OPTIMIZE_WORKERS=env("OPTIMIZE_WORKERS", 2),
+    OPTIMIZE_QUEUE_SIZE=env("OPTIMIZE_QUEUE_SIZE", 8),
+    OPTIMIZE_TIME_LIMIT=env("OPTIMIZE_TIME_LIMIT", 5, float),
+    OPTIMIZE_TIMEOUT=env("OPTIMIZE_TIMEOUT", 10, float),
+    OPTIMIZE_MIP_GAP=env("OPTIMIZE_MIP_GAP", None, env_optional(float)),
+    OPTIMIZE_CACHE_SIZE=env("OPTIMIZE_CACHE_SIZE", 1024),
+    OPTIMIZE_OBJECTIVES=env(
+        "OPTIMIZE_OBJECTIVES",
+        ["preds", "form", "top_ownership"],
+        lambda value: value.split(","),
+    ),
+    # seconds between checks for a newly published snapshot version, which
+    # is warmed up in the background before requests switch to it; 0 disables
+    SNAPSHOT_POLL_INTERVAL=env("SNAPSHOT_POLL_INTERVAL", 10, float),
+    # ?season= picks one of storage.SEASONS; seasons other than the default
+    # are loaded on first use and evicted, least recently used first, when
+    # their frames and payloads take more than SEASON_MEMORY_LIMIT bytes
+    DEFAULT_SEASON=env("DEFAULT_SEASON", storage.CURRENT_SEASON, str),
+    SEASON_MEMORY_LIMIT=env("SEASON_MEMORY_LIMIT", 512 * 1024 * 1024),
+)
+if app.config["UPSTREAM_RATE_LIMIT"]:
+    fpl_client.limiter = RateLimiter(app.config["UPSTREAM_RATE_LIMIT"])
+solver_pool = SolverPool(
+    app.config["OPTIMIZE_WORKERS"], app.config["OPTIMIZE_QUEUE_SIZE"]
+)
+optimize_results = TTLCache(app.config["OPTIMIZE_CACHE_SIZE"])
+optimize_flight = SingleFlight()
+seasons = SeasonCache(
+    {
+        season: os.path.join(current_directory, directory)
+        for season, directory in storage.SEASONS.items()
+    },
+    app.config["DEFAULT_SEASON"],
+    app.config["SEASON_MEMORY_LIMIT"],
+)
+
+
+def current_season():
+    """Season the request asked for with ?season=, the default one otherwise"""
+    if not has_request_context():
+        return seasons.get()
+    if "season" not in g:
+        g.season = seasons.get(request.args.get("season"))
+    return g.season
+
+
+def data_directory():
+    """Snapshot version directory to read from, fixed for a whole request"""
+    if not has_request_context():
+        return current_season().directory
+    if "data_directory" not in g:
+        g.data_directory = current_season().directory
+    return g.data_directory
 
 
 def authorization_required(func):
@@ -37,67 +143,48 @@ def authorization_required(func):
     return decorated_function
 
 
-def SolveLP(df, SquadComposition, MaxElementsPerTeam, BudgetLimit):
-    # Get a list of players
-    players = list(df["web_name"])
-    # Initialize Dictionaries for Salaries and Positions
-    cost = dict(zip(players, df["now_cost"]))
-    positions = dict(zip(players, df["element_type"]))
-    teams = dict(zip(players, df["team"]))
-    # Dictionary for Projected Score for each player
-    project_points = dict(zip(players, df["top_ownership"]))
-    # Set Players to Take either 1 or 0 values (owned or not)
-    player_vars = pulp.LpVariable.dicts(
-        "Player", players, lowBound=0, upBound=1, cat="Integer"
-    )
+def current_season_only(func):
+    """Reject ?season= for views backed by the FPL API, which only serves
+    the current season"""
 
-    total_score = pulp.LpProblem("FPL Best Team", pulp.LpMaximize)
-    total_score += pulp.lpSum([project_points[i] * player_vars[i] for i in player_vars])
-    total_score += (
-        pulp.lpSum([cost[i] * player_vars[i] for i in player_vars]) <= BudgetLimit
-    )
-    # Get indices of players for each position
-    fwd = [p for p in positions.keys() if positions[p] == 4]
-    mid = [p for p in positions.keys() if positions[p] == 3]
-    defD = [p for p in positions.keys() if positions[p] == 2]
-    gk = [p for p in positions.keys() if positions[p] == 1]
-    # Set Constraints
-    total_score += (
-        pulp.lpSum([player_vars[i] for i in fwd]) == SquadComposition["Forwards"]
-    )
-    total_score += (
-        pulp.lpSum([player_vars[i] for i in defD]) == SquadComposition["Defenders"]
-    )
-    total_score += (
-        pulp.lpSum([player_vars[i] for i in mid]) == SquadComposition["Midfielders"]
-    )
-    total_score += (
-        pulp.lpSum([player_vars[i] for i in gk]) == SquadComposition["Goalkeepers"]
-    )
+    @wraps(func)
+    def decorated_function(*args, **kwargs):
+        if current_season().name != storage.CURRENT_SEASON:
+            return (
+                jsonify(
+                    {
+                        "message": "ERROR: Only available for the "
+                        f"{storage.CURRENT_SEASON} season"
+                    }
+                ),
+                400,
+            )
+        return func(*args, **kwargs)
 
-    # Teams constraints
-    for k in list(df["team"].unique()):
-        teamTMP = [p for p in teams.keys() if teams[p] == k]
-        total_score += (
-            pulp.lpSum([player_vars[i] for i in teamTMP]) <= MaxElementsPerTeam
-        )
+    return decorated_function
 
-    total_score.solve(pulp.PULP_CBC_CMD(msg=False))
 
-    playersTeam = []
-    for v in total_score.variables():
-        if v.varValue > 0:
-            playersTeam.append(
-                v.name.replace("Player_r_", "").replace("_", " ").replace("Player ", "")
-            )
-        #   print(v.name.replace("Player_r_","").replace("_", " ").replace("Player ",""))
+TEAM_PICK_COLUMNS = [
+    "id",
+    "web_name",
+    "now_cost",
+    "event_points",
+    "element_type",
+    "form",
+    "selected_by_percent",
+    "news",
+    "team",
+    "photo",
+    "preds",
+]
 
-    dfPlayers = pd.DataFrame(playersTeam)
-    dfPlayers.columns = ["name"]
 
-    merged_df = df.merge(dfPlayers, left_on="web_name", right_on="name", how="inner")
-    merged_df = merged_df.drop(columns=["name"])
-    return merged_df
+def _team_pick_players(players):
+    team_players = players[TEAM_PICK_COLUMNS].copy()
+    team_players["photo"] = team_players["photo"].str.replace(
+        ".jpg", ".png", regex=False
+    )
+    return team_players
 
 
 def get_team_data(entry_id, gameweek):
@@ -109,28 +196,18 @@ def get_team_data(entry_id, gameweek):
         entry_id (int) : ID of the team whose data is to be retrieved
         gameweek (int) : Specific gameweek
     """
-    base_url = "https://fantasy.premierleague.com/api/entry/"
-    full_url = base_url + str(entry_id) + "/event/" + str(gameweek) + "/picks/"
-    response = requests.get(full_url)
-    response.raise_for_status()
-    data = response.json()
-    team_picks = pd.DataFrame(data["picks"])
+    data = fpl_client.picks(
+        entry_id, gameweek, finished=gameweek in finished_gameweeks()
+    )
+    return merge_picks(pd.DataFrame(data["picks"]))
+
+
+def merge_picks(team_picks):
+    """Join raw picks with the player columns shown for a team"""
     team_picks = team_picks.merge(
-        player_data()[
-            [
-                "id",
-                "web_name",
-                "now_cost",
-                "event_points",
-                "element_type",
-                "form",
-                "selected_by_percent",
-                "news",
-                "team",
-                "photo",
-                "preds",
-            ]
-        ],
+        snapshot_cache.derive(
+            player_data_path(), _team_pick_players, columns=TEAM_PICK_COLUMNS
+        ),
         left_on="element",
         right_on="id",
     )
@@ -141,14 +218,10 @@ def get_team_data(entry_id, gameweek):
     ):
         team_picks["element_type"] = team_picks["element_type_x"]  # Keep one
         team_picks.drop(columns=["element_type_x", "element_type_y"], inplace=True)
-    team_picks["photo"] = team_picks["photo"].str.replace(".jpg", ".png", regex=False)
     return team_picks
 
 
-def current_gameweek():
-    gameweek_data = pd.read_pickle(
-        os.path.join(data_directory, "get_gameweek_data.pkl")
-    )
+def _current_from_events(gameweek_data):
     try:
         current = gameweek_data[gameweek_data["is_current"]].iloc[-1]["id"]
     except IndexError:  # catch gameweek 0
@@ -156,133 +229,653 @@ def current_gameweek():
     return current
 
 
-def player_data():
+def gameweek_data_path():
+    return storage.resolve(data_directory(), "get_gameweek_data")
+
+
+def current_gameweek():
+    return snapshot_cache.derive(gameweek_data_path(), _current_from_events)
+
+
+def _finished_from_events(gameweek_data):
+    return frozenset(gameweek_data.loc[gameweek_data["finished"], "id"])
+
+
+def finished_gameweeks():
+    return snapshot_cache.derive(gameweek_data_path(), _finished_from_events)
+
+
+def player_data_path():
     gameweek = current_gameweek()
-    players = pd.read_pickle(
-        os.path.join(data_directory, f"get_player_data_gw{gameweek}.pkl")
-    )
+    return storage.resolve(data_directory(), f"get_player_data_gw{gameweek}")
+
+
+def player_horizon_data_path():
+    gameweek = current_gameweek()
+    return storage.resolve(data_directory(), f"get_player_horizon_gw{gameweek}")
+
+
+def fixtures_data_path():
+    return storage.resolve(data_directory(), "get_fixtures_data")
+
+
+def club_data_path():
+    return storage.resolve(data_directory(), "get_club_data")
+
+
+def top_managers_data_path():
+    gameweek = current_gameweek()
+    return storage.resolve(data_directory(), f"top250_gw{gameweek}")
+
+
+def top_ownership_data_path():
+    gameweek = current_gameweek()
+    return storage.resolve(data_directory(), f"all_top250_gw{gameweek}_data")
+
+
+def ai_team_data_path():
+    gameweek = current_gameweek()
+    return storage.resolve(data_directory(), f"ai_team_gw{gameweek}")
+
+
+def fpl_challenge_data_path():
+    gameweek = current_gameweek()
+    return storage.resolve(data_directory(), f"FPL_challenge_gw{gameweek}")
+
+
+def player_data():
+    return snapshot_cache.load(player_data_path())
+
+
+def player_sources():
+    """Files /api/players is built from; the horizon is optional"""
+    sources = [player_data_path(), club_data_path()]
+    horizon_path = player_horizon_data_path()
+    if os.path.exists(horizon_path):
+        sources.append(horizon_path)
+    return sources
+
+
+def players_frame(sources):
+    """Player snapshot with club columns and, if stored, the xp_gw horizon"""
+    players = with_clubs(player_data())
+    if len(sources) > 2:
+        horizon = snapshot_cache.load(sources[2])
+        # stored as float32, widen so values serialize as written
+        xp = [column for column in horizon.columns if column != "id"]
+        horizon = horizon.astype({column: np.float64 for column in xp}).round(2)
+        with metrics.stage("merge"):
+            players = players.merge(horizon, on="id", how="left")
     return players
 
 
 def fixtures_data():
-    fixtures = pd.read_pickle(os.path.join(data_directory, "get_fixtures_data.pkl"))
-    return fixtures
+    return snapshot_cache.load(fixtures_data_path())
 
 
 def club_data():
-    clubs = pd.read_pickle(os.path.join(data_directory, "get_club_data.pkl"))
-    return clubs
+    return snapshot_cache.load(club_data_path())
 
 
 def top_managers_data():
-    gameweek = current_gameweek()
-    top_managers = pd.read_pickle(
-        os.path.join(data_directory, f"top250_gw{gameweek}.pkl")
-    )
-    return top_managers
+    return snapshot_cache.load(top_managers_data_path())
 
 
 def ai_team_data():
-    gameweek = current_gameweek()
-    ai = pd.read_pickle(os.path.join(data_directory, f"ai_team_gw{gameweek}.pkl"))
-    return ai
+    return snapshot_cache.load(ai_team_data_path())
 
 
 def fpl_challenge_data():
-    gameweek = current_gameweek()
-    ai = pd.read_pickle(os.path.join(data_directory, f"FPL_challenge_gw{gameweek}.pkl"))
-    return ai
+    return snapshot_cache.load(fpl_challenge_data_path())
+
+
+def with_clubs(df):
+    clubs = club_data()[["team_code", "team_id", "team_name", "team_short_name"]]
+    with metrics.stage("merge"):
+        # a left merge keeps the rows in order, e.g. team sheets by position,
+        # where pandas' inner merge may group them by club
+        df = df[df["team"].isin(clubs["team_id"])]
+        return df.merge(clubs, how="left", left_on="team", right_on="team_id")
+
+
+def records(df):
+    """Convert a frame to JSON-ready rows, with missing values as None"""
+    with metrics.stage("clean"):
+        df = df.replace({np.nan: None})
+    with metrics.stage("to_dict"):
+        return df.to_dict(orient="records")
+
+
+def data_version(sources):
+    """Version stamp of a response, changes whenever one of its sources does"""
+    return tuple(snapshot_cache.signature(path) for path in sources)
+
+
+def render_json(obj):
+    # same bytes as returning obj from a view in production mode
+    with metrics.stage("serialize"):
+        return f"{app.json.dumps(obj, separators=(',', ':'))}\n".encode("utf-8")
+
+
+payload_results = metrics.registry.register(
+    metrics.Counter(
+        "fplmstr_payload_requests_total",
+        "Pre-rendered payload lookups by outcome",
+        ("payload", "result"),
+    )
+)
+
+
+def cached_payload(name, sources, build):
+    """Serve a response that is rendered once per version of its source files
+
+    Args:
+        name (str) : Key of the payload in the payload cache
+        sources (list) : Paths of the data files the response is built from
+        build (callable) : Returns the JSON-serializable response object
+    """
+    version = data_version(sources)
+    payload_cache = current_season().payloads
+    payload = payload_cache.peek(name, version)
+    if payload is not None and payload.etag in request.if_none_match:
+        payload_results.inc(name, "not_modified")
+        return payload_response(payload, not_modified=True)
+    payload_results.inc(name, "render" if payload is None else "hit")
+    payload = payload_cache.get(name, version, lambda: render_json(build()))
+    return payload_response(payload)
+
+
+def payload_response(payload, not_modified=False):
+    if not_modified or payload.etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        encoding = request.accept_encodings.best_match(
+            payload.encodings, default="identity"
+        )
+        response = app.response_class(
+            payload.bodies[encoding], mimetype=payload.content_type
+        )
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+    response.set_etag(payload.etag)
+    response.headers["Cache-Control"] = "no-cache"
+    response.vary.add("Accept-Encoding")
+    return response
 
 
 @app.route("/api/fixtures")
 @authorization_required
 def fixtures_api():
-    fixtures = fixtures_data()
-    fixtures["event"] = fixtures["event"].fillna(0)
-    fixturesdf = fixtures[
-        [
-            "code",
-            "event",
-            "id",
-            "team_a",
-            "team_h",
-            "team_a_difficulty",
-            "team_h_difficulty",
-            "team_code_a",
-            "team_code_h",
-            "team_name_a",
-            "team_name_h",
-            "team_short_name_a",
-            "team_short_name_h",
+    def build():
+        fixtures = fixtures_data()
+        fixturesdf = fixtures[
+            [
+                "code",
+                "event",
+                "id",
+                "team_a",
+                "team_h",
+                "team_a_difficulty",
+                "team_h_difficulty",
+                "team_code_a",
+                "team_code_h",
+                "team_name_a",
+                "team_name_h",
+                "team_short_name_a",
+                "team_short_name_h",
+            ]
         ]
-    ]
-    fixturesdf = fixturesdf.replace({np.nan: None})
-    return {"fixtures": fixturesdf.to_dict(orient="records")}
+        fixturesdf = fixturesdf.assign(event=fixturesdf["event"].fillna(0))
+        return {"fixtures": records(fixturesdf)}
+
+    return cached_payload("fixtures", [fixtures_data_path()], build)
 
 
 @app.route("/api/fpl/<int:team_id>")
 @authorization_required
+@current_season_only
 def fpl_team(team_id: int):
     team_data = get_team_data(team_id, gameweek=current_gameweek())
-    team_data = team_data.merge(
-        club_data()[["team_code", "team_id", "team_name", "team_short_name"]],
-        left_on="team",
-        right_on="team_id",
+    team_data = with_clubs(team_data)
+    return {"my_team": records(team_data)}
+
+
+def _integer(value, name):
+    # JSON true and 1.5 would pass int() as 1
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f"Invalid integer for '{name}': {value!r}")
+    return value
+
+
+@app.route("/api/fpl/batch", methods=["POST"])
+@authorization_required
+@current_season_only
+def fpl_team_batch():
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body, dict):
+        return jsonify({"message": "ERROR: The body must be a JSON object"}), 400
+    entries = body.get("entries")
+    if not isinstance(entries, list) or not entries:
+        return jsonify({"message": "ERROR: 'entries' must be a list of IDs"}), 400
+    if len(entries) > app.config["BATCH_MAX_ENTRIES"]:
+        return (
+            jsonify(
+                {
+                    "message": "ERROR: At most "
+                    f"{app.config['BATCH_MAX_ENTRIES']} entries per request"
+                }
+            ),
+            400,
+        )
+    try:
+        entries = list(dict.fromkeys(_integer(entry, "entries") for entry in entries))
+        gameweek = body.get("gameweek")
+        if gameweek is None:
+            gameweek = int(current_gameweek())
+        else:
+            gameweek = _integer(gameweek, "gameweek")
+    except ValueError:
+        return jsonify({"message": "ERROR: IDs and gameweek must be integers"}), 400
+    finished = gameweek in finished_gameweeks()
+
+    def fetch(entry):
+        # an entry's failure is reported with the teams rather than failing all
+        try:
+            data = fpl_client.picks(entry, gameweek, finished=finished)
+            return entry, data["picks"], None
+        except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+            return entry, None, str(e)
+
+    picks, errors = [], {}
+    counter = OwnershipCounter()
+    with ThreadPoolExecutor(app.config["BATCH_CONCURRENCY"]) as executor:
+        for entry, entry_picks, error in executor.map(fetch, entries):
+            if error is not None:
+                errors[str(entry)] = error
+            else:
+                picks.append(pd.DataFrame(entry_picks).assign(entry=entry))
+                counter.add(entry_picks)
+
+    teams, ownership = {}, []
+    if picks:
+        all_picks = with_clubs(merge_picks(pd.concat(picks, ignore_index=True)))
+        ownership = league_ownership(counter)
+        with metrics.stage("clean"):
+            all_picks = all_picks.replace({np.nan: None})
+        by_entry = dict(list(all_picks.groupby("entry", sort=False)))
+        for entry in entries:
+            if entry in by_entry:
+                team = by_entry[entry].drop(columns=["entry"])
+                teams[str(entry)] = team.to_dict(orient="records")
+    return {
+        "gameweek": gameweek,
+        "teams": teams,
+        "errors": errors,
+        "ownership": ownership,
+    }
+
+
+def league_ownership(counter):
+    """Share of the counted managers owning, starting and captaining each player"""
+    ownership = counter.summary()[
+        ["element", "owned", "starting", "captain"]
+        + ["ownership", "captaincy", "effective_ownership"]
+    ]
+    ownership = ownership.merge(
+        player_data()[["id", "web_name"]], left_on="element", right_on="id"
+    ).drop(columns=["id"])
+    ownership = ownership.sort_values(
+        "effective_ownership", ascending=False, kind="stable"
     )
-    team_data = team_data.replace({np.nan: None})
-    return {"my_team": team_data.to_dict(orient="records")}
+    return ownership.to_dict(orient="records")
 
 
 @app.route("/api/top250")
 @authorization_required
 def top_FPL_managers():
-    top_team = top_managers_data()
-    top_team = top_team.merge(
-        club_data()[["team_code", "team_id", "team_name", "team_short_name"]],
-        left_on="team",
-        right_on="team_id",
-    )
-    top_team = top_team.replace({np.nan: None})
-    return {"top250": top_team.to_dict(orient="records")}
+    def build():
+        top_team = with_clubs(top_managers_data())
+        return {"top250": records(top_team)}
+
+    sources = [top_managers_data_path(), club_data_path()]
+    return cached_payload("top250", sources, build)
 
 
 @app.route("/api/ai")
 @authorization_required
 def ai_team():
-    ai = ai_team_data()
-    ai = ai.merge(
-        club_data()[["team_code", "team_id", "team_name", "team_short_name"]],
-        left_on="team",
-        right_on="team_id",
-    )
-    ai = ai.replace({np.nan: None})
-    return {"ai": ai.to_dict(orient="records")}
+    def build():
+        ai = with_clubs(ai_team_data())
+        return {"ai": records(ai)}
+
+    return cached_payload("ai", [ai_team_data_path(), club_data_path()], build)
 
 
 @app.route("/api/fpl-challenge")
 @authorization_required
 def fpl_challenge():
-    ai = fpl_challenge_data()
-    ai = ai.merge(
-        club_data()[["team_code", "team_id", "team_name", "team_short_name"]],
-        left_on="team",
-        right_on="team_id",
-    )
-    ai = ai.replace({np.nan: None})
-    return {"ai": ai.to_dict(orient="records")}
+    def build():
+        ai = with_clubs(fpl_challenge_data())
+        return {"ai": records(ai)}
+
+    sources = [fpl_challenge_data_path(), club_data_path()]
+    return cached_payload("fpl-challenge", sources, build)
 
 
 @app.route("/api/players")
 @authorization_required
 def players_api():
-    all_players = player_data()
-    all_players = all_players.merge(
-        club_data()[["team_code", "team_id", "team_name", "team_short_name"]],
-        left_on="team",
-        right_on="team_id",
+    sources = player_sources()
+    # other parameters, like cache busters, keep the full listing
+    args = {key: value for key, value in request.args.items() if key in QUERY_PARAMS}
+    if args:
+        index = current_season().players.get(
+            data_version(sources), lambda: players_frame(sources)
+        )
+        try:
+            return index.query(args)
+        except QueryError as e:
+            return jsonify({"message": f"ERROR: {e}"}), 400
+
+    def build():
+        return {"players": records(players_frame(sources))}
+
+    return cached_payload("players", sources, build)
+
+
+@app.route("/api/players/<int:player_id>/history")
+@authorization_required
+def player_history(player_id: int):
+    history = current_season().history
+    history.refresh()
+    gameweeks, players = history.lookup([player_id])
+    if not players:
+        return jsonify({"message": "ERROR: Player not found"}), 404
+    return {"gameweeks": gameweeks, **players[0]}
+
+
+@app.route("/api/players/history")
+@authorization_required
+def players_history():
+    try:
+        ids = [int(player_id) for player_id in request.args["ids"].split(",")]
+    except (KeyError, ValueError):
+        return jsonify({"message": "ERROR: 'ids' must be a list of player IDs"}), 400
+    history = current_season().history
+    history.refresh()
+    gameweeks, players = history.lookup(ids)
+    return {"gameweeks": gameweeks, "players": players}
+
+
+OPTIMIZE_COLUMNS = ["id", "now_cost", "element_type", "team", "preds", "form"]
+
+
+def optimize_frame():
+    """Columns the optimizer needs, with top_ownership joined in (0 if unowned)"""
+    players = snapshot_cache.load(player_data_path(), columns=OPTIMIZE_COLUMNS)
+    ownership = snapshot_cache.load(
+        top_ownership_data_path(), columns=["id", "top_ownership"]
+    )
+    frame = players.merge(ownership, on="id", how="left")
+    frame["form"] = pd.to_numeric(frame["form"], errors="coerce")
+    return frame.fillna({"form": 0, "top_ownership": 0})
+
+
+def _id_list(body, name):
+    players = body.get(name) or []
+    if not isinstance(players, list):
+        raise ValueError(f"'{name}' must be a list of player IDs")
+    return sorted({_integer(player, name) for player in players})
+
+
+def _composition(body):
+    # a partial composition only overrides the positions it names
+    composition = body.get("composition") or {}
+    if not isinstance(composition, dict):
+        raise ValueError("'composition' must map element_type to a count")
+    merged = dict(SQUAD_COMPOSITION)
+    for element_type, count in composition.items():
+        try:
+            position = int(element_type)
+        except ValueError:
+            position = None
+        if position not in SQUAD_COMPOSITION:
+            raise ValueError(
+                f"Unknown element_type '{element_type}' in 'composition', "
+                f"expected one of {', '.join(map(str, SQUAD_COMPOSITION))}"
+            )
+        if _integer(count, f"composition.{element_type}") < 0:
+            raise ValueError("'composition' counts can't be negative")
+        merged[position] = count
+    return merged
+
+
+def optimize_constraints(body):
+    """Validate an optimize request into a canonical dict of constraints"""
+    if not isinstance(body, dict):
+        raise ValueError("The body must be a JSON object")
+    objective = body.get("objective", "preds")
+    if objective not in app.config["OPTIMIZE_OBJECTIVES"]:
+        raise ValueError(
+            f"'objective' must be one of {', '.join(app.config['OPTIMIZE_OBJECTIVES'])}"
+        )
+    constraints = {
+        "objective": objective,
+        "budget": _integer(body.get("budget", 1000), "budget"),
+        "max_per_team": _integer(body.get("max_per_team", 3), "max_per_team"),
+        "composition": _composition(body),
+        "locked": _id_list(body, "lock"),
+        "excluded": _id_list(body, "exclude"),
+        "lineup": bool(body.get("lineup", True)),
+        "bench_weight": float(body.get("bench_weight", BENCH_WEIGHT)),
+        "captain_multiplier": float(body.get("captain_multiplier", 2)),
+    }
+    if not 0 <= constraints["bench_weight"] <= 1:
+        raise ValueError("'bench_weight' must be between 0 and 1")
+    if constraints["captain_multiplier"] < 1:
+        raise ValueError("'captain_multiplier' can't be below 1")
+    if set(constraints["locked"]) & set(constraints["excluded"]):
+        raise ValueError("A player can't be both locked and excluded")
+    return constraints
+
+
+def solver_key(kind, params, sources):
+    """Cache key of a solve: its canonical parameters plus the data version"""
+    canonical = json.dumps(
+        [kind, current_season().name, params, data_version(sources)], sort_keys=True
+    )
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+def pooled_solve(key, job):
+    """Return the cached result of a solve, running it in the solver pool once
+
+    Identical concurrent requests share one solve, and a solve that finishes
+    after its request stopped waiting still fills the cache.
+
+    Args:
+        key (str) : Cache key from solver_key()
+        job (callable) : Returns (func, args, kwargs) to run in the pool,
+            only called on a cache miss
+
+    Raises SolverBusy, TimeoutError, ValueError or OptimizationError.
+    """
+    result = optimize_results.get(key)
+    if result is not None:
+        return result
+
+    def solve():
+        func, args, kwargs = job()
+        future = solver_pool.submit(func, *args, **kwargs)
+
+        def remember(future):
+            if future.exception() is None:
+                optimize_results.set(key, future.result())
+
+        future.add_done_callback(remember)
+        with metrics.stage("optimize"):
+            return future.result(timeout=app.config["OPTIMIZE_TIMEOUT"])
+
+    return optimize_flight.do(key, solve)
+
+
+SOLVER_ERRORS = (SolverBusy, TimeoutError, ValueError, OptimizationError)
+
+
+def solver_error(e):
+    """Response for one of SOLVER_ERRORS"""
+    if isinstance(e, SolverBusy):
+        response = jsonify({"message": f"ERROR: {e}, try again later"})
+        return response, 503, {"Retry-After": "1"}
+    if isinstance(e, TimeoutError):
+        return jsonify({"message": "ERROR: Optimization timed out"}), 504
+    if isinstance(e, OptimizationError):
+        return jsonify({"message": f"ERROR: {e}"}), 422
+    return jsonify({"message": f"ERROR: {e}"}), 400
+
+
+@app.route("/api/optimize", methods=["POST"])
+@authorization_required
+def optimize():
+    try:
+        constraints = optimize_constraints(request.get_json(silent=True) or {})
+    except (TypeError, ValueError) as e:
+        return jsonify({"message": f"ERROR: {e}"}), 400
+    sources = [player_data_path(), top_ownership_data_path(), club_data_path()]
+
+    def job():
+        frame = optimize_frame()
+        unknown = set(constraints["locked"]) - set(frame["id"])
+        if unknown:
+            raise ValueError(f"Unknown players: {sorted(unknown)}")
+        options = dict(constraints)
+        args = (frame, options.pop("objective"))
+        options.update(
+            time_limit=app.config["OPTIMIZE_TIME_LIMIT"],
+            mip_gap=app.config["OPTIMIZE_MIP_GAP"],
+        )
+        return select_squad_ids, args, options
+
+    try:
+        picks, stats = pooled_solve(solver_key("squad", constraints, sources), job)
+    except SOLVER_ERRORS as e:
+        return solver_error(e)
+    # in pick order, with the lineup columns when the XI was chosen too
+    squad = with_clubs(player_data()).merge(pd.DataFrame(picks), on="id")
+    if constraints["lineup"]:
+        squad = squad.sort_values("position")
+    return {"squad": records(squad), "constraints": constraints, "stats": stats}
+
+
+TRANSFER_PLAYER_COLUMNS = ["id", "web_name", "now_cost", "element_type", "team"]
+
+
+def horizon_xp(players, gameweek, horizon):
+    """Player x gameweek expected points for the gameweeks after `gameweek`
+
+    Read from the horizon snapshot when there is one, otherwise every
+    gameweek repeats the single-gameweek preds.
+    """
+    path = player_horizon_data_path()
+    if os.path.exists(path):
+        columns = [f"xp_gw{gw}" for gw in range(gameweek + 1, gameweek + horizon + 1)]
+        xp = snapshot_cache.load(path)
+        columns = [column for column in columns if column in xp.columns]
+        if columns:
+            xp = players[["id"]].merge(xp, on="id", how="left")[columns]
+            return [int(column[len("xp_gw") :]) for column in columns], (
+                xp.fillna(0).to_numpy(np.float64)
+            )
+    gameweeks = [gw for gw in range(gameweek + 1, gameweek + horizon + 1) if gw <= 38]
+    preds = players["preds"].to_numpy(np.float64)
+    return gameweeks, np.repeat(preds[:, None], len(gameweeks), axis=1)
+
+
+@app.route("/api/fpl/<int:team_id>/transfers")
+@authorization_required
+@current_season_only
+def fpl_transfers(team_id: int):
+    try:
+        horizon = int(request.args.get("horizon", 3))
+        free_transfers = int(request.args.get("free_transfers", 1))
+        max_transfers = request.args.get("max_transfers")
+        max_transfers = None if max_transfers is None else int(max_transfers)
+        # defaults to the bank of the entry's current picks
+        bank = request.args.get("bank")
+        bank = None if bank is None else int(bank)
+    except ValueError:
+        return jsonify({"message": "ERROR: Parameters must be integers"}), 400
+    if not 1 <= horizon <= MAX_HORIZON:
+        return (
+            jsonify({"message": f"ERROR: horizon must be between 1 and {MAX_HORIZON}"}),
+            400,
+        )
+    if not 0 <= free_transfers <= MAX_FREE_TRANSFERS:
+        return (
+            jsonify(
+                {
+                    "message": "ERROR: free_transfers must be between 0 and "
+                    f"{MAX_FREE_TRANSFERS}"
+                }
+            ),
+            400,
+        )
+    if max_transfers is not None and max_transfers < 0:
+        return jsonify({"message": "ERROR: max_transfers can't be negative"}), 400
+    gameweek = int(current_gameweek())
+    try:
+        data = fpl_client.picks(
+            team_id, gameweek, finished=gameweek in finished_gameweeks()
+        )
+        squad = sorted(pick["element"] for pick in data["picks"])
+    except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+        return jsonify({"message": f"ERROR: Couldn't fetch the team: {e}"}), 502
+    bank = (data.get("entry_history") or {}).get("bank", 0) if bank is None else bank
+    params = {
+        "entry": team_id,
+        "gameweek": gameweek,
+        "horizon": horizon,
+        "squad": squad,
+        "bank": bank,
+        "free_transfers": free_transfers,
+        "max_transfers": max_transfers,
+    }
+    sources = player_sources()
+    players = snapshot_cache.load(
+        player_data_path(), columns=TRANSFER_PLAYER_COLUMNS + ["preds"]
     )
-    all_players = all_players.replace({np.nan: None})
-    return {"players": all_players.to_dict(orient="records")}
+    gameweeks, xp = horizon_xp(players, gameweek, horizon)
+    if not gameweeks:
+        return jsonify({"message": "ERROR: No gameweeks left to plan"}), 400
+
+    def job():
+        kwargs = {
+            "free_transfers": free_transfers,
+            "max_transfers": max_transfers,
+            "time_limit": app.config["OPTIMIZE_TIME_LIMIT"],
+            "mip_gap": app.config["OPTIMIZE_MIP_GAP"],
+        }
+        return plan_transfers, (players, xp, squad, bank), kwargs
+
+    try:
+        result = pooled_solve(solver_key("transfers", params, sources), job)
+    except SOLVER_ERRORS as e:
+        return solver_error(e)
+    names = players.set_index("id")[TRANSFER_PLAYER_COLUMNS[1:]]
+
+    def describe(ids):
+        return records(names.loc[ids].reset_index())
+
+    plan = [
+        {
+            **step,
+            "gameweek": gw,
+            "transfers_in": describe(step["transfers_in"]),
+            "transfers_out": describe(step["transfers_out"]),
+        }
+        for gw, step in zip(gameweeks, result["plan"])
+    ]
+    return {"gameweek": gameweek, "plan": plan, "stats": result["stats"]}
 
 
 @app.route("/api/gameweek_number")
@@ -291,6 +884,196 @@ def gameweek_number():
     return f"{gameweek}"
 
 
+@app.route("/healthz")
+def healthz():
+    return {"status": "ok"}
+
+
+@app.route("/readyz")
+def readyz():
+    try:
+        data_version([player_data_path(), club_data_path(), fixtures_data_path()])
+    except FileNotFoundError as e:
+        return {"status": "unavailable", "reason": str(e)}, 503
+    return {
+        "status": "ok",
+        "gameweek": int(current_gameweek()),
+        "season": current_season().name,
+        "version": current_season().snapshots.version,
+    }
+
+
+def warm_up(directory=None, season=None):
+    """Load and pre-render everything served for the current gameweek
+
+    Run once in the gunicorn master before it forks (see wsgi.py), so all
+    workers share these frames and payloads instead of each building them,
+    and for every newly published snapshot version before switching to it.
+
+    Args:
+        directory (str) : Snapshot version to warm up, the current one if None
+        season (Season) : Season the version belongs to, the default if None
+    """
+    season = season or seasons.get()
+    season.history.refresh(directory)
+    with app.test_request_context():
+        g.season = season
+        if directory is not None:
+            g.data_directory = directory
+        for view in (
+            players_api,
+            fixtures_api,
+            top_FPL_managers,
+            ai_team,
+            fpl_challenge,
+        ):
+            try:
+                view.__wrapped__()
+            except FileNotFoundError as e:
+                print(f"Skipped warming up {view.__name__}: {e}")
+        sources = player_sources()
+        season.players.get(data_version(sources), lambda: players_frame(sources))
+        snapshot_cache.derive(
+            player_data_path(), _team_pick_players, columns=TEAM_PICK_COLUMNS
+        )
+        finished_gameweeks()
+
+
+def watch_snapshots(on_switch=None):
+    """Follow newly published snapshot versions in background threads
+
+    One per loaded season. Under gunicorn this runs in the master only (see
+    when_ready in gunicorn.conf.py): the master warms the new version once
+    and `on_switch` then replaces the workers, which fork from it and share
+    its frames and payloads again. Requests already running finish on the
+    version they started with.
+
+    Args:
+        on_switch (callable) : Called after each switch, once the previous
+            version's frames are dropped
+    """
+    interval = app.config["SNAPSHOT_POLL_INTERVAL"]
+
+    def retire(previous):
+        snapshot_cache.evict(previous)
+        if on_switch is not None:
+            on_switch()
+
+    if interval:
+        seasons.watch(interval, prepare=warm_up, retire=retire)
+
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+    metrics.start_request_timings()
+    try:
+        data_directory()
+    except UnknownSeason as e:
+        return jsonify({"message": f"ERROR: {e}"}), 404
+
+
+@app.after_request
+def record_request(response):
+    elapsed = time.perf_counter() - g.get("request_start", time.perf_counter())
+    stages = metrics.finish_request_timings()
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.request_seconds.observe(
+        elapsed, route, request.method, str(response.status_code)
+    )
+    if not response.is_streamed:
+        metrics.response_bytes.inc(route, amount=response.content_length or 0)
+    if app.config["SERVER_TIMING"]:
+        response.headers["Server-Timing"] = ", ".join(
+            [f"{name};dur={seconds * 1000:.2f}" for name, seconds in stages]
+            + [f"total;dur={elapsed * 1000:.2f}"]
+        )
+    # only requests for other seasons can grow them past their budget
+    if g.get("season") is not None and g.season.name != seasons.default:
+        seasons.trim()
+    return response
+
+
+metrics.registry.register(
+    metrics.Gauge(
+        "fplmstr_snapshot_cache",
+        "Snapshot cache hits, misses and entries",
+        lambda: {(key,): value for key, value in snapshot_cache.stats().items()},
+        ("kind",),
+    )
+)
+metrics.registry.register(
+    metrics.Gauge(
+        "fplmstr_upstream_calls",
+        "Calls made to the FPL API and how many failed",
+        lambda: {("calls",): fpl_client.calls, ("errors",): fpl_client.errors},
+        ("kind",),
+    )
+)
+metrics.registry.register(
+    metrics.Gauge(
+        "fplmstr_optimize_jobs",
+        "Optimizations running or queued, and results cached",
+        lambda: {
+            ("pending",): solver_pool.pending,
+            ("cached",): len(optimize_results),
+        },
+        ("state",),
+    )
+)
+metrics.registry.register(
+    metrics.Gauge(
+        "fplmstr_snapshot_switches",
+        "Snapshot versions switched to since the worker started",
+        lambda: {(): sum(season.snapshots.switches for season in seasons.loaded())},
+    )
+)
+metrics.registry.register(
+    metrics.Gauge(
+        "fplmstr_season_bytes",
+        "Memory held by each loaded season's frames and payloads",
+        lambda: {(season.name,): season.nbytes() for season in seasons.loaded()},
+        ("season",),
+    )
+)
+metrics.registry.register(
+    metrics.Gauge(
+        "fplmstr_season_loads",
+        "Seasons loaded and evicted since the worker started",
+        lambda: {("loads",): seasons.loads, ("evictions",): seasons.evictions},
+        ("kind",),
+    )
+)
+metrics.registry.register(
+    metrics.Gauge(
+        "fplmstr_picks_cache_entries",
+        "Picks held in the upstream cache",
+        lambda: {(): len(fpl_client.picks_cache)},
+    )
+)
+
+
+def metrics_api():
+    return app.response_class(
+        metrics.registry.render(), mimetype="text/plain; version=0.0.4"
+    )
+
+
+if app.config["METRICS_DIRECTORY"]:
+    metrics.registry.share(app.config["METRICS_DIRECTORY"])
+if app.config["METRICS_PATH"]:
+    app.add_url_rule(
+        app.config["METRICS_PATH"],
+        "metrics_api",
+        (
+            authorization_required(metrics_api)
+            if app.config["METRICS_AUTH_REQUIRED"]
+            else metrics_api
+        ),
+    )
+
+
 if __name__ == "__main__":
+    watch_snapshots()
     # serve(app, port="8000")
     app.run(host="0.0.0.0", port=5000)
@@ -0,0 +1,281 @@
+"""HTTP benchmarks for the API endpoints
+
+Runs every endpoint against the checked-in data2425 snapshots, either
+in-process through Flask's test client or over HTTP against a threaded WSGI
+server, and reports throughput, p50/p95/p99 latency and peak RSS per
+endpoint and concurrency level. Upstream FPL calls go to a local stub.
+
+    python bench/run.py --output bench/results.json
+    python bench/run.py --mode wsgi --compare bench/results.json
+
+Run it from the repository root, the app resolves data2425 relative to the
+working directory.
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+API_KEY = "bench"
+
+ENDPOINTS = {
+    "players": ("GET", "/api/players", None),
+    "players_query": (
+        "GET",
+        "/api/players?fields=id,web_name,now_cost,preds&element_type=3"
+        "&sort=-preds&limit=50",
+        None,
+    ),
+    "fixtures": ("GET", "/api/fixtures", None),
+    "top250": ("GET", "/api/top250", None),
+    "ai": ("GET", "/api/ai", None),
+    "fpl_challenge": ("GET", "/api/fpl-challenge", None),
+    "gameweek_number": ("GET", "/api/gameweek_number", None),
+    "fpl_team": ("GET", "/api/fpl/{entry}", None),
+    "fpl_batch": ("POST", "/api/fpl/batch", "batch"),
+    "player_history": ("GET", "/api/players/1/history", None),
+}
+
+
+def _prepare_app():
+    """Import the app with its upstream client pointed at a local stub"""
+    import app as app_module
+    from bench import stub_fpl
+
+    # stub squads are drawn from the players the app serves, so they all merge
+    players = app_module.player_data()[["id", "element_type"]]
+    server = stub_fpl.serve(stub_fpl.StandIn(players=players))
+    app_module.fpl_client.base_url = f"http://127.0.0.1:{server.server_port}/api"
+    app_module.fpl_client.limiter = None
+    return app_module.app
+
+
+# entry IDs handed out across warmup and every concurrency level of a run,
+# so no request finds its picks already cached by an earlier one
+_entries = itertools.count(1)
+
+
+def _request_args(endpoint):
+    method, path, body = ENDPOINTS[endpoint]
+    if "{entry}" in path:
+        path = path.format(entry=next(_entries))
+    if body == "batch":
+        body = {"entries": [next(_entries) for _ in range(50)]}
+    return method, path, body
+
+
+def _measure(send, endpoint, concurrency, requests, warmup):
+    for i in range(warmup):
+        send(*_request_args(endpoint))
+    latencies = np.empty(requests)
+    errors = 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        start = time.perf_counter()
+        status = send(*_request_args(endpoint))
+        latencies[i] = time.perf_counter() - start
+        if status >= 400:
+            with lock:
+                errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(one, range(requests)))
+    elapsed = time.perf_counter() - start
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round(requests / elapsed, 2),
+        "p50_ms": round(p50, 3),
+        "p95_ms": round(p95, 3),
+        "p99_ms": round(p99, 3),
+    }
+
+
+def _inprocess_worker(endpoint, levels, requests, warmup, queue):
+    os.environ["Authorization"] = API_KEY
+    client = _prepare_app().test_client()
+    headers = {"Authorization": API_KEY, "Accept-Encoding": "gzip"}
+
+    def send(method, path, body):
+        return client.open(path, method=method, json=body, headers=headers).status_code
+
+    results = [_measure(send, endpoint, c, requests, warmup) for c in levels]
+    # ru_maxrss is in KiB on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    for result in results:
+        result["peak_rss_mb"] = round(peak, 1)
+    queue.put(results)
+
+
+def _wsgi_server(port, ready):
+    os.environ["Authorization"] = API_KEY
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    server = make_server("127.0.0.1", port, _prepare_app(), threaded=True)
+    ready.set()
+    server.serve_forever()
+
+
+def _peak_rss_mb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return round(int(line.split()[1]) / 1024, 1)
+    return None
+
+
+def _wsgi_worker(endpoint, levels, requests, warmup, queue, port=8765):
+    import requests as http
+
+    context = multiprocessing.get_context("fork")
+    ready = context.Event()
+    server = context.Process(target=_wsgi_server, args=(port, ready), daemon=True)
+    server.start()
+    ready.wait(60)
+    time.sleep(0.2)
+    session = http.Session()
+    adapter = http.adapters.HTTPAdapter(pool_maxsize=max(levels))
+    session.mount("http://", adapter)
+    headers = {"Authorization": API_KEY, "Accept-Encoding": "gzip"}
+
+    def send(method, path, body):
+        response = session.request(
+            method, f"http://127.0.0.1:{port}{path}", json=body, headers=headers
+        )
+        return response.status_code
+
+    try:
+        results = [_measure(send, endpoint, c, requests, warmup) for c in levels]
+        peak = _peak_rss_mb(server.pid)
+        for result in results:
+            result["peak_rss_mb"] = peak
+    finally:
+        server.terminate()
+        server.join()
+    queue.put(results)
+
+
+def run(endpoints, levels, requests, warmup, mode):
+    """Benchmark each endpoint in a fresh process so peak RSS is per endpoint"""
+    context = multiprocessing.get_context("fork")
+    worker = _inprocess_worker if mode == "inprocess" else _wsgi_worker
+    results = []
+    for endpoint in endpoints:
+        queue = context.Queue()
+        process = context.Process(
+            target=worker, args=(endpoint, levels, requests, warmup, queue)
+        )
+        process.start()
+        endpoint_results = queue.get()
+        process.join()
+        for result in endpoint_results:
+            print(
+                f"{result['endpoint']:>16} c={result['concurrency']:<3} "
+                f"{result['throughput_rps']:>9.1f} req/s  "
+                f"p50 {result['p50_ms']:>8.2f}ms  p95 {result['p95_ms']:>8.2f}ms  "
+                f"p99 {result['p99_ms']:>8.2f}ms  rss {result['peak_rss_mb']}MB  "
+                f"errors {result['errors']}",
+                flush=True,
+            )
+        results += endpoint_results
+    return {
+        "meta": {
+            "mode": mode,
+            "requests": requests,
+            "warmup": warmup,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "timestamp": time.time(),
+        },
+        "results": results,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Return the regressions of report against baseline
+
+    A result regresses when its throughput drops, or its p95 latency grows,
+    by more than `tolerance` (a fraction) relative to the baseline.
+    """
+    previous = {
+        (result["endpoint"], result["concurrency"]): result
+        for result in baseline["results"]
+    }
+    regressions = []
+    for result in report["results"]:
+        base = previous.get((result["endpoint"], result["concurrency"]))
+        if base is None:
+            continue
+        if result["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{result['endpoint']} c={result['concurrency']}: throughput "
+                f"{base['throughput_rps']} -> {result['throughput_rps']} req/s"
+            )
+        if result["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{result['endpoint']} c={result['concurrency']}: p95 "
+                f"{base['p95_ms']} -> {result['p95_ms']} ms"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=["inprocess", "wsgi"], default="inprocess")
+    parser.add_argument(
+        "--endpoints", default=",".join(ENDPOINTS), help="comma separated names"
+    )
+    parser.add_argument("--concurrency", default="1,4,16")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--compare", help="baseline JSON report to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+
+    endpoints = args.endpoints.split(",")
+    unknown = [endpoint for endpoint in endpoints if endpoint not in ENDPOINTS]
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(unknown)}")
+    levels = [int(level) for level in args.concurrency.split(",")]
+    report = run(endpoints, levels, args.requests, args.warmup, args.mode)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["meta"]["mode"] != args.mode:
+            parser.error(f"baseline was recorded in {baseline['meta']['mode']} mode")
+        regressions = compare(report, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""Offline end-to-end benchmark of the fetch_data.py pipeline
+
+Runs fetch_data.main() in a scratch copy of the published data2425
+snapshot version, with every upstream request answered by the stand-in
+server of bench/stub_fpl.py, and reports the wall time and the status,
+attempts and seconds of each stage per run. The first run starts without
+pipeline state, so every stage runs; later runs show what the incremental
+fetch skips.
+
+    python bench/run_pipeline.py --managers 10000 --samples 250,10000
+    python bench/run_pipeline.py --latency 0.05 --error-rate 0.02 --runs 2
+
+Run it from the repository root.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# the state and report of earlier runs aren't copied, so the first run is a
+# full one
+SKIPPED_FILES = {"pipeline_state.json", "pipeline_report.json", "current.json"}
+
+
+def _link_or_copy(source, target):
+    # snapshots are only ever replaced through a rename, so links are safe
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def prepare_workdir(workdir, data=os.path.join(ROOT, "data2425")):
+    """Lay out a working directory fetch_data.py can run in
+
+    The published snapshot version of `data` becomes the flat data2425 of
+    the working directory and the models are linked in.
+    """
+    import storage
+
+    source = storage.current_directory(data)
+    target = os.path.join(workdir, "data2425")
+    os.makedirs(target)
+    for file in os.listdir(source):
+        path = os.path.join(source, file)
+        if file not in SKIPPED_FILES and os.path.isfile(path):
+            _link_or_copy(path, os.path.join(target, file))
+    os.symlink(os.path.join(ROOT, "models"), os.path.join(workdir, "models"))
+
+
+def run(args, stand_in, base_url):
+    """Run the pipeline args.runs times, return the report of each run"""
+    # fetch_data and upstream read the URLs and the data paths on import
+    os.environ["FPL_BASE_URL"] = f"{base_url}/api"
+    os.environ["FPL_DATA_URL"] = f"{base_url}/data"
+    os.chdir(args.workdir)
+    import crawler
+    import fetch_data
+    from pipeline import load_report
+
+    crawler.CRAWL_RATE_LIMIT = args.rate_limit
+    argv = [
+        "--samples",
+        ",".join(map(str, args.samples)),
+        "--crawl-workers",
+        str(args.crawl_workers),
+    ]
+    if args.force:
+        argv.append("--force")
+    runs = []
+    for number in range(1, args.runs + 1):
+        # a new process would request and load everything again
+        fetch_data.upstream_cache.forget()
+        fetch_data.resources.reset("game_data")
+        before = stand_in.stats()
+        start = time.perf_counter()
+        try:
+            fetch_data.main(argv)
+            published = True
+        except SystemExit:
+            published = False
+        seconds = time.perf_counter() - start
+        after = stand_in.stats()
+        report = load_report(fetch_data.data_root)
+        runs.append(
+            {
+                "run": number,
+                "published": published,
+                "seconds": round(seconds, 3),
+                "stages": report.get("stages", {}),
+                "upstream_requests": {
+                    route: count - before["requests"].get(route, 0)
+                    for route, count in after["requests"].items()
+                },
+                "throttled": after["throttled"] - before["throttled"],
+            }
+        )
+    return runs
+
+
+def print_run(result):
+    print(
+        f"\nRun {result['run']}: {result['seconds']:.2f}s, "
+        f"{'published' if result['published'] else 'NOT published'}, "
+        f"upstream {result['upstream_requests']}, "
+        f"{result['throttled']} throttled"
+    )
+    for name, stage in result["stages"].items():
+        print(
+            f"{name:>24} {stage['status']:<8} attempts {stage.get('attempts', 0)} "
+            f"{stage.get('seconds', 0):>9.3f}s"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data", default=os.path.join(ROOT, "data2425"))
+    parser.add_argument(
+        "--workdir", help="kept after the run, a temporary one is used if unset"
+    )
+    parser.add_argument("--runs", type=int, default=2)
+    parser.add_argument(
+        "--force", action="store_true", help="pass --force to every run"
+    )
+    parser.add_argument("--managers", type=int, default=10_000)
+    parser.add_argument(
+        "--samples", default="250", help="comma separated top manager sample sizes"
+    )
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--recorded", help="responses recorded by bench/stub_fpl.py")
+    parser.add_argument(
+        "--rate-limit", type=float, default=500, help="crawler requests per second"
+    )
+    parser.add_argument("--crawl-workers", type=int, default=32)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+    args.samples = [int(size) for size in args.samples.split(",")]
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    from bench import stub_fpl
+
+    keep = args.workdir is not None
+    args.workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="fplmstr-"))
+    prepare_workdir(args.workdir, args.data)
+    stand_in = stub_fpl.StandIn(
+        args.data,
+        managers=args.managers,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        recorded=args.recorded,
+    )
+    server = stub_fpl.serve(stand_in)
+    try:
+        runs = run(args, stand_in, f"http://127.0.0.1:{server.server_port}")
+    finally:
+        server.shutdown()
+        os.chdir(ROOT)
+        if not keep:
+            shutil.rmtree(args.workdir, ignore_errors=True)
+    for result in runs:
+        print_run(result)
+    if args.output:
+        report = {
+            "meta": {
+                "managers": args.managers,
+                "samples": args.samples,
+                "latency": args.latency,
+                "jitter": args.jitter,
+                "error_rate": args.error_rate,
+                "rate_limit": args.rate_limit,
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "timestamp": time.time(),
+            },
+            "runs": runs,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,439 @@
+"""Offline stand-in for the FPL API and the vaastav season CSVs
+
+Serves everything fetch_data.py and the app request upstream, built from
+the data2425 snapshots or from responses recorded off the live endpoints:
+
+    /api/bootstrap-static/
+    /api/entry/{entry_id}/event/{gameweek}/picks/
+    /api/leagues-classic/{league_id}/standings/?page_standings={page}
+    /data/{season}/teams.csv
+    /data/{season}/fixtures.csv
+
+Point the pipeline at it with FPL_BASE_URL=http://host:port/api and
+FPL_DATA_URL=http://host:port/data. Run it from the repository root:
+
+    python bench/stub_fpl.py --port 8090 --managers 10000 --latency 0.05
+    python bench/stub_fpl.py record bench/recorded --entries 1,2,3
+    python bench/stub_fpl.py --recorded bench/recorded
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import storage  # noqa: E402
+
+STANDINGS_PAGE_SIZE = 50
+# columns of the vaastav fixtures.csv that survive get_fixtures_data's merge
+# with the clubs unsuffixed
+FIXTURE_COLUMNS = [
+    "code",
+    "event",
+    "finished",
+    "finished_provisional",
+    "id",
+    "kickoff_time",
+    "minutes",
+    "provisional_start_time",
+    "started",
+    "team_a",
+    "team_a_difficulty",
+    "team_a_score",
+    "team_h",
+    "team_h_difficulty",
+    "team_h_score",
+    "stats",
+]
+ELEMENT_TYPES = [
+    {"id": element_type, "singular_name_short": short, "squad_select": select}
+    for element_type, short, select in (
+        (1, "GKP", 2),
+        (2, "DEF", 5),
+        (3, "MID", 5),
+        (4, "FWD", 3),
+    )
+]
+CLUB_COLUMNS = {
+    "team_id": "id",
+    "team_code": "code",
+    "team_name": "name",
+    "team_short_name": "short_name",
+}
+
+
+def synthetic_picks(entry_id, players):
+    """Deterministic 15-man squad for an entry, drawn from the player frame
+
+    Args:
+        entry_id (int) : Seed for the squad
+        players (DataFrame) : Player snapshot with id and element_type
+    """
+    rng = random.Random(entry_id)
+    squad = []
+    for element_type, count in ((1, 2), (2, 5), (3, 5), (4, 3)):
+        ids = players.loc[players["element_type"] == element_type, "id"].tolist()
+        squad += [(element_id, element_type) for element_id in rng.sample(ids, count)]
+    # 1 GK, 4 DEF, 4 MID, 2 FWD start, the rest is the bench
+    starters = [0, 2, 3, 4, 5, 7, 8, 9, 10, 12, 13]
+    order = starters + [i for i in range(15) if i not in starters]
+    picks = []
+    for position, index in enumerate(order, start=1):
+        element_id, element_type = squad[index]
+        picks.append(
+            {
+                "element": int(element_id),
+                "position": position,
+                "multiplier": (2 if position == 1 else 1) if position <= 11 else 0,
+                "is_captain": position == 1,
+                "is_vice_captain": position == 2,
+                "element_type": element_type,
+            }
+        )
+    return {"picks": picks}
+
+
+def synthetic_standings(league_id, page, managers):
+    """One 50-entry page of a classic league of `managers` ranked entries
+
+    The entry at rank r has ID r, so synthetic_picks gives every ranked
+    manager a stable squad.
+    """
+    first = (page - 1) * STANDINGS_PAGE_SIZE + 1
+    last = min(managers, first + STANDINGS_PAGE_SIZE - 1)
+    results = [
+        {
+            "id": rank,
+            "entry": rank,
+            "rank": rank,
+            "last_rank": rank,
+            "rank_sort": rank,
+            "entry_name": f"Entry {rank}",
+            "player_name": f"Manager {rank}",
+            "total": max(0, 3000 - rank // 10),
+            "event_total": 50 + rank % 60,
+        }
+        for rank in range(first, last + 1)
+    ]
+    return {
+        "league": {"id": league_id, "name": f"League {league_id}"},
+        "standings": {"has_next": last < managers, "page": page, "results": results},
+    }
+
+
+def recorded_path(path, query=""):
+    """Where the body of a GET of path?query is kept in a recording"""
+    key = path.strip("/")
+    if query:
+        key += "/" + query.replace("&", "_").replace("=", "-")
+    return os.path.join(key, "body")
+
+
+def _records(df):
+    # to_json turns NaN into null and numpy scalars into plain numbers
+    return json.loads(df.to_json(orient="records", date_format="iso"))
+
+
+class StandIn:
+    """Responses of the stand-in server, with its fault and scale settings
+
+    Bodies are built once from the published snapshots of `directory`. A
+    body recorded at the same path under `recorded` (see record()) is served
+    instead, so live responses can be replayed as they were.
+
+    Args:
+        directory (str) : Data directory the snapshots are read from
+        players (DataFrame) : Player frame squads are drawn from, read from
+            the current gameweek's snapshot when None
+        managers (int) : Ranked entries in every classic league
+        latency (float) : Seconds added to every response
+        jitter (float) : Up to this many more seconds, drawn uniformly
+        error_rate (float) : Fraction of requests answered with a 429
+        retry_after (float) : Retry-After sent with the 429s
+        recorded (str) : Directory of recorded response bodies
+        seed (int) : Seed of the latency jitter and the injected 429s
+    """
+
+    def __init__(
+        self,
+        directory=os.path.join(ROOT, "data2425"),
+        players=None,
+        managers=10_000,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        retry_after=0.1,
+        recorded=None,
+        seed=0,
+    ):
+        self.directory = storage.current_directory(directory)
+        self.managers = managers
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.recorded = recorded
+        self.requests = {}
+        self.throttled = 0
+        self._players = players
+        self._bodies = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _frame(self, name, columns=None):
+        return storage.read_frame(self.directory, name, columns)
+
+    def _gameweek(self):
+        events = self._frame("get_gameweek_data")
+        current = events[events["is_current"]]
+        if len(current):
+            return int(current.iloc[-1]["id"])
+        return int(events[events["is_next"]].iloc[-1]["id"]) - 1
+
+    def _player_frame(self):
+        gameweek = self._gameweek()
+        # the latest gameweek with a player snapshot, the current one may not
+        # have been fetched
+        while gameweek > 0 and not os.path.exists(
+            storage.resolve(self.directory, f"get_player_data_gw{gameweek}")
+        ):
+            gameweek -= 1
+        return self._frame(f"get_player_data_gw{gameweek}")
+
+    @property
+    def players(self):
+        if self._players is None:
+            self._players = self._player_frame()[["id", "element_type"]]
+        return self._players
+
+    def bootstrap(self):
+        """bootstrap-static as FPL serves it, without the predictions"""
+        elements = self._player_frame().drop(columns=["preds"], errors="ignore")
+        elements["photo"] = elements["photo"].str.replace(".png", ".jpg", regex=False)
+        clubs = self._frame("get_club_data").rename(columns=CLUB_COLUMNS)
+        return {
+            "events": _records(self._frame("get_gameweek_data")),
+            "teams": _records(clubs),
+            "elements": _records(elements),
+            "element_types": ELEMENT_TYPES,
+            "total_players": self.managers,
+        }
+
+    def teams_csv(self):
+        clubs = self._frame("get_club_data").rename(columns=CLUB_COLUMNS)
+        return clubs.to_csv(index=False)
+
+    def fixtures_csv(self):
+        fixtures = self._frame("get_fixtures_data")
+        columns = [column for column in FIXTURE_COLUMNS if column in fixtures]
+        return fixtures[columns].to_csv(index=False)
+
+    def _static(self, key, build, content_type):
+        # static bodies are rendered once and served with a strong ETag, so
+        # the pipeline's conditional GETs get 304s like they would upstream
+        with self._lock:
+            body = self._bodies.get(key)
+        if body is None:
+            content = build()
+            if not isinstance(content, str):
+                content = json.dumps(content)
+            content = content.encode()
+            body = (content, f'"{hashlib.sha1(content).hexdigest()}"', content_type)
+            with self._lock:
+                self._bodies[key] = body
+        return body
+
+    def _recorded(self, path, query):
+        if self.recorded is None:
+            return None
+        file = os.path.join(self.recorded, recorded_path(path, query))
+        if not os.path.exists(file):
+            return None
+        with open(file, "rb") as f:
+            content = f.read()
+        content_type = "text/csv" if path.endswith(".csv") else "application/json"
+        return content, f'"{hashlib.sha1(content).hexdigest()}"', content_type
+
+    def _route(self, path, query):
+        parts = path.strip("/").split("/")
+        if parts[0] == "api" and parts[1:] == ["bootstrap-static"]:
+            return "bootstrap", self._static(
+                "bootstrap", self.bootstrap, "application/json"
+            )
+        # /api/entry/{entry_id}/event/{gameweek}/picks
+        if len(parts) == 6 and parts[1] == "entry" and parts[5] == "picks":
+            content = json.dumps(synthetic_picks(int(parts[2]), self.players))
+            return "picks", (content.encode(), None, "application/json")
+        # /api/leagues-classic/{league_id}/standings
+        if len(parts) == 4 and parts[1:4:2] == ["leagues-classic", "standings"]:
+            page = int(query.get("page_standings", ["1"])[0])
+            standings = synthetic_standings(int(parts[2]), page, self.managers)
+            content = json.dumps(standings).encode()
+            return "standings", (content, None, "application/json")
+        # /data/{season}/teams.csv, the snapshots hold a single season
+        if len(parts) == 3 and parts[0] == "data" and parts[2] == "teams.csv":
+            return "teams_csv", self._static("teams", self.teams_csv, "text/csv")
+        if len(parts) == 3 and parts[0] == "data" and parts[2] == "fixtures.csv":
+            return "fixtures_csv", self._static(
+                "fixtures", self.fixtures_csv, "text/csv"
+            )
+        return "unknown", None
+
+    def respond(self, path, headers):
+        """Return the status, headers and body of a GET of `path`"""
+        url = urlsplit(path)
+        route, body = self._route(url.path, parse_qs(url.query))
+        recorded = self._recorded(url.path, url.query)
+        if recorded is not None:
+            body = recorded
+        with self._lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+            delay = self.latency + self._rng.uniform(0, self.jitter)
+            throttle = self._rng.random() < self.error_rate
+            if throttle:
+                self.throttled += 1
+        if delay:
+            time.sleep(delay)
+        if body is None:
+            return 404, {}, b""
+        if throttle:
+            return 429, {"Retry-After": str(self.retry_after)}, b""
+        content, etag, content_type = body
+        response_headers = {"Content-Type": content_type}
+        if etag is not None:
+            response_headers["ETag"] = etag
+            if headers.get("If-None-Match") == etag:
+                return 304, response_headers, b""
+        return 200, response_headers, content
+
+    def stats(self):
+        with self._lock:
+            return {"requests": dict(self.requests), "throttled": self.throttled}
+
+
+def serve(stand_in, host="127.0.0.1", port=0):
+    """Start the stand-in server in a background thread
+
+    Returns the running server, its base URLs are
+    http://{host}:{server.server_port}/api and .../data
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            status, headers, content = stand_in.respond(self.path, self.headers)
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def record(directory, entries=(), league_id=314, pages=1, gameweek=None):
+    """Save live responses under `directory` for StandIn(recorded=...) to replay
+
+    Args:
+        directory (str) : Where the bodies are written, one per URL
+        entries (list) : Entry IDs whose picks are recorded too
+        league_id (int) : Classic league whose standings are recorded
+        pages (int) : Standings pages to record, later ones are synthesized
+        gameweek (int) : Gameweek of the recorded picks, the current one if None
+    """
+    import requests
+
+    from upstream import FPL_BASE_URL, FPL_DATA_URL
+
+    def save(path, url, query=""):
+        response = requests.get(f"{url}?{query}" if query else url, timeout=(3.05, 30))
+        response.raise_for_status()
+        file = os.path.join(directory, recorded_path(path, query))
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        with open(file, "wb") as f:
+            f.write(response.content)
+        print(f"Recorded {response.url} ({len(response.content)} bytes)")
+        return response
+
+    game_data = save("api/bootstrap-static/", f"{FPL_BASE_URL}/bootstrap-static/")
+    if gameweek is None:
+        gameweek = max(
+            [event["id"] for event in game_data.json()["events"] if event["is_current"]]
+            or [0]
+        )
+    for name in ("teams.csv", "fixtures.csv"):
+        season = storage.CURRENT_SEASON
+        save(f"data/{season}/{name}", f"{FPL_DATA_URL}/{season}/{name}")
+    for page in range(1, pages + 1):
+        save(
+            f"api/leagues-classic/{league_id}/standings/",
+            f"{FPL_BASE_URL}/leagues-classic/{league_id}/standings/",
+            f"page_standings={page}",
+        )
+    for entry in entries:
+        save(
+            f"api/entry/{entry}/event/{gameweek}/picks/",
+            f"{FPL_BASE_URL}/entry/{entry}/event/{gameweek}/picks/",
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command")
+    recorder = commands.add_parser("record", help="save live responses to replay")
+    recorder.add_argument("directory")
+    recorder.add_argument("--entries", default="", help="comma separated entry IDs")
+    recorder.add_argument("--league", type=int, default=314)
+    recorder.add_argument("--pages", type=int, default=1)
+    recorder.add_argument("--gameweek", type=int)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--data", default=os.path.join(ROOT, "data2425"))
+    parser.add_argument("--managers", type=int, default=10_000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--recorded", help="directory written by the record command")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        entries = [int(entry) for entry in args.entries.split(",") if entry]
+        record(args.directory, entries, args.league, args.pages, args.gameweek)
+        return
+    stand_in = StandIn(
+        args.data,
+        managers=args.managers,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        recorded=args.recorded,
+    )
+    server = serve(stand_in, args.host, args.port)
+    base = f"http://{args.host}:{server.server_port}"
+    print(f"FPL_BASE_URL={base}/api FPL_DATA_URL={base}/data")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        print(json.dumps(stand_in.stats()))
+
+
+if __name__ == "__main__":
+    main()
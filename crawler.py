@@ -0,0 +1,237 @@
+import json
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+from ownership import OwnershipCounter, pick_rows
+from upstream import FPLClient
+
+# FPL doesn't publish its rate limits, so stay conservative; the client backs
+# off and retries when a 429 comes back anyway.
+CRAWL_RATE_LIMIT = 8
+CRAWL_WORKERS = 8
+CRAWL_RETRIES = 5
+# consecutive failed entries after which a crawl is treated as banned
+CRAWL_MAX_FAILURES = 50
+STANDINGS_PAGE_SIZE = 50
+CHECKPOINT_DIRECTORY = "crawl_checkpoints"
+
+
+class CrawlAborted(Exception):
+    """Too many entries failed in a row, the crawl stopped early"""
+
+
+def crawl_client(workers=None):
+    """FPL client tuned for bulk crawls: rate limited and retrying
+
+    Args:
+        workers (int) : Requests in flight at once, defaults to CRAWL_WORKERS
+    """
+    return FPLClient(
+        pool_size=workers or CRAWL_WORKERS,
+        rate_limit=CRAWL_RATE_LIMIT,
+        retries=CRAWL_RETRIES,
+        timeout=(3.05, 20),
+    )
+
+
+def league_entries(client, league_id, pages, workers=None):
+    """Return the entry IDs on the first pages of a classic league, by rank
+
+    Args:
+        client (FPLClient) : Client used for the standings requests
+        league_id (int) : ID of the classic league, 314 is the overall league
+        pages (int) : Number of 50-entry standings pages to read
+        workers (int) : Pages requested at once, defaults to CRAWL_WORKERS
+    """
+
+    def page(number):
+        data = client.get_json(
+            f"leagues-classic/{league_id}/standings/",
+            params={"page_standings": number},
+        )
+        return data["standings"]["results"]
+
+    with ThreadPoolExecutor(min(pages, workers or CRAWL_WORKERS)) as executor:
+        results = list(executor.map(page, range(1, pages + 1)))
+    return [manager["entry"] for managers in results for manager in managers]
+
+
+def crawl_picks(
+    client,
+    entries,
+    gameweek,
+    workers=None,
+    progress=None,
+    max_failures=None,
+):
+    """Fetch the picks of many entries concurrently
+
+    Yields (entry_id, picks) pairs in completion order. Entries that still
+    fail after the client's retries are reported and skipped.
+
+    Args:
+        client (FPLClient) : Client used for the picks requests
+        entries (list) : Entry IDs to fetch
+        gameweek (int) : Specific gameweek
+        workers (int) : Number of requests in flight at once, defaults to
+            CRAWL_WORKERS
+        progress (callable) : Called with the number of entries done so far
+        max_failures (int) : Raise CrawlAborted after this many failures in a
+            row instead of working through the rest while rate limited
+    """
+    done = 0
+    failures = 0
+    with ThreadPoolExecutor(workers or CRAWL_WORKERS) as executor:
+        futures = {
+            executor.submit(
+                client.get_json, f"entry/{entry}/event/{gameweek}/picks/"
+            ): entry
+            for entry in entries
+        }
+        for future in as_completed(futures):
+            entry = futures[future]
+            done += 1
+            if progress is not None:
+                progress(done)
+            try:
+                data = future.result()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                print(f"\nSkipping entry {entry}: {e}")
+                failures += 1
+                if max_failures is not None and failures >= max_failures:
+                    for pending in futures:
+                        pending.cancel()
+                    raise CrawlAborted(
+                        f"{failures} entries failed in a row, last was {entry}"
+                    ) from e
+                continue
+            failures = 0
+            yield entry, data["picks"]
+
+
+class Checkpoint:
+    """Append-only JSON lines record of a crawl, so it can resume
+
+    The first line holds the ranked entry IDs of the sample, every later line
+    one crawled squad as {"entry": ..., "rows": pick_rows(picks)}. Lines are
+    flushed as they are written, so a crash loses at most the squad in flight.
+
+    Args:
+        path (str) : File the checkpoint is kept in
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def load(self):
+        """Return (entries, {entry: rows}) or (None, {}) when there is none"""
+        entries, done = None, {}
+        if not os.path.exists(self.path):
+            return entries, done
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a line cut short by a crash, its entry is crawled again
+                    continue
+                if "entries" in record:
+                    entries = record["entries"]
+                else:
+                    done[record["entry"]] = record["rows"]
+        return entries, done
+
+    def _write(self, record):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._file = open(self.path, "a")
+        self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._file.flush()
+
+    def start(self, entries):
+        """Record the entries of the sample, dropping any previous crawl"""
+        self.remove()
+        self._write({"entries": entries})
+
+    def add(self, entry, rows):
+        """Record one crawled squad"""
+        self._write({"entry": entry, "rows": rows})
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        """Delete the checkpoint once its crawl has been published"""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def checkpoint_path(league_id, sample_size, gameweek):
+    return os.path.join(
+        CHECKPOINT_DIRECTORY, f"league{league_id}_top{sample_size}_gw{gameweek}.jsonl"
+    )
+
+
+def sample_ownership(
+    client,
+    league_id,
+    sample_size,
+    gameweek,
+    checkpoint=None,
+    progress=None,
+    max_failures=CRAWL_MAX_FAILURES,
+    workers=None,
+):
+    """Count the ownership of the top sample_size entries of a classic league
+
+    Resumes from the checkpoint when one exists: its sample is reused and the
+    entries it already holds are counted without being fetched again. The
+    checkpoint is left in place, remove it once the result is published.
+
+    Args:
+        client (FPLClient) : Client used for the standings and picks requests
+        league_id (int) : ID of the classic league, 314 is the overall league
+        sample_size (int) : Number of top ranked entries to crawl
+        gameweek (int) : Specific gameweek
+        checkpoint (Checkpoint) : Where the crawl is recorded, defaults to
+            checkpoint_path(league_id, sample_size, gameweek)
+        progress (callable) : Called with (entries done, sample size)
+        max_failures (int) : Consecutive failures after which to abort
+        workers (int) : Requests in flight at once, defaults to CRAWL_WORKERS
+    """
+    if checkpoint is None:
+        checkpoint = Checkpoint(checkpoint_path(league_id, sample_size, gameweek))
+    entries, done = checkpoint.load()
+    if entries is None:
+        pages = math.ceil(sample_size / STANDINGS_PAGE_SIZE)
+        entries = league_entries(client, league_id, pages, workers)[:sample_size]
+        checkpoint.start(entries)
+    elif done:
+        print(f"Resuming crawl with {len(done)} of {len(entries)} entries done")
+    rank = {entry: position for position, entry in enumerate(entries)}
+    counter = OwnershipCounter()
+    for entry, rows in done.items():
+        counter.add_rows(rows, rank[entry])
+    remaining = [entry for entry in entries if entry not in done]
+    try:
+        for entry, picks in crawl_picks(
+            client,
+            remaining,
+            gameweek,
+            workers=workers,
+            progress=progress and (lambda n: progress(len(done) + n, len(entries))),
+            max_failures=max_failures,
+        ):
+            rows = pick_rows(picks)
+            checkpoint.add(entry, rows)
+            counter.add_rows(rows, rank[entry])
+    finally:
+        checkpoint.close()
+    return counter
@@ -1,156 +1,131 @@
+import argparse
+import hashlib
 import io
+import json
+import sys
+from functools import partial
 from joblib import load
 import time
-import numpy as np
-import json
 import pandas as pd
-import requests
-import pulp
-import warnings
 import os
 
-warnings.filterwarnings("ignore", category=UserWarning, module="pulp")
-
+import crawler
+import storage
+from optimizer import select_squad
+from ownership import ownership_frame
+from pipeline import Pipeline, failed_stages, load_report
+from predictions import POSITION_FEATURES, PredictionEngine, horizon_predictions
+from resources import ResourceRegistry
+from upstream import FPL_BASE_URL, FPL_DATA_URL, SourceCache
 
 # Get the current directory
 current_directory = os.getcwd()
 # Define the path to the directories within the current directory
 models_directory = os.path.join(current_directory, "models")
-data_directory = os.path.join(current_directory, "data2425")
+# season the pipeline runs for, set by main() from --season
+season = storage.CURRENT_SEASON
+data_root = os.path.join(current_directory, storage.SEASONS[season])
+# the published snapshot version; main() points this at the version it builds
+data_directory = storage.current_directory(data_root)
+# last bodies and validators of the upstream files, for conditional GETs
+upstream_directory = os.path.join(current_directory, "upstream_cache")
 
 
 # Overall FPL league ID, 314 for 2019/20 season.
 overallLeagueID = 314
 # overall league
 overall_league_url = (
-    "https://fantasy.premierleague.com/api/leagues-classic/"
-    + str(overallLeagueID)
-    + "/standings/"
+    FPL_BASE_URL + "/leagues-classic/" + str(overallLeagueID) + "/standings/"
 )
+# default sizes of the league samples to build template teams for, see
+# main(); each one is published as top{N}_gw{gw}
+TOP_MANAGER_SAMPLES = [250]
+# gameweeks ahead to predict in get_player_horizon(), 1 to 8
+PREDICTION_HORIZON = 8
 
 
-# Fetch the game data once and use it across the application
-try:
-    lods_gk = load(os.path.join(models_directory, "gk_model.joblib"))
-    lods_def = load(os.path.join(models_directory, "def_model.joblib"))
-    lods_mid = load(os.path.join(models_directory, "mid_model.joblib"))
-    lods_fwd = load(os.path.join(models_directory, "fwd_model.joblib"))
-
-    game_data = requests.get(
-        "https://fantasy.premierleague.com/api/bootstrap-static/"
-    ).json()
-except requests.exceptions.RequestException as e:
-    print(e)
-    game_data = None
-
-
-def SolveLP(df, SquadComposition, MaxElementsPerTeam, BudgetLimit, feature: str):
-    # Get a list of players
-    players = list(df["id"])
-    # Initialize Dictionaries for Salaries and Positions
-    cost = dict(zip(players, df["now_cost"]))
-    positions = dict(zip(players, df["element_type"]))
-    teams = dict(zip(players, df["team"]))
-    # Dictionary for Projected Score for each player
-    project_points = dict(zip(players, df[feature]))
-    # Set Players to Take either 1 or 0 values (owned or not)
-    player_vars = pulp.LpVariable.dicts(
-        "Player", players, lowBound=0, upBound=1, cat="Integer"
-    )
+# FPL_BASE_URL and FPL_DATA_URL point these at a local stand-in server, see
+# bench/stub_fpl.py
+BOOTSTRAP_URL = FPL_BASE_URL + "/bootstrap-static/"
+# the FPL API only serves the current season, earlier ones can only refresh
+# the stages built from their CSVs
+ARCHIVE_STAGES = ["club_data", "fixtures_data"]
+MODEL_NAMES = {1: "gk", 2: "def", 3: "mid", 4: "fwd"}
 
-    total_score = pulp.LpProblem("FPL Best Team", pulp.LpMaximize)
-    total_score += pulp.lpSum([project_points[i] * player_vars[i] for i in player_vars])
-    total_score += (
-        pulp.lpSum([cost[i] * player_vars[i] for i in player_vars]) <= BudgetLimit
-    )
-    # Get indices of players for each position
-    fwd = [p for p in positions.keys() if positions[p] == 4]
-    mid = [p for p in positions.keys() if positions[p] == 3]
-    defD = [p for p in positions.keys() if positions[p] == 2]
-    gk = [p for p in positions.keys() if positions[p] == 1]
-    # Set Constraints
-    total_score += (
-        pulp.lpSum([player_vars[i] for i in fwd]) == SquadComposition["Forwards"]
-    )
-    total_score += (
-        pulp.lpSum([player_vars[i] for i in mid]) == SquadComposition["Midfielders"]
-    )
-    total_score += (
-        pulp.lpSum([player_vars[i] for i in defD]) == SquadComposition["Defenders"]
-    )
-    total_score += (
-        pulp.lpSum([player_vars[i] for i in gk]) == SquadComposition["Goalkeepers"]
-    )
+upstream_cache = SourceCache(upstream_directory)
 
-    # Teams constraints
-    for k in list(df["team"].unique()):
-        teamTMP = [p for p in teams.keys() if teams[p] == k]
-        total_score += (
-            pulp.lpSum([player_vars[i] for i in teamTMP]) <= MaxElementsPerTeam
-        )
 
-    total_score.solve(pulp.PULP_CBC_CMD(msg=False))
+def season_url(file):
+    """URL of one of the season's CSVs, e.g. season_url("teams.csv")"""
+    return f"{FPL_DATA_URL}/{season}/{file}"
 
-    playersTeam = []
-    for v in total_score.variables():
-        if v.varValue > 0:
-            playersTeam.append(
-                v.name.replace("Player_r_", "").replace("_", " ").replace("Player ", "")
-            )
-            # print(v.name.replace("Player_r_","").replace("_", " ").replace("Player ",""))
 
-    dfPlayers = pd.DataFrame(playersTeam)
-    dfPlayers.columns = ["player_id"]
-    dfPlayers["player_id"] = dfPlayers["player_id"].astype(int)
+def _model_path(name):
+    return os.path.join(models_directory, f"{name}_model.joblib")
 
-    merged_df = df.merge(dfPlayers, left_on="id", right_on="player_id", how="inner")
-    merged_df = merged_df.drop(columns=["player_id"])
-    return merged_df
 
+def _load_model(position):
+    return load(_model_path(position))
 
-def load_players():
-    gameweek = get_current_gameweek()
-    players_df = pd.read_pickle(
-        os.path.join(data_directory, f"get_player_data_gw{gameweek}.pkl")
-    )
-    return players_df
 
+def _fetch_game_data():
+    return json.loads(upstream_cache.get(BOOTSTRAP_URL).content)
 
-def get_team_data(entry_id, gameweek):
-    """Retrieve the gw-by-gw data for a specific entry/team
 
-    credit: vaastav/Fantasy-Premier-League/getters.py
+def models_digest():
+    """sha1 of the model files, changes whenever a model is retrained"""
+    digest = hashlib.sha1()
+    for name in MODEL_NAMES.values():
+        with open(_model_path(name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
 
-    Args:
-        entry_id (int) : ID of the team whose data is to be retrieved
-        gameweek (int) : Specific gameweek
-    """
-    base_url = "https://fantasy.premierleague.com/api/entry/"
-    full_url = base_url + str(entry_id) + "/event/" + str(gameweek) + "/picks/"
-    response = requests.get(full_url)
-    response.raise_for_status()
-    data = response.json()
-    team_picks = pd.DataFrame(data["picks"])
-    team_picks = team_picks.merge(
-        load_players()[
-            [
-                "id",
-                "web_name",
-                "now_cost",
-                "event_points",
-                "element_type",
-                "form",
-                "selected_by_percent",
-                "news",
-                "team",
-                "photo",
-                "preds",
-            ]
-        ],
-        left_on="element",
-        right_on="id",
+
+# The models and the game data are loaded on first use rather than on import,
+# so importing this module is cheap and works offline
+resources = ResourceRegistry()
+resources.register("game_data", _fetch_game_data)
+
+prediction_engine = PredictionEngine()
+for position, name in MODEL_NAMES.items():
+    prediction_engine.register(
+        position,
+        resources.register(f"lods_{name}", partial(_load_model, name)),
+        POSITION_FEATURES[position],
     )
-    return team_picks
+
+
+def __getattr__(name):
+    # keeps fetch_data.lods_gk, fetch_data.game_data etc. working
+    if name in resources:
+        return resources.get(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def warm_up():
+    """Load the models and the game data up front, before the pipeline runs"""
+    resources.warm_up()
+
+
+TEAM_PICK_COLUMNS = [
+    "id",
+    "web_name",
+    "now_cost",
+    "event_points",
+    "element_type",
+    "form",
+    "selected_by_percent",
+    "news",
+    "team",
+    "photo",
+    "preds",
+]
+
+
+def load_players():
+    gameweek = get_current_gameweek()
+    players_df = storage.read_frame(data_directory, f"get_player_data_gw{gameweek}")
+    return players_df
 
 
 def get_game_data():
@@ -159,127 +134,57 @@ def get_game_data():
     credit: vaastav/Fantasy-Premier-League/getters.py
 
     """
-    return game_data
+    return resources.get("game_data")
 
 
 def get_gameweek_data():
     gw_data = pd.DataFrame(get_game_data()["events"])
-    gw_data.to_pickle(os.path.join(data_directory, "get_gameweek_data.pkl"))
+    storage.write_frame(gw_data, data_directory, "get_gameweek_data")
     print(f"Successfully fetched gameweek data on: {time.ctime()}")
     return gw_data
 
 
-def get_player_data():
-    gameweek = get_current_gameweek()
-    gw_df = pd.DataFrame(get_game_data()["elements"])
-    # Trial
-    # Define the conditions for applying the models
-    condition_1 = gw_df["element_type"] == 1
-    condition_2 = gw_df["element_type"] == 2
-    condition_3 = gw_df["element_type"] == 3
-    condition_4 = gw_df["element_type"] == 4
-
-    # Apply model_1 to rows where 'element_type' is 1
-    gw_df["preds"] = 0  # Initialize the 'preds' column with default values
-    gw_df["preds"] = gw_df["preds"].where(
-        ~condition_1,
-        np.round(
-            lods_gk.predict(
-                gw_df[
-                    [
-                        "ep_this",
-                        "form",
-                        "value_form",
-                        "transfers_in_event",
-                        "clean_sheets",
-                        "total_points",
-                        "value_season",
-                        "bps",
-                    ]
-                ]
-            )
-        ),
-    )
+def _previous_predictions(name, models):
+    # only predictions made by the same models can be reused
+    if storage.load_manifest(data_directory).get(name, {}).get("models") != models:
+        return None
+    columns = ["id", "element_type", "preds"] + prediction_engine.features
+    try:
+        return storage.read_frame(data_directory, name, columns)
+    except (OSError, KeyError):
+        return None
 
-    # Apply model_2 to rows where 'element_type' is 2
-    gw_df["preds"] = gw_df["preds"].where(
-        ~condition_2,
-        np.round(
-            lods_def.predict(
-                gw_df[
-                    [
-                        "ep_this",
-                        "form",
-                        "value_form",
-                        "points_per_game",
-                        "transfers_in_event",
-                        "clean_sheets_per_90",
-                        "total_points",
-                    ]
-                ]
-            )
-        ),
-    )
 
-    # Apply model_3 to rows where 'element_type' is 3
-    gw_df["preds"] = gw_df["preds"].where(
-        ~condition_3,
-        np.round(
-            lods_mid.predict(
-                gw_df[
-                    [
-                        "ep_this",
-                        "form",
-                        "value_form",
-                        "points_per_game",
-                        "transfers_in_event",
-                        "expected_goal_involvements",
-                        "total_points",
-                        "ict_index",
-                        "goals_scored",
-                    ]
-                ]
-            )
-        ),
-    )
+def get_player_data(full=False):
+    """Fetch the players of the current gameweek and predict their points
 
-    # Apply model_4 to rows where 'element_type' is 4
-    gw_df["preds"] = gw_df["preds"].where(
-        ~condition_4,
-        np.round(
-            lods_fwd.predict(
-                gw_df[
-                    [
-                        "ep_this",
-                        "form",
-                        "value_form",
-                        "points_per_game",
-                        "transfers_in_event",
-                        "bonus",
-                        "bps",
-                        "influence",
-                        "goals_scored",
-                        "total_points",
-                        "expected_goals",
-                    ]
-                ]
-            )
-        ),
-    )
+    Players whose features are the same as in the stored snapshot keep
+    their prediction, unless `full` is set or the models changed.
+
+    Args:
+        full (bool) : Predict every player
+    """
+    gameweek = get_current_gameweek()
+    name = f"get_player_data_gw{gameweek}"
+    gw_df = pd.DataFrame(get_game_data()["elements"])
+    models = models_digest()
+    previous = None if full else _previous_predictions(name, models)
+    # each position's model only scores that position's rows
+    gw_df["preds"], predicted = prediction_engine.update(gw_df, previous)
 
     gw_df["photo"] = gw_df["photo"].str.replace(".jpg", ".png", regex=False)
 
-    gw_df.to_pickle(os.path.join(data_directory, f"get_player_data_gw{gameweek}.pkl"))
+    storage.write_frame(gw_df, data_directory, name, meta={"models": models})
 
     print(
-        f"Successfully fetched gw player data and predicted player points on: {time.ctime()}"
+        f"Successfully fetched gw player data and predicted {predicted} of "
+        f"{len(gw_df)} players on: {time.ctime()}"
     )
     return gw_df
 
 
 def get_club_data():
-    url = "https://raw.githubusercontent.com/vaastav/Fantasy-Premier-League/master/data/2024-25/teams.csv"
-    s = requests.get(url).content
+    s = upstream_cache.get(season_url("teams.csv")).content
     teams = pd.read_csv(io.StringIO(s.decode("utf-8")))
     teams.rename(
         columns={
@@ -290,13 +195,13 @@ def get_club_data():
         },
         inplace=True,
     )
-    teams.to_pickle(os.path.join(data_directory, "get_club_data.pkl"))
+    storage.write_frame(teams, data_directory, "get_club_data")
     print(f"Successfully fetched club data on: {time.ctime()}")
     return teams
 
 
 def get_current_gameweek():
-    gameweeks = pd.read_pickle(os.path.join(data_directory, "get_gameweek_data.pkl"))
+    gameweeks = storage.read_frame(data_directory, "get_gameweek_data")
     try:
         current = gameweeks[gameweeks["is_current"]].iloc[-1]["id"]
     except IndexError:  # catch gameweek 0
@@ -305,10 +210,9 @@ def get_current_gameweek():
 
 
 def get_fixtures_data():
-    url = "https://raw.githubusercontent.com/vaastav/Fantasy-Premier-League/master/data/2024-25/fixtures.csv"
-    s = requests.get(url).content
+    s = upstream_cache.get(season_url("fixtures.csv")).content
     fixtures = pd.read_csv(io.StringIO(s.decode("utf-8")))
-    teams = pd.read_pickle(os.path.join(data_directory, "get_club_data.pkl"))
+    teams = storage.read_frame(data_directory, "get_club_data")
     combined_df = pd.merge(
         left=fixtures,
         right=teams,
@@ -326,50 +230,49 @@ def get_fixtures_data():
         suffixes=("_a", "_h"),
     )
     combined_df = combined_df.drop(columns=["team_id_a", "team_id_h"])
-    combined_df.to_pickle(os.path.join(data_directory, "get_fixtures_data.pkl"))
+    storage.write_frame(combined_df, data_directory, "get_fixtures_data")
     print(f"Successfully fetched fixtures on: {time.ctime()}")
     return combined_df
 
 
-def top_managers():
+def get_player_horizon(horizon=PREDICTION_HORIZON):
+    """Predict the players over the next gameweeks from their fixtures
+
+    Stored next to the player snapshot as get_player_horizon_gw{gw}, one row
+    per player and one xp_gw{n} column per gameweek.
+    """
     gameweek = get_current_gameweek()
-    ## Check if local data exists for the current gameweek
-    # try:
-    #     top250df = pd.read_pickle(f"top250_gw{gameWeek}.pkl")
-    # adds the top team ID's to this array
-    teamIDarray_all = []
-
-    urls = [
-        "https://fantasy.premierleague.com/api/leagues-classic/314/standings/",
-        "https://fantasy.premierleague.com/api/leagues-classic/314/standings/?page_standings=2",
-        "https://fantasy.premierleague.com/api/leagues-classic/314/standings/?page_standings=3",
-        "https://fantasy.premierleague.com/api/leagues-classic/314/standings/?page_standings=4",
-        "https://fantasy.premierleague.com/api/leagues-classic/314/standings/?page_standings=5",
-    ]
-
-    managerParsed_all = []
-    for url in urls:
-        response = requests.get(url)
-        data = response.text
-        parsed = json.loads(data)
-        managerParsed_all.append(parsed["standings"]["results"])
-
-    final_dataframe_all = pd.DataFrame()
-
-    # get csv of top 15 manager information and write to top_managers.csv
-    for page in managerParsed_all:
-        for manager in page:
-            teamIDarray_all.append(manager["entry"])
-
-    def update_dictionary_key(dictionary, key):
-        if key in dictionary:
-            dictionary[key] += 1
-        else:
-            dictionary[key] = 1
-
-    count_dict_all = {}
-    count = 0
-    print("Fetching Top 250 Managers...")
+    players = storage.read_frame(
+        data_directory, f"get_player_data_gw{gameweek}", ["id", "team", "preds"]
+    )
+    fixtures = storage.read_frame(data_directory, "get_fixtures_data")
+    horizon_df = horizon_predictions(players, fixtures, gameweek + 1, horizon)
+    storage.write_frame(horizon_df, data_directory, f"get_player_horizon_gw{gameweek}")
+    print(f"Successfully predicted the next {horizon} gameweeks on: {time.ctime()}")
+    return horizon_df
+
+
+def top_managers(league_id=overallLeagueID, sample_size=250, workers=None):
+    """Build the template team of the top managers of a classic league
+
+    The crawl is checkpointed, so running this again after a crash or a
+    rate-limit ban resumes where it stopped. Publishes all_top{N}_gw{gw}_data
+    and top{N}_gw{gw}, prefixed with league{id}_ for leagues other than the
+    overall league.
+
+    Args:
+        league_id (int) : ID of the classic league, 314 is the overall league
+        sample_size (int) : Number of top ranked managers to crawl
+        workers (int) : Requests in flight at once, defaults to
+            crawler.CRAWL_WORKERS
+    """
+    gameweek = get_current_gameweek()
+    prefix = "" if league_id == overallLeagueID else f"league{league_id}_"
+    client = crawler.crawl_client(workers)
+    checkpoint = crawler.Checkpoint(
+        crawler.checkpoint_path(league_id, sample_size, gameweek)
+    )
+    print(f"Fetching Top {sample_size} Managers...")
 
     ## Progress bar ##
     def print_progress_bar(iteration, total, length=50):
@@ -381,109 +284,249 @@ def top_managers():
 
     ## ##
 
-    # for each teamID in the top 15, call the api and update both top_managers_gwInfo.csv and top_managers_gwPicks.csv
-    for teamID in teamIDarray_all:
-        # Call the get_team_data function
-        team_data_all = get_team_data(teamID, gameweek)
-        for _, x in team_data_all.iterrows():
-            update_dictionary_key(count_dict_all, x["id"])
-        # Append the team_data to the final_dataframe
-        final_dataframe_all = pd.concat([final_dataframe_all, team_data_all])
-        time.sleep(2)
-        count += 1
-        print_progress_bar(count, 250)
-    print()
-    # Create a new 'frequency' column using list comprehension
-    final_dataframe_all["top_ownership"] = final_dataframe_all["id"].apply(
-        (lambda x: count_dict_all.get(x, 0) * 0.4)
+    # fetch every top manager's picks concurrently and count player ownership
+    counter = crawler.sample_ownership(
+        client,
+        league_id,
+        sample_size,
+        gameweek,
+        checkpoint=checkpoint,
+        progress=print_progress_bar,
+        workers=workers,
     )
+    print()
 
-    # Remove one of the duplicate columns if both exist
-    if (
-        "element_type_x" in final_dataframe_all.columns
-        and "element_type_y" in final_dataframe_all.columns
-    ):
-        final_dataframe_all["element_type"] = final_dataframe_all[
-            "element_type_x"
-        ]  # Keep one
-        final_dataframe_all.drop(
-            columns=["element_type_x", "element_type_y"], inplace=True
-        )
-
-    # Remove duplicate rows
-    df_unique = final_dataframe_all.drop_duplicates(subset=["web_name"], keep="first")
+    # one row per owned player, joined with the player frame once
+    df_unique = ownership_frame(counter, load_players(), TEAM_PICK_COLUMNS)
 
-    df_unique.to_pickle(
-        os.path.join(data_directory, f"all_top250_gw{gameweek}_data.pkl")
-    )
-    top250df = SolveLP(
-        df_unique,
-        {"Forwards": 3, "Midfielders": 5, "Defenders": 5, "Goalkeepers": 2},
-        3,
-        1000,
-        "top_ownership",
+    storage.write_frame(
+        df_unique, data_directory, f"{prefix}all_top{sample_size}_gw{gameweek}_data"
     )
+    top_df, stats = select_squad(df_unique, "top_ownership", max_per_team=3)
+    print(f"Solved the top {sample_size} template: {stats}")
 
-    top250df.to_pickle(os.path.join(data_directory, f"top250_gw{gameweek}.pkl"))
+    storage.write_frame(
+        top_df, data_directory, f"{prefix}top{sample_size}_gw{gameweek}"
+    )
+    checkpoint.remove()
 
     print(
-        f"Successfully fetched top 250 managers for GameWeek {gameweek} on: {time.ctime()}"
+        f"Successfully fetched top {sample_size} managers for GameWeek {gameweek} "
+        f"on: {time.ctime()}"
     )
-    return top250df
+    return top_df
 
 
 def ai_team(team_type):
     gameweek = get_current_gameweek()
-    player_data = pd.read_pickle(
-        os.path.join(data_directory, f"get_player_data_gw{gameweek}.pkl")
-    )
+    player_data = storage.read_frame(data_directory, f"get_player_data_gw{gameweek}")
     if team_type == "Fantasy":
-        ai = SolveLP(
-            df=player_data,
-            SquadComposition={
-                "Forwards": 3,
-                "Midfielders": 5,
-                "Defenders": 5,
-                "Goalkeepers": 2,
-            },
-            MaxElementsPerTeam=3,
-            BudgetLimit=1000,
-            feature="preds",
-        )
-        ai.to_pickle(os.path.join(data_directory, f"ai_team_gw{gameweek}.pkl"))
+        ai, stats = select_squad(player_data, "preds", max_per_team=3, lineup=True)
+        storage.write_frame(ai, data_directory, f"ai_team_gw{gameweek}")
         print(
-            f"Successfully created AI team for GameWeek {gameweek} on: {time.ctime()}"
+            f"Successfully created AI team for GameWeek {gameweek} on: {time.ctime()} {stats}"
         )
         return ai
     else:
-        ai = SolveLP(
-            df=player_data,
-            SquadComposition={
-                "Forwards": 3,
-                "Midfielders": 5,
-                "Defenders": 5,
-                "Goalkeepers": 2,
-            },
-            MaxElementsPerTeam=5,
-            BudgetLimit=1000,
-            feature="preds",
-        )
-        ai.to_pickle(os.path.join(data_directory, f"FPL_challenge_gw{gameweek}.pkl"))
+        ai, stats = select_squad(player_data, "preds", max_per_team=5, lineup=True)
+        storage.write_frame(ai, data_directory, f"FPL_challenge_gw{gameweek}")
         print(
-            f"Successfully created FPL Challenge team for GameWeek {gameweek} on: {time.ctime()}"
+            f"Successfully created FPL Challenge team for GameWeek {gameweek} on: {time.ctime()} {stats}"
         )
         return ai
 
 
-def main():
-    get_game_data()
-    get_gameweek_data()
-    get_player_data()
-    get_club_data()
-    get_fixtures_data()
-    top_managers()
-    ai_team("Fantasy")
-    ai_team("FPL Challenge")
+def build_pipeline(
+    full=False,
+    league_id=overallLeagueID,
+    samples=TOP_MANAGER_SAMPLES,
+    crawl_workers=None,
+):
+    """The stages of a data refresh and the snapshots each one reads and writes
+
+    Args:
+        full (bool) : Predict every player rather than the changed ones
+        league_id (int) : Classic league whose top managers are sampled
+        samples (list) : Sizes of the top manager samples
+        crawl_workers (int) : Picks requested at once by the top manager
+            crawls, defaults to crawler.CRAWL_WORKERS
+    """
+
+    def gameweek_snapshots(*names):
+        return lambda: [f"{name}_gw{get_current_gameweek()}" for name in names]
+
+    datasets = {
+        "gameweek": lambda: ["get_gameweek_data"],
+        "players": gameweek_snapshots("get_player_data"),
+        "clubs": lambda: ["get_club_data"],
+        "fixtures": lambda: ["get_fixtures_data"],
+        "horizon": gameweek_snapshots("get_player_horizon"),
+        "ai_team": gameweek_snapshots("ai_team"),
+        "fpl_challenge": gameweek_snapshots("FPL_challenge"),
+    }
+    # upstream files are fetched conditionally and fingerprinted by content,
+    # so an unchanged file skips every stage downstream of it
+    sources = {
+        "bootstrap": lambda: upstream_cache.get(BOOTSTRAP_URL).digest,
+        "clubs_csv": lambda: upstream_cache.get(season_url("teams.csv")).digest,
+        "fixtures_csv": lambda: upstream_cache.get(season_url("fixtures.csv")).digest,
+        "models": models_digest,
+    }
+    pipeline = Pipeline(data_directory, datasets, sources, report_directory=data_root)
+    pipeline.add(
+        "gameweek_data",
+        get_gameweek_data,
+        outputs=["gameweek"],
+        sources=["bootstrap"],
+    )
+    pipeline.add(
+        "player_data",
+        partial(get_player_data, full=full),
+        inputs=["gameweek"],
+        outputs=["players"],
+        sources=["bootstrap", "models"],
+    )
+    pipeline.add("club_data", get_club_data, outputs=["clubs"], sources=["clubs_csv"])
+    pipeline.add(
+        "fixtures_data",
+        get_fixtures_data,
+        inputs=["clubs"],
+        outputs=["fixtures"],
+        sources=["fixtures_csv"],
+    )
+    pipeline.add(
+        "player_horizon",
+        get_player_horizon,
+        inputs=["gameweek", "players", "fixtures"],
+        outputs=["horizon"],
+    )
+    prefix = "" if league_id == overallLeagueID else f"league{league_id}_"
+    for sample_size in samples:
+        datasets[f"{prefix}top{sample_size}"] = gameweek_snapshots(
+            f"{prefix}all_top{sample_size}", f"{prefix}top{sample_size}"
+        )
+        pipeline.add(
+            f"top_managers_{prefix}{sample_size}",
+            partial(
+                top_managers,
+                league_id=league_id,
+                sample_size=sample_size,
+                workers=crawl_workers,
+            ),
+            inputs=["gameweek", "players"],
+            outputs=[f"{prefix}top{sample_size}"],
+            fetches=True,
+            # the crawl resumes from its checkpoint, a retry loses little
+            retries=3,
+        )
+    pipeline.add(
+        "ai_team",
+        partial(ai_team, "Fantasy"),
+        inputs=["gameweek", "players"],
+        outputs=["ai_team"],
+    )
+    pipeline.add(
+        "fpl_challenge",
+        partial(ai_team, "FPL Challenge"),
+        inputs=["gameweek", "players"],
+        outputs=["fpl_challenge"],
+    )
+    return pipeline
+
+
+def main(argv=None):
+    """Build a new snapshot version and publish it if every stage succeeds
+
+    The version starts as a copy of the published one, so the API keeps
+    serving a complete, consistent set of files until the pointer swap. A
+    run with failed stages stays unpublished; --retry-failed carries on in
+    the same version.
+    """
+    global season, data_root, data_directory
+    parser = argparse.ArgumentParser(description="Fetch FPL data and predict")
+    parser.add_argument(
+        "--season",
+        choices=list(storage.SEASONS),
+        default=storage.CURRENT_SEASON,
+        help="season whose data directory is refreshed",
+    )
+    parser.add_argument("--stages", help="comma separated stages to run")
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="run the stages that failed or were blocked last time",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="run stages with unchanged inputs and predict every player",
+    )
+    parser.add_argument(
+        "--league",
+        type=int,
+        default=overallLeagueID,
+        help="classic league whose top managers are sampled",
+    )
+    parser.add_argument(
+        "--samples",
+        default=",".join(map(str, TOP_MANAGER_SAMPLES)),
+        help="comma separated top manager sample sizes, e.g. 250,1000,10000",
+    )
+    parser.add_argument(
+        "--crawl-workers",
+        type=int,
+        default=crawler.CRAWL_WORKERS,
+        help="top manager picks requested at once",
+    )
+    args = parser.parse_args(argv)
+    try:
+        samples = [int(size) for size in args.samples.split(",")]
+    except ValueError:
+        parser.error(f"--samples takes comma separated sizes, not {args.samples}")
+    if min(samples) < 1:
+        parser.error("--samples must be positive")
+    if args.crawl_workers < 1:
+        parser.error("--crawl-workers must be positive")
+
+    season = args.season
+    data_root = os.path.join(current_directory, storage.SEASONS[season])
+    # every stage, or the ones an earlier season can still refresh
+    every_stage = None if season == storage.CURRENT_SEASON else ARCHIVE_STAGES
+    only = args.stages.split(",") if args.stages else every_stage
+    if every_stage is None:
+        warm_up()
+    elif set(only) - set(every_stage):
+        parser.error(
+            f"{', '.join(sorted(set(only) - set(every_stage)))} can only run "
+            f"for the {storage.CURRENT_SEASON} season"
+        )
+    staging = None
+    if args.retry_failed:
+        last = load_report(data_root)
+        only = failed_stages(last)
+        if not only:
+            print("Nothing to retry")
+            return
+        staging = os.path.normpath(os.path.join(data_root, last.get("directory", "")))
+        if staging in (data_root, storage.current_directory(data_root)) or (
+            not os.path.isdir(staging)
+        ):
+            print("The failed run's snapshot version is gone, running every stage")
+            staging, only = None, every_stage
+    data_directory = staging or storage.stage_version(data_root)
+    print(f"Building snapshot version {os.path.basename(data_directory)}")
+    pipeline = build_pipeline(
+        full=args.force,
+        league_id=args.league,
+        samples=samples,
+        crawl_workers=args.crawl_workers,
+    )
+    report = pipeline.run(only=only, force=args.force)
+    if failed_stages(report):
+        print(f"Not publishing {data_directory}, rerun with --retry-failed")
+        sys.exit(1)
+    version = storage.publish_version(data_root, data_directory)
+    print(f"Published snapshot version {version} on: {time.ctime()}")
 
 
 if __name__ == "__main__":
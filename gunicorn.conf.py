@@ -0,0 +1,64 @@
+import multiprocessing
+import os
+import signal
+import tempfile
+
+# gunicorn -c gunicorn.conf.py wsgi:app
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+worker_class = "gthread"
+
+# Import and warm the app in the master so workers share its memory
+preload_app = True
+
+# Recycle workers gracefully, staggered so they don't all restart at once
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 5000))
+max_requests_jitter = max_requests // 10
+graceful_timeout = 30
+timeout = 60
+keepalive = 5
+
+# workers write their metrics here so a scrape of any one reports them all
+os.environ.setdefault(
+    "METRICS_DIRECTORY", os.path.join(tempfile.gettempdir(), "fplmstr-metrics")
+)
+
+
+def on_starting(server):
+    import metrics
+
+    if metrics.registry.directory is not None:
+        metrics.registry.clear_shared()
+
+
+def post_fork(server, worker):
+    import metrics
+    from app import seasons
+
+    metrics.registry.forked()
+    # only the master follows publishes, see when_ready
+    seasons.forked()
+
+
+def worker_exit(server, worker):
+    import metrics
+
+    if metrics.registry.directory is not None:
+        metrics.registry.dump()
+
+
+def when_ready(server):
+    # Watch for newly published snapshot versions in the master: it loads
+    # and pre-renders a new version once, then HUP replaces the workers
+    # gracefully, so the new ones fork from the warm master and share its
+    # memory like the first ones did instead of each warming a private copy
+    import gc
+
+    from app import watch_snapshots
+
+    def reload_workers():
+        gc.freeze()
+        os.kill(server.pid, signal.SIGHUP)
+
+    watch_snapshots(on_switch=reload_workers)
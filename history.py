@@ -0,0 +1,136 @@
+import os
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+
+import storage
+
+HISTORY_COLUMNS = [
+    "now_cost",
+    "form",
+    "preds",
+    "event_points",
+    "selected_by_percent",
+]
+
+_player_file = re.compile(r"^get_player_data_gw(\d+)\.(?:pkl|parquet)$")
+
+
+class PlayerHistory:
+    """Per-player time series across every stored gameweek snapshot
+
+    Only the id and HISTORY_COLUMNS of each get_player_data_gw{N} file are
+    loaded, as float32 arrays. refresh() picks up new or rewritten gameweek
+    files without reloading the ones already indexed, including when it moves
+    to a new snapshot version whose unchanged files are hard links.
+    """
+
+    def __init__(self, directory, columns=HISTORY_COLUMNS):
+        self.directory = directory
+        self.columns = list(columns)
+        self._snapshots = {}
+        self._directory_signature = None
+        self._lock = threading.Lock()
+        # (gameweeks, ids, series), replaced as a whole on every rebuild so
+        # readers never see a partially updated index
+        self._index = (
+            np.empty(0, dtype=np.int32),
+            np.empty(0, dtype=np.int32),
+            {column: np.empty((0, 0), np.float32) for column in columns},
+        )
+
+    def refresh(self, directory=None):
+        """Index new or changed gameweek files, return True if any were found
+
+        Args:
+            directory (str) : Index this directory from now on, if given
+        """
+        if directory is not None and directory != self.directory:
+            with self._lock:
+                self.directory = directory
+                self._directory_signature = None
+        try:
+            signature = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if signature == self._directory_signature:
+            return False
+        with self._lock:
+            if signature == self._directory_signature:
+                return False
+            changed = False
+            for gameweek in self._stored_gameweeks():
+                path = storage.resolve(self.directory, f"get_player_data_gw{gameweek}")
+                stat = os.stat(path)
+                file_signature = (
+                    os.path.basename(path),
+                    stat.st_mtime_ns,
+                    stat.st_size,
+                )
+                snapshot = self._snapshots.get(gameweek)
+                if snapshot is None or snapshot[0] != file_signature:
+                    self._snapshots[gameweek] = (file_signature, self._load(path))
+                    changed = True
+            if changed:
+                self._rebuild()
+            self._directory_signature = signature
+            return changed
+
+    def _stored_gameweeks(self):
+        gameweeks = set()
+        for file in os.listdir(self.directory):
+            match = _player_file.match(file)
+            if match:
+                gameweeks.add(int(match.group(1)))
+        return sorted(gameweeks)
+
+    def _load(self, path):
+        frame = storage.read_path(path, ["id"] + self.columns)
+        return (
+            frame["id"].to_numpy(np.int32),
+            {
+                column: pd.to_numeric(frame[column], errors="coerce").to_numpy(
+                    np.float32
+                )
+                for column in self.columns
+            },
+        )
+
+    def _rebuild(self):
+        gameweeks = sorted(self._snapshots)
+        ids = np.unique(np.concatenate([self._snapshots[gw][1][0] for gw in gameweeks]))
+        series = {
+            column: np.full((len(ids), len(gameweeks)), np.nan, dtype=np.float32)
+            for column in self.columns
+        }
+        for position, gameweek in enumerate(gameweeks):
+            snapshot_ids, values = self._snapshots[gameweek][1]
+            rows = np.searchsorted(ids, snapshot_ids)
+            for column in self.columns:
+                series[column][rows, position] = values[column]
+        self._index = (np.asarray(gameweeks, dtype=np.int32), ids, series)
+
+    def lookup(self, player_ids):
+        """Return the time series of the given players, skipping unknown IDs
+
+        Args:
+            player_ids (list) : IDs of the players to look up
+        """
+        gameweeks, ids, series = self._index
+        player_ids = np.asarray(player_ids, dtype=np.int64)
+        rows = np.searchsorted(ids, player_ids)
+        found = rows < len(ids)
+        found[found] = ids[rows[found]] == player_ids[found]
+        players = []
+        for player_id, row in zip(player_ids[found], rows[found]):
+            player = {"id": int(player_id)}
+            for column in self.columns:
+                values = series[column][row]
+                player[column] = [
+                    None if np.isnan(value) else round(float(value), 2)
+                    for value in values
+                ]
+            players.append(player)
+        return gameweeks.tolist(), players
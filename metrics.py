@@ -0,0 +1,371 @@
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    """Monotonic counter, one value per combination of label values"""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def add(a, b):
+        return a + b
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self, values=None):
+        values = self.values() if values is None else values
+        for labels, value in sorted(values.items()):
+            yield self.name, _labels(self.labels, labels), value
+
+
+class Histogram:
+    """Cumulative histogram in the Prometheus bucket layout"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[0][i] += 1
+                    break
+            counts[1] += 1
+            counts[2] += value
+
+    def values(self):
+        with self._lock:
+            return {
+                labels: (list(c[0]), c[1], c[2]) for labels, c in self._values.items()
+            }
+
+    @staticmethod
+    def add(a, b):
+        return ([x + y for x, y in zip(a[0], b[0])], a[1] + b[1], a[2] + b[2])
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self, values=None):
+        values = self.values() if values is None else values
+        for labels, (buckets, count, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, buckets):
+                cumulative += bucket
+                yield (
+                    f"{self.name}_bucket",
+                    _labels(self.labels + ("le",), labels + (bound,)),
+                    cumulative,
+                )
+            yield (
+                f"{self.name}_bucket",
+                _labels(self.labels + ("le",), labels + ("+Inf",)),
+                count,
+            )
+            yield f"{self.name}_count", _labels(self.labels, labels), count
+            yield f"{self.name}_sum", _labels(self.labels, labels), total
+
+
+class Gauge:
+    """Value read from a callback at scrape time
+
+    The callback returns a dict mapping label value tuples to numbers.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, callback, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.callback = callback
+
+    def values(self):
+        return dict(self.callback())
+
+    def samples(self, values=None, labels=None):
+        values = self.values() if values is None else values
+        names = self.labels if labels is None else labels
+        for label_values, value in sorted(values.items()):
+            yield self.name, _labels(names, label_values), value
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Registry:
+    """The metrics of this process, or of every worker with share()
+
+    Shared, each process writes its values to {directory}/{pid}.json every
+    `interval` seconds and when scraped. A scrape of any worker then sums
+    the counters and histograms of all of them, those of exited workers
+    included, so totals never go backwards; gauges are reported per running
+    worker with a worker label.
+    """
+
+    DEAD = "exited.json"
+
+    def __init__(self):
+        self._metrics = []
+        self.directory = None
+        self._sync = None
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def share(self, directory):
+        """Aggregate the metrics of every process writing to `directory`"""
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+    def clear_shared(self):
+        """Forget every process's values, e.g. when the server starts"""
+        for file in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, file))
+
+    def forked(self, interval=5):
+        """Start over in a forked worker, then keep its file up to date
+
+        The worker's counters start from zero, rather than from the values
+        the parent recorded before forking, which the parent accounts for.
+        """
+        for metric in self._metrics:
+            if metric.kind != "gauge":
+                metric.reset()
+        self._sync = None
+        if self.directory is None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.dump()
+                except OSError as e:
+                    print(f"Failed to write metrics: {e}")
+
+        self._sync = threading.Thread(target=run, name="metrics", daemon=True)
+        self._sync.start()
+
+    def _write(self, path, state):
+        # label tuples become lists, JSON objects only have string keys
+        state = {
+            name: [[list(labels), value] for labels, value in values.items()]
+            for name, values in state.items()
+        }
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(f"{path}.tmp", path)
+
+    def dump(self):
+        """Write this process's values to the shared directory"""
+        self._write(
+            os.path.join(self.directory, f"{os.getpid()}.json"),
+            {metric.name: metric.values() for metric in self._metrics},
+        )
+
+    def _load(self, path):
+        with open(path) as f:
+            return {
+                name: {tuple(labels): value for labels, value in values}
+                for name, values in json.load(f).items()
+            }
+
+    def _combine(self, total, values, add):
+        for labels, value in values.items():
+            total[labels] = add(total[labels], value) if labels in total else value
+
+    def _shared(self):
+        """Summed counters and histograms, per worker gauges"""
+        self.dump()
+        kinds = {metric.name: metric for metric in self._metrics}
+        summed = {name: {} for name in kinds}
+        gauges = {name: {} for name in kinds}
+        # one scrape at a time folds exited workers into DEAD
+        with open(os.path.join(self.directory, ".lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            dead_path = os.path.join(self.directory, self.DEAD)
+            dead = self._load(dead_path) if os.path.exists(dead_path) else {}
+            folded = False
+            for file in os.listdir(self.directory):
+                pid, _, extension = file.partition(".")
+                if not pid.isdigit() or extension != "json":
+                    continue
+                pid = int(pid)
+                path = os.path.join(self.directory, file)
+                try:
+                    state = self._load(path)
+                except (OSError, ValueError):
+                    continue
+                if pid != os.getpid() and not _pid_alive(pid):
+                    for name, values in state.items():
+                        if name in kinds and kinds[name].kind != "gauge":
+                            self._combine(
+                                dead.setdefault(name, {}), values, kinds[name].add
+                            )
+                    os.remove(path)
+                    folded = True
+                    continue
+                for name, values in state.items():
+                    if name not in kinds:
+                        continue
+                    if kinds[name].kind == "gauge":
+                        for labels, value in values.items():
+                            gauges[name][labels + (str(pid),)] = value
+                    else:
+                        self._combine(summed[name], values, kinds[name].add)
+            if folded:
+                self._write(dead_path, dead)
+        for name, values in dead.items():
+            if name in summed:
+                self._combine(summed[name], values, kinds[name].add)
+        return summed, gauges
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format"""
+        summed = gauges = None
+        if self.directory is not None:
+            summed, gauges = self._shared()
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            if summed is None:
+                samples = metric.samples()
+            elif metric.kind == "gauge":
+                samples = metric.samples(
+                    gauges[metric.name], metric.labels + ("worker",)
+                )
+            else:
+                samples = metric.samples(summed[metric.name])
+            for name, labels, value in samples:
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+request_seconds = registry.register(
+    Histogram(
+        "fplmstr_request_seconds",
+        "Time spent handling a request",
+        ("route", "method", "status"),
+    )
+)
+response_bytes = registry.register(
+    Counter(
+        "fplmstr_response_bytes_total",
+        "Bytes of response bodies sent",
+        ("route",),
+    )
+)
+stage_seconds = registry.register(
+    Histogram(
+        "fplmstr_stage_seconds",
+        "Time spent in each stage of building a response",
+        ("stage",),
+    )
+)
+upstream_seconds = registry.register(
+    Histogram(
+        "fplmstr_upstream_seconds",
+        "Duration of calls to the FPL API",
+        ("endpoint", "outcome"),
+    )
+)
+
+_request_timings = threading.local()
+
+
+def start_request_timings():
+    """Start collecting stage timings for the current thread's request"""
+    _request_timings.stages = []
+
+
+def finish_request_timings():
+    """Stop collecting and return the (stage, seconds) pairs recorded"""
+    stages = getattr(_request_timings, "stages", None) or []
+    _request_timings.stages = None
+    return stages
+
+
+@contextmanager
+def stage(name):
+    """Record how long the enclosed block takes as stage `name`"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_seconds.observe(elapsed, name)
+        stages = getattr(_request_timings, "stages", None)
+        if stages is not None:
+            stages.append((name, elapsed))
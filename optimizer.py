@@ -0,0 +1,399 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+from scipy import sparse
+from scipy.optimize import Bounds, LinearConstraint, milp
+
+# element_type -> players of that position in a 15-man squad
+SQUAD_COMPOSITION = {1: 2, 2: 5, 3: 5, 4: 3}
+BUDGET = 1000
+# element_type -> (fewest, most) starters of that position
+FORMATION = {1: (1, 1), 2: (3, 5), 3: (2, 5), 4: (1, 3)}
+STARTERS = 11
+BENCH_WEIGHT = 0.1
+CAPTAIN_MULTIPLIER = 2
+LINEUP_COLUMNS = [
+    "position",
+    "starting",
+    "multiplier",
+    "is_captain",
+    "is_vice_captain",
+]
+
+
+class OptimizationError(RuntimeError):
+    """Raised when a problem has no feasible solution"""
+
+
+class BinaryProblem:
+    """Maximize a linear objective over 0/1 variables, in matrix form
+
+    Constraints are added as whole rows (or blocks of rows) of coefficients,
+    so building a problem costs a few NumPy operations whatever its size.
+    Rows are kept sparse, most constraints touch a few variables only.
+
+    Args:
+        objective (array) : Value of each variable when it is 1
+        upper (int or array) : Upper bound of the variables, raise it for
+            counters such as transfers made
+    """
+
+    def __init__(self, objective, upper=1):
+        self.objective = np.asarray(objective, dtype=np.float64)
+        self.size = len(self.objective)
+        self.upper = np.broadcast_to(upper, self.size).astype(np.float64)
+        self._rows = []
+        self._lower = []
+        self._upper = []
+
+    def add_rows(self, rows, lower=-np.inf, upper=np.inf):
+        """Add the constraints lower <= rows @ x <= upper
+
+        Args:
+            rows (array) : One row, or a (sparse) matrix with one row per
+                constraint
+            lower (float or array) : Lower bounds
+            upper (float or array) : Upper bounds
+        """
+        if not sparse.issparse(rows):
+            rows = np.atleast_2d(np.asarray(rows, dtype=np.float64))
+        rows = sparse.csr_matrix(rows, dtype=np.float64)
+        self._rows.append(rows)
+        self._lower.append(np.broadcast_to(lower, rows.shape[0]).astype(np.float64))
+        self._upper.append(np.broadcast_to(upper, rows.shape[0]).astype(np.float64))
+
+    def add_groups(
+        self, groups, lower=-np.inf, upper=np.inf, weights=None, columns=None
+    ):
+        """Bound the (weighted) count of variables in each group at once
+
+        Args:
+            groups (array) : Group label of every variable, e.g. its team
+            lower (float or array) : Lower bound per group, in sorted order
+            upper (float or array) : Upper bound per group, in sorted order
+            weights (array) : Coefficient of each variable, 1 by default
+            columns (array) : Variables the labels belong to, all by default
+
+        Returns the sorted group labels, one per row added.
+        """
+        labels, inverse = np.unique(np.asarray(groups), return_inverse=True)
+        if columns is None:
+            columns = np.arange(self.size)
+        data = np.ones(len(columns)) if weights is None else weights
+        rows = sparse.csr_matrix(
+            (data, (inverse.ravel(), columns)),
+            shape=(len(labels), self.size),
+        )
+        self.add_rows(rows, lower, upper)
+        return labels
+
+    def solve(self, time_limit=None, mip_gap=None, integral=None):
+        """Return (x, stats) for the best solution found, x as integers
+
+        Args:
+            time_limit (float) : Seconds after which the best solution so far
+                is returned
+            mip_gap (float) : Relative gap at which a solution is accepted
+            integral (array) : Which variables must be integers, all by
+                default; the others are continuous
+
+        Raises OptimizationError when no feasible solution is found, also
+        when the time limit runs out before the first one.
+        """
+        options = {}
+        if time_limit is not None:
+            options["time_limit"] = time_limit
+        if mip_gap is not None:
+            options["mip_rel_gap"] = mip_gap
+        constraints = []
+        if self._rows:
+            constraints.append(
+                LinearConstraint(
+                    sparse.vstack(self._rows, format="csr"),
+                    np.concatenate(self._lower),
+                    np.concatenate(self._upper),
+                )
+            )
+        start = time.perf_counter()
+        result = milp(
+            -self.objective,
+            constraints=constraints,
+            integrality=np.ones(self.size) if integral is None else integral,
+            bounds=Bounds(0, self.upper),
+            options=options,
+        )
+        stats = {
+            "status": result.message,
+            "optimal": result.status == 0,
+            "objective": None if result.x is None else round(float(-result.fun), 6),
+            "mip_gap": getattr(result, "mip_gap", None),
+            "nodes": getattr(result, "mip_node_count", None),
+            "seconds": round(time.perf_counter() - start, 4),
+            "variables": self.size,
+            "constraints": int(sum(rows.shape[0] for rows in self._rows)),
+        }
+        if result.x is None:
+            raise OptimizationError(f"No feasible solution: {result.message}")
+        return np.round(result.x).astype(np.int64), stats
+
+
+def squad_problem(
+    df,
+    feature,
+    composition=SQUAD_COMPOSITION,
+    max_per_team=3,
+    budget=BUDGET,
+    locked=(),
+    excluded=(),
+    lineup=False,
+    bench_weight=BENCH_WEIGHT,
+    captain_multiplier=CAPTAIN_MULTIPLIER,
+):
+    """Squad selection over the players of df, maximizing `feature`
+
+    With lineup, the starting XI and the captain are chosen in the same
+    model: variables [0, n) pick the squad, [n, 2n) the starters in a valid
+    FORMATION and [2n, 3n) the captain. Starters count fully, bench players
+    by bench_weight and the captain captain_multiplier times.
+
+    Args:
+        df (DataFrame) : Players with id, now_cost, element_type and team
+        feature (str) : Column to maximize, e.g. preds or top_ownership
+        composition (dict) : Number of players per element_type
+        max_per_team (int) : Most players allowed from one club
+        budget (int) : Most the squad may cost, in now_cost units
+        locked (list) : IDs of players the squad must include
+        excluded (list) : IDs of players the squad must leave out
+        lineup (bool) : Also pick the starting XI and captain
+        bench_weight (float) : Share of its value a bench player adds
+        captain_multiplier (float) : Points multiplier of the captain
+    """
+    missing = [label for label, count in composition.items() if count]
+    missing = set(missing) - set(df["element_type"].unique())
+    if missing:
+        raise OptimizationError(f"No players for positions {sorted(missing)}")
+    n = len(df)
+    value = df[feature].to_numpy(np.float64)
+    if lineup:
+        problem = BinaryProblem(
+            np.concatenate(
+                [
+                    bench_weight * value,
+                    (1 - bench_weight) * value,
+                    (captain_multiplier - 1) * value,
+                ]
+            )
+        )
+    else:
+        problem = BinaryProblem(value)
+    squad = np.arange(n)
+    problem.add_groups(
+        np.zeros(n), upper=budget, weights=df["now_cost"].to_numpy(), columns=squad
+    )
+    positions = df["element_type"].to_numpy()
+    labels = np.unique(positions)
+    counts = np.array([composition.get(label, 0) for label in labels])
+    problem.add_groups(positions, lower=counts, upper=counts, columns=squad)
+    problem.add_groups(df["team"].to_numpy(), upper=max_per_team, columns=squad)
+    ids = df["id"].to_numpy()
+    locked = np.flatnonzero(np.isin(ids, list(locked)))
+    if len(locked):
+        problem.add_groups(np.zeros(len(locked)), lower=len(locked), columns=locked)
+    excluded = np.flatnonzero(np.isin(ids, list(excluded)))
+    if len(excluded):
+        problem.add_groups(np.zeros(len(excluded)), upper=0, columns=excluded)
+    if lineup:
+        starters, captain = squad + n, squad + 2 * n
+        # starter <= squad and captain <= starter, one row per player each
+        for inner, outer in ((starters, squad), (captain, starters)):
+            rows = np.arange(n)
+            problem.add_rows(
+                sparse.csr_matrix(
+                    (
+                        np.concatenate([np.ones(n), -np.ones(n)]),
+                        (np.concatenate([rows, rows]), np.concatenate([inner, outer])),
+                    ),
+                    shape=(n, problem.size),
+                ),
+                upper=0,
+            )
+        problem.add_groups(
+            np.zeros(n), lower=STARTERS, upper=STARTERS, columns=starters
+        )
+        problem.add_groups(np.zeros(n), lower=1, upper=1, columns=captain)
+        low = [FORMATION.get(label, (0, 0))[0] for label in labels]
+        high = [FORMATION.get(label, (0, 0))[1] for label in labels]
+        problem.add_groups(positions, lower=low, upper=high, columns=starters)
+    return problem
+
+
+def _lineup_columns(squad, starting, captain, feature, captain_multiplier):
+    """Add FPL-style position, multiplier and captaincy columns to a squad
+
+    Starters come first by element_type, then the bench with the reserve
+    goalkeeper ahead of the outfield players by `feature`. The vice captain
+    is the best starter after the captain.
+    """
+    squad = squad.assign(
+        starting=starting.astype(bool),
+        is_captain=captain.astype(bool),
+    )
+    squad["is_vice_captain"] = False
+    vice = squad[squad["starting"] & ~squad["is_captain"]][feature].idxmax()
+    squad.loc[vice, "is_vice_captain"] = True
+    if float(captain_multiplier).is_integer():
+        captain_multiplier = int(captain_multiplier)
+    squad["multiplier"] = np.where(
+        squad["is_captain"], captain_multiplier, squad["starting"].astype(int)
+    )
+    order = squad.assign(
+        _bench=~squad["starting"],
+        _outfield=squad["element_type"] != 1,
+        _value=-squad[feature],
+    ).sort_values(["_bench", "_outfield", "element_type", "_value"], kind="stable")
+    squad = squad.loc[order.index].reset_index(drop=True)
+    squad["position"] = np.arange(1, len(squad) + 1)
+    return squad
+
+
+def select_squad(
+    df,
+    feature,
+    composition=SQUAD_COMPOSITION,
+    max_per_team=3,
+    budget=BUDGET,
+    locked=(),
+    excluded=(),
+    lineup=False,
+    bench_weight=BENCH_WEIGHT,
+    captain_multiplier=CAPTAIN_MULTIPLIER,
+    time_limit=None,
+    mip_gap=None,
+):
+    """Pick the squad maximizing `feature`, returns (squad rows, stats)
+
+    The rows keep the order and columns of df. With lineup the rows are in
+    pick order instead, with LINEUP_COLUMNS added. Works for the Fantasy, FPL
+    Challenge and top-ownership teams alike.
+
+    Args:
+        df (DataFrame) : Players with id, now_cost, element_type and team
+        feature (str) : Column to maximize
+        composition (dict) : Number of players per element_type
+        max_per_team (int) : Most players allowed from one club
+        budget (int) : Most the squad may cost, in now_cost units
+        locked (list) : IDs of players the squad must include
+        excluded (list) : IDs of players the squad must leave out
+        lineup (bool) : Also pick the starting XI and captain
+        bench_weight (float) : Share of its value a bench player adds
+        captain_multiplier (float) : Points multiplier of the captain
+        time_limit (float) : Seconds to search before settling
+        mip_gap (float) : Relative optimality gap to settle for
+    """
+    problem = squad_problem(
+        df,
+        feature,
+        composition,
+        max_per_team,
+        budget,
+        locked,
+        excluded,
+        lineup,
+        bench_weight,
+        captain_multiplier,
+    )
+    x, stats = problem.solve(time_limit=time_limit, mip_gap=mip_gap)
+    n = len(df)
+    selected = x[:n].astype(bool)
+    squad = df[selected].reset_index(drop=True)
+    if lineup:
+        squad = _lineup_columns(
+            squad,
+            x[n : 2 * n][selected],
+            x[2 * n :][selected],
+            feature,
+            captain_multiplier,
+        )
+    return squad, stats
+
+
+def select_squad_ids(df, feature, **options):
+    """select_squad() returning (picks, stats), cheap to send back from a
+    solver process; picks hold the id and, with lineup, LINEUP_COLUMNS"""
+    squad, stats = select_squad(df, feature, **options)
+    columns = ["id"] + (LINEUP_COLUMNS if options.get("lineup") else [])
+    return squad[columns].to_dict(orient="records"), stats
+
+
+class SolverBusy(Exception):
+    """Raised when the solver pool already holds as many jobs as it queues"""
+
+
+class SolverPool:
+    """Bounded pool of solver processes
+
+    Jobs run in separate processes so long solves never hold the GIL of a
+    web worker. At most `queue_size` jobs are running or waiting at once,
+    beyond that submit() raises SolverBusy right away. The processes are
+    started on first use, so a pool created before gunicorn forks isn't
+    shared between workers.
+
+    Args:
+        workers (int) : Number of solver processes
+        queue_size (int) : Most jobs running or waiting at once
+    """
+
+    def __init__(self, workers=2, queue_size=8):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._lock = threading.Lock()
+        self.pending = 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawned rather than forked from a multithreaded web worker
+                self._executor = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def submit(self, func, *args, **kwargs):
+        """Queue func(*args, **kwargs) and return its Future
+
+        The slot is only freed when the job really finishes, so a job whose
+        caller gave up waiting still counts against the queue.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise SolverBusy(f"{self.queue_size} optimizations already queued")
+        with self._lock:
+            self.pending += 1
+        try:
+            try:
+                future = self._get_executor().submit(func, *args, **kwargs)
+            except BrokenProcessPool:
+                # a solver process died, start over with fresh ones
+                self.shutdown()
+                future = self._get_executor().submit(func, *args, **kwargs)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return future
+
+    def _release(self):
+        with self._lock:
+            self.pending -= 1
+        self._slots.release()
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
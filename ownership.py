@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+
+PICK_FIELDS = ["position", "multiplier", "is_captain", "is_vice_captain"]
+
+
+def pick_rows(picks):
+    """Compact [element, position, multiplier, is_captain, is_vice_captain] rows
+
+    Args:
+        picks (list) : The "picks" list of the FPL entry picks endpoint
+    """
+    return [
+        [int(pick["element"])] + [int(pick.get(field, 0)) for field in PICK_FIELDS]
+        for pick in picks
+    ]
+
+
+class OwnershipCounter:
+    """Running ownership counts over any number of managers' picks
+
+    Each squad is reduced to integer arrays and added to per-element
+    counters, so memory stays flat however many managers are counted.
+
+    Args:
+        size (int) : Initial number of element IDs to make room for
+    """
+
+    def __init__(self, size=1024):
+        self.managers = 0
+        self.owners = np.zeros(size, dtype=np.int32)
+        self.starters = np.zeros(size, dtype=np.int32)
+        self.captains = np.zeros(size, dtype=np.int32)
+        self.multipliers = np.zeros(size, dtype=np.int32)
+        # the pick of the best ranked owner, kept to fill the pick columns
+        self.first_rank = np.full(size, np.iinfo(np.int64).max, dtype=np.int64)
+        self.first_pick = np.zeros((size, len(PICK_FIELDS)), dtype=np.int16)
+
+    def _grow(self, size):
+        extra = size - len(self.owners)
+        for name in ("owners", "starters", "captains", "multipliers"):
+            setattr(
+                self,
+                name,
+                np.concatenate([getattr(self, name), np.zeros(extra, np.int32)]),
+            )
+        self.first_rank = np.concatenate(
+            [self.first_rank, np.full(extra, np.iinfo(np.int64).max, dtype=np.int64)]
+        )
+        self.first_pick = np.concatenate(
+            [self.first_pick, np.zeros((extra, len(PICK_FIELDS)), dtype=np.int16)]
+        )
+
+    def add(self, picks, rank=None):
+        """Count one manager's squad
+
+        Args:
+            picks (list) : The "picks" list of the FPL entry picks endpoint
+            rank (int) : Position of the manager in the crawl, lower wins the
+                pick columns; defaults to the order managers are added in
+        """
+        self.add_rows(pick_rows(picks), rank)
+
+    def add_rows(self, rows, rank=None):
+        """Count one manager's squad from its compact pick rows
+
+        Args:
+            rows (list) : pick_rows() output, as stored in crawl checkpoints
+            rank (int) : Position of the manager in the crawl
+        """
+        rank = self.managers if rank is None else rank
+        rows = np.asarray(rows, dtype=np.int64).reshape(-1, 1 + len(PICK_FIELDS))
+        element = rows[:, 0]
+        values = rows[:, 1:].astype(np.int16)
+        if len(element) and element.max() >= len(self.owners):
+            self._grow(max(element.max() + 1, 2 * len(self.owners)))
+        multiplier = values[:, 1]
+        # a squad holds each element once, so plain fancy indexing is safe
+        self.owners[element] += 1
+        self.starters[element] += multiplier > 0
+        self.captains[element] += values[:, 2]
+        self.multipliers[element] += multiplier
+        better = rank < self.first_rank[element]
+        self.first_rank[element[better]] = rank
+        self.first_pick[element[better]] = values[better]
+        self.managers += 1
+
+    def summary(self):
+        """Per-element counts and shares of the managers counted so far"""
+        element = np.flatnonzero(self.owners)
+        managers = max(self.managers, 1)
+        summary = pd.DataFrame({"element": element})
+        for field, values in zip(PICK_FIELDS, self.first_pick[element].T):
+            summary[field] = values
+        summary["is_captain"] = summary["is_captain"].astype(bool)
+        summary["is_vice_captain"] = summary["is_vice_captain"].astype(bool)
+        summary["owned"] = self.owners[element]
+        summary["starting"] = self.starters[element]
+        summary["captain"] = self.captains[element]
+        summary["ownership"] = self.owners[element] / managers
+        summary["captaincy"] = self.captains[element] / managers
+        summary["effective_ownership"] = self.multipliers[element] / managers
+        return summary
+
+
+def ownership_frame(counter, players_df, columns):
+    """Join the counted elements with the player frame in one merge
+
+    Adds top_ownership, the percentage of managers owning each player, which
+    is the objective of the template team.
+
+    Args:
+        counter (OwnershipCounter) : Counts of the crawled managers
+        players_df (DataFrame) : Player snapshot of the gameweek
+        columns (list) : Player columns to keep, must include id
+    """
+    summary = counter.summary()
+    frame = summary.merge(players_df[columns], left_on="element", right_on="id")
+    frame["top_ownership"] = frame["ownership"] * 100
+    frame["captaincy"] = frame["captaincy"] * 100
+    frame["effective_ownership"] = frame["effective_ownership"] * 100
+    return frame.drop(columns=["owned", "starting", "captain", "ownership"])
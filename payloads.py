@@ -0,0 +1,75 @@
+import gzip
+import hashlib
+import threading
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+
+class RenderedPayload:
+    """Serialized response body plus its precompressed variants"""
+
+    def __init__(self, body, content_type="application/json"):
+        self.content_type = content_type
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.bodies = {"identity": body, "gzip": gzip.compress(body, 6)}
+        if brotli is not None:
+            self.bodies["br"] = brotli.compress(body, quality=5)
+
+    @property
+    def encodings(self):
+        return list(self.bodies)
+
+
+class PayloadCache:
+    """Keeps the latest rendered payload of each endpoint per data version
+
+    A payload is rendered the first time a version is requested and reused
+    until the version changes, so repeated requests only copy bytes.
+    """
+
+    def __init__(self):
+        self._payloads = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def peek(self, name, version):
+        """Return the cached payload for this version, or None"""
+        cached = self._payloads.get(name)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        return None
+
+    def get(self, name, version, render):
+        """Return the payload for this version, rendering it if needed
+
+        Args:
+            name (str) : Endpoint the payload belongs to
+            version (hashable) : Stamp of the data the payload is built from
+            render (callable) : Returns the response body as bytes
+        """
+        payload = self.peek(name, version)
+        if payload is not None:
+            return payload
+        with self._lock:
+            lock = self._locks.setdefault(name, threading.Lock())
+        # only one thread renders a given endpoint, the rest wait for it
+        with lock:
+            payload = self.peek(name, version)
+            if payload is None:
+                payload = RenderedPayload(render())
+                self._payloads[name] = (version, payload)
+        return payload
+
+    def nbytes(self):
+        """Memory held by the rendered bodies, all encodings included"""
+        return sum(
+            len(body)
+            for _, payload in list(self._payloads.values())
+            for body in payload.bodies.values()
+        )
+
+    def clear(self):
+        self._payloads.clear()
@@ -0,0 +1,258 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import storage
+
+PIPELINE_WORKERS = 4
+PIPELINE_RETRIES = 2
+PIPELINE_RETRY_DELAY = 5
+STATE_FILE = "pipeline_state.json"
+REPORT_FILE = "pipeline_report.json"
+
+
+def load_report(directory):
+    """Report of the last run written to `directory`, empty if none"""
+    path = os.path.join(directory, REPORT_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def failed_stages(report):
+    """Names of the stages that failed or were blocked in a report"""
+    return [
+        name
+        for name, result in report.get("stages", {}).items()
+        if result["status"] in ("failed", "blocked")
+    ]
+
+
+class Stage:
+    """One step of the pipeline
+
+    Args:
+        name (str) : Unique name of the stage
+        func (callable) : Runs the stage, called without arguments
+        inputs (list) : Datasets the stage reads
+        outputs (list) : Datasets the stage writes
+        sources (list) : Upstream sources the stage reads, part of its
+            fingerprint next to its inputs
+        fetches (bool) : Reads from the network in ways no source captures,
+            so it runs even when its inputs are unchanged
+        retries (int) : Extra attempts after a failure
+    """
+
+    def __init__(
+        self,
+        name,
+        func,
+        inputs=(),
+        outputs=(),
+        sources=(),
+        fetches=False,
+        retries=PIPELINE_RETRIES,
+    ):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.sources = list(sources)
+        self.fetches = fetches
+        self.retries = retries
+
+
+class Pipeline:
+    """Runs stages concurrently in dependency order
+
+    A stage depends on the stages writing its inputs. Stages without a
+    pending dependency run at once, up to `workers` at a time. A stage is
+    skipped when the content of its inputs and the digests of its sources
+    are the same as on its last successful run and its outputs exist, so an
+    unchanged upstream file skips everything downstream of it. Failed
+    stages are retried, and stages depending on one that still fails are
+    reported as blocked while the rest of the pipeline carries on.
+
+    Args:
+        directory (str) : Data directory the snapshots and the run state are
+            stored in
+        datasets (dict) : Dataset name -> callable returning the snapshot
+            names it is made of, called when the stage is scheduled
+        sources (dict) : Source name -> callable returning a digest of its
+            current content, e.g. after a conditional GET
+        workers (int) : Most stages running at once
+        report_directory (str) : Where the report of the run is written,
+            `directory` when None
+    """
+
+    def __init__(
+        self,
+        directory,
+        datasets,
+        sources=None,
+        workers=PIPELINE_WORKERS,
+        report_directory=None,
+    ):
+        self.directory = directory
+        self.report_directory = report_directory or directory
+        self.datasets = datasets
+        self.sources = sources or {}
+        self.workers = workers
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, func, **options):
+        """Add a stage, see Stage for the options"""
+        if name in self.stages:
+            raise ValueError(f"Duplicate stage {name}")
+        unknown = set(options.get("sources", ())) - set(self.sources)
+        if unknown:
+            raise ValueError(f"Unknown sources: {', '.join(sorted(unknown))}")
+        self.stages[name] = Stage(name, func, **options)
+        return self.stages[name]
+
+    def dependencies(self, stage):
+        """Names of the stages writing one of the inputs of `stage`"""
+        return {
+            other.name
+            for other in self.stages.values()
+            if other is not stage and set(other.outputs) & set(stage.inputs)
+        }
+
+    def _paths(self, datasets):
+        return [
+            storage.resolve(self.directory, snapshot)
+            for dataset in datasets
+            for snapshot in self.datasets[dataset]()
+        ]
+
+    def _fingerprint(self, stage):
+        digests = {}
+        for path in self._paths(stage.inputs):
+            if not os.path.exists(path):
+                digests[os.path.basename(path)] = None
+                continue
+            with open(path, "rb") as f:
+                digests[os.path.basename(path)] = hashlib.sha1(f.read()).hexdigest()
+        for source in stage.sources:
+            digests[f"source:{source}"] = self.sources[source]()
+        return digests
+
+    def _load(self, name):
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def _save(self, directory, name, data):
+        path = os.path.join(directory, name)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.replace(f"{path}.tmp", path)
+
+    def _execute(self, stage, state, force):
+        """Run a stage with retries, returns its report entry"""
+        start = time.perf_counter()
+        for attempt in range(1, stage.retries + 2):
+            try:
+                # probing the sources may hit the network, so it is retried too
+                fingerprint = None if stage.fetches else self._fingerprint(stage)
+                if (
+                    fingerprint is not None
+                    and not force
+                    and state.get(stage.name) == fingerprint
+                    and all(os.path.exists(p) for p in self._paths(stage.outputs))
+                ):
+                    print(f"Skipping {stage.name}, its inputs are unchanged")
+                    return {
+                        "status": "skipped",
+                        "attempts": 0,
+                        "seconds": round(time.perf_counter() - start, 3),
+                    }
+                stage.func()
+            except Exception as e:
+                print(f"Stage {stage.name} failed (attempt {attempt}): {e}")
+                error = "".join(traceback.format_exception_only(type(e), e)).strip()
+                if attempt <= stage.retries:
+                    time.sleep(PIPELINE_RETRY_DELAY * attempt)
+                    continue
+                return {
+                    "status": "failed",
+                    "attempts": attempt,
+                    "seconds": round(time.perf_counter() - start, 3),
+                    "error": error,
+                }
+            if fingerprint is not None:
+                with self._lock:
+                    state[stage.name] = fingerprint
+            return {
+                "status": "ok",
+                "attempts": attempt,
+                "seconds": round(time.perf_counter() - start, 3),
+            }
+
+    def run(self, only=None, force=False):
+        """Run the pipeline and write its report, returns the report
+
+        Args:
+            only (list) : Run just these stages, e.g. the failed ones of the
+                last run; the others are assumed to be up to date
+            force (bool) : Run stages even when their inputs are unchanged
+        """
+        unknown = set(only or ()) - set(self.stages)
+        if unknown:
+            raise ValueError(f"Unknown stages: {', '.join(sorted(unknown))}")
+        selected = set(only or self.stages)
+        state = self._load(STATE_FILE)
+        results = {}
+        pending = {name for name in self.stages if name in selected}
+        started = time.time()
+        with ThreadPoolExecutor(self.workers) as executor:
+            running = {}
+            while pending or running:
+                for name in sorted(pending):
+                    deps = self.dependencies(self.stages[name]) & selected
+                    if any(
+                        results.get(dep, {}).get("status") in ("failed", "blocked")
+                        for dep in deps
+                    ):
+                        results[name] = {"status": "blocked", "attempts": 0}
+                        pending.discard(name)
+                    elif all(dep in results for dep in deps):
+                        running[
+                            executor.submit(
+                                self._execute, self.stages[name], state, force
+                            )
+                        ] = name
+                        pending.discard(name)
+                if not running:
+                    if pending:
+                        raise ValueError(f"Stages in a cycle: {sorted(pending)}")
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+        self._save(self.directory, STATE_FILE, state)
+        report = {
+            "directory": os.path.relpath(self.directory, self.report_directory),
+            "started_at": started,
+            "seconds": round(time.time() - started, 3),
+            "stages": results,
+        }
+        self._save(self.report_directory, REPORT_FILE, report)
+        for name, result in results.items():
+            print(
+                f"{name:>24} {result['status']:<8} "
+                f"{result.get('seconds', 0):>8.2f}s  attempts {result['attempts']}"
+            )
+        return report
+
+    def failed(self):
+        """Names of the stages that failed or were blocked in the last run"""
+        return failed_stages(load_report(self.report_directory))
@@ -0,0 +1,183 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+class QueryError(ValueError):
+    """Raised when a player query has invalid parameters"""
+
+
+class PlayerIndex:
+    """Columnar, pre-indexed copy of the merged player frame
+
+    Every column is stored once as an object array of JSON-ready values, and
+    numeric columns additionally as float arrays for filtering and sorting,
+    so a query only touches the rows and columns it returns.
+    """
+
+    filters = {
+        "element_type": "element_type",
+        "team": "team",
+    }
+    ranges = {
+        "cost": "now_cost",
+        "preds": "preds",
+        "xp": "xp_horizon",
+    }
+
+    def __init__(self, df):
+        self.size = len(df)
+        self.fields = list(df.columns)
+        clean = df.replace({np.nan: None})
+        self.values = {}
+        for column in self.fields:
+            values = np.empty(self.size, dtype=object)
+            values[:] = clean[column].tolist()
+            self.values[column] = values
+        self.numeric = {
+            column: pd.to_numeric(df[column], errors="coerce").to_numpy(float)
+            for column in self.fields
+            if pd.api.types.is_numeric_dtype(df[column])
+            and not pd.api.types.is_bool_dtype(df[column])
+        }
+        # per-gameweek predictions, summed over ?horizon=N into xp_horizon
+        self.horizon = [column for column in self.fields if column.startswith("xp_gw")]
+        self.horizon.sort(key=lambda column: int(column[len("xp_gw") :]))
+        self.horizon_matrix = (
+            np.column_stack([self.numeric[column] for column in self.horizon])
+            if self.horizon
+            else np.empty((self.size, 0))
+        )
+        self.groups = {
+            column: {
+                key: np.flatnonzero(df[column].to_numpy() == key)
+                for key in df[column].unique()
+            }
+            for column in self.filters.values()
+        }
+
+    def _columns(self, args):
+        """Values and numeric arrays, with xp_horizon when a horizon is asked"""
+        if "horizon" not in args:
+            return self.values, self.numeric
+        horizon = _parse_number("horizon", args["horizon"], int)
+        if not 1 <= horizon <= len(self.horizon):
+            raise QueryError(
+                f"horizon must be between 1 and {len(self.horizon)}"
+                if self.horizon
+                else "No predictions beyond the next gameweek"
+            )
+        # NaN for players missing from the horizon snapshot
+        xp = np.round(self.horizon_matrix[:, :horizon].sum(axis=1), 2)
+        values = np.empty(self.size, dtype=object)
+        values[:] = [None if np.isnan(x) else float(x) for x in xp]
+        return {**self.values, "xp_horizon": values}, {
+            **self.numeric,
+            "xp_horizon": xp,
+        }
+
+    def _selection(self, args, numeric):
+        selected = None
+        for param, column in self.filters.items():
+            if param not in args:
+                continue
+            keys = [_parse_number(param, key, int) for key in args[param].split(",")]
+            groups = self.groups[column]
+            rows = np.concatenate(
+                [groups.get(key, np.empty(0, dtype=np.int64)) for key in keys]
+            )
+            mask = np.zeros(self.size, dtype=bool)
+            mask[rows] = True
+            selected = mask if selected is None else selected & mask
+        for param, column in self.ranges.items():
+            for bound, compare in (("min", np.greater_equal), ("max", np.less_equal)):
+                key = f"{bound}_{param}"
+                if key not in args:
+                    continue
+                limit = _parse_number(key, args[key], float)
+                if column not in numeric:
+                    raise QueryError(f"'{key}' needs a horizon")
+                mask = compare(numeric[column], limit)
+                selected = mask if selected is None else selected & mask
+        if selected is None:
+            return np.arange(self.size)
+        return np.flatnonzero(selected)
+
+    def _order(self, rows, sort, numeric):
+        keys = []
+        for key in reversed(sort.split(",")):
+            column = key.lstrip("-")
+            if column not in numeric:
+                raise QueryError(f"Can't sort by '{column}'")
+            values = numeric[column][rows]
+            # NaN sorts last in both directions
+            keys.append(-values if key.startswith("-") else values)
+        return rows[np.lexsort(keys)]
+
+    def query(self, args):
+        """Filter, sort and page through the players
+
+        Args:
+            args (dict) : Query string parameters, all optional:
+                fields, element_type, team, min_cost, max_cost, min_preds,
+                max_preds, horizon, min_xp, max_xp, sort, limit and cursor.
+                horizon=N adds xp_horizon, the predictions summed over the
+                next N gameweeks.
+        """
+        values, numeric = self._columns(args)
+        fields = self.fields + (["xp_horizon"] if "xp_horizon" in values else [])
+        if args.get("fields"):
+            fields = args["fields"].split(",")
+            unknown = [field for field in fields if field not in values]
+            if unknown:
+                raise QueryError(f"Unknown fields: {', '.join(unknown)}")
+        rows = self._selection(args, numeric)
+        if args.get("sort"):
+            rows = self._order(rows, args["sort"], numeric)
+        total = len(rows)
+        start = _parse_number("cursor", args.get("cursor", 0), int)
+        limit = _parse_number("limit", args.get("limit", total), int)
+        if start < 0 or limit < 0:
+            raise QueryError("cursor and limit can't be negative")
+        page = rows[start : start + limit]
+        columns = [values[field][page].tolist() for field in fields]
+        end = start + len(page)
+        return {
+            "players": [dict(zip(fields, row)) for row in zip(*columns)],
+            "total": total,
+            "next_cursor": str(end) if end < total else None,
+        }
+
+
+# the query string parameters PlayerIndex.query() understands
+QUERY_PARAMS = frozenset(
+    ["fields", "horizon", "sort", "limit", "cursor", *PlayerIndex.filters]
+    + [f"{bound}_{param}" for bound in ("min", "max") for param in PlayerIndex.ranges]
+)
+
+
+def _parse_number(name, value, kind):
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        raise QueryError(f"Invalid value for '{name}': {value}")
+
+
+class PlayerIndexCache:
+    """Holds the PlayerIndex of the latest data version"""
+
+    def __init__(self):
+        self._current = None
+        self._lock = threading.Lock()
+
+    def get(self, version, build):
+        current = self._current
+        if current is not None and current[0] == version:
+            return current[1]
+        with self._lock:
+            current = self._current
+            if current is None or current[0] != version:
+                current = (version, PlayerIndex(build()))
+                self._current = current
+        return current[1]
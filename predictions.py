@@ -0,0 +1,227 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from resources import LazyResource
+
+# Features each position's model was trained on, element_type -> columns
+POSITION_FEATURES = {
+    1: [
+        "ep_this",
+        "form",
+        "value_form",
+        "transfers_in_event",
+        "clean_sheets",
+        "total_points",
+        "value_season",
+        "bps",
+    ],
+    2: [
+        "ep_this",
+        "form",
+        "value_form",
+        "points_per_game",
+        "transfers_in_event",
+        "clean_sheets_per_90",
+        "total_points",
+    ],
+    3: [
+        "ep_this",
+        "form",
+        "value_form",
+        "points_per_game",
+        "transfers_in_event",
+        "expected_goal_involvements",
+        "total_points",
+        "ict_index",
+        "goals_scored",
+    ],
+    4: [
+        "ep_this",
+        "form",
+        "value_form",
+        "points_per_game",
+        "transfers_in_event",
+        "bonus",
+        "bps",
+        "influence",
+        "goals_scored",
+        "total_points",
+        "expected_goals",
+    ],
+}
+
+
+class PredictionEngine:
+    """Runs one model per position over the rows of that position only
+
+    The numeric FPL columns, many of which come as strings, are coerced to a
+    single float matrix once and every model reads its columns from it. Rows
+    of positions without a model predict 0.
+
+    Args:
+        workers (int) : Number of positions predicted at once
+    """
+
+    def __init__(self, workers=4):
+        self.workers = workers
+        self._models = {}
+
+    def register(self, position, model, features):
+        """Predict the rows of `position` with `model`
+
+        Args:
+            position (int) : element_type the model scores
+            model (object) : Estimator with predict(), or a LazyResource of one
+            features (list) : Columns the model takes, in training order
+        """
+        self._models[position] = (model, list(features))
+
+    @property
+    def features(self):
+        """Every column used by at least one model, each once"""
+        columns = []
+        for _, features in self._models.values():
+            columns += [column for column in features if column not in columns]
+        return columns
+
+    def feature_matrix(self, df):
+        """Coerce the model columns of df to one float64 matrix"""
+        return df[self.features].astype(np.float64).to_numpy()
+
+    def predict(self, df):
+        """Return the rounded predictions for every row of df, in order
+
+        Args:
+            df (DataFrame) : Elements frame with element_type and the features
+        """
+        matrix = self.feature_matrix(df)
+        column = {name: i for i, name in enumerate(self.features)}
+        element_type = df["element_type"].to_numpy()
+        preds = np.zeros(len(df), dtype=np.float64)
+
+        def run(position):
+            model, features = self._models[position]
+            if isinstance(model, LazyResource):
+                model = model.get()
+            rows = np.flatnonzero(element_type == position)
+            if len(rows) == 0:
+                return
+            X = pd.DataFrame(
+                matrix[np.ix_(rows, [column[name] for name in features])],
+                columns=features,
+            )
+            # each position writes a disjoint set of rows
+            preds[rows] = np.round(model.predict(X))
+
+        with ThreadPoolExecutor(self.workers) as executor:
+            list(executor.map(run, self._models))
+        return preds
+
+    def update(self, df, previous=None):
+        """Predict only the rows whose features changed since `previous`
+
+        A row keeps its previous prediction when previous has a row with the
+        same id, element_type and feature values.
+
+        Args:
+            df (DataFrame) : Elements frame with id, element_type and the
+                features
+            previous (DataFrame) : Earlier scored frame with the same columns
+                and preds, or None to predict every row
+
+        Returns the predictions for every row of df, in order, and the number
+        of rows that were predicted.
+        """
+        preds = np.zeros(len(df), dtype=np.float64)
+        stale = np.ones(len(df), dtype=bool)
+        if previous is not None and len(previous):
+            columns = ["element_type"] + self.features
+            before = previous.set_index("id").reindex(df["id"])
+            old = before[columns].astype(np.float64).to_numpy()
+            new = df[columns].astype(np.float64).to_numpy()
+            same = (old == new) | (np.isnan(old) & np.isnan(new))
+            # ids missing from previous have NaN in every column, so are stale
+            stale = ~same.all(axis=1)
+            preds[~stale] = before["preds"].to_numpy(np.float64)[~stale]
+        if stale.any():
+            preds[stale] = self.predict(df[stale])
+        return preds, int(stale.sum())
+
+    def rescore(self, frames):
+        """Predict many snapshots, e.g. past gameweeks, in one pass per model
+
+        Args:
+            frames (list) : Elements frames to score
+
+        Returns the list of prediction arrays, one per frame.
+        """
+        if not frames:
+            return []
+        preds = self.predict(pd.concat(frames, ignore_index=True))
+        return np.split(preds, np.cumsum([len(frame) for frame in frames])[:-1])
+
+
+MAX_HORIZON = 8
+# Scale applied to a prediction per fixture of each FPL difficulty rating;
+# a double gameweek adds up two fixtures, a blank one scores 0
+DIFFICULTY_WEIGHTS = {1: 1.3, 2: 1.15, 3: 1.0, 4: 0.85, 5: 0.7}
+
+
+def fixture_matrix(fixtures, gameweeks):
+    """Team x gameweek matrix of summed fixture weights
+
+    Row t is team ID t, so a player's row is looked up by its team directly.
+
+    Args:
+        fixtures (DataFrame) : Fixtures with event, team_h, team_a,
+            team_h_difficulty and team_a_difficulty
+        gameweeks (list) : Gameweeks to make columns for, in order
+    """
+    fixtures = fixtures.dropna(subset=["event"])
+    fixtures = fixtures[fixtures["event"].isin(gameweeks)]
+    column = {gameweek: i for i, gameweek in enumerate(gameweeks)}
+    teams = int(np.max(fixtures[["team_h", "team_a"]].to_numpy(), initial=0)) + 1
+    weights = np.zeros(max(DIFFICULTY_WEIGHTS) + 1)
+    for difficulty, weight in DIFFICULTY_WEIGHTS.items():
+        weights[difficulty] = weight
+    matrix = np.zeros((teams, len(gameweeks)))
+    columns = fixtures["event"].astype(int).map(column).to_numpy()
+    for side in ("h", "a"):
+        np.add.at(
+            matrix,
+            (fixtures[f"team_{side}"].to_numpy(int), columns),
+            weights[fixtures[f"team_{side}_difficulty"].to_numpy(int)],
+        )
+    return matrix
+
+
+def horizon_predictions(players, fixtures, start, horizon=MAX_HORIZON):
+    """Dense player x gameweek predictions over the next `horizon` gameweeks
+
+    Each player's single-gameweek prediction is scaled by the fixture weights
+    of their team in each gameweek. Returns a frame with id and one float32
+    xp_gw{n} column per gameweek.
+
+    Args:
+        players (DataFrame) : Player snapshot with id, team and preds
+        fixtures (DataFrame) : Fixtures of the season
+        start (int) : First gameweek of the horizon
+        horizon (int) : Number of gameweeks, 1 to MAX_HORIZON
+    """
+    if not 1 <= horizon <= MAX_HORIZON:
+        raise ValueError(f"horizon must be between 1 and {MAX_HORIZON}")
+    gameweeks = [gw for gw in range(start, start + horizon) if gw <= 38]
+    matrix = fixture_matrix(fixtures, gameweeks)
+    team = players["team"].to_numpy(int)
+    # teams without any fixture in the horizon are off the end of the matrix
+    known = team < len(matrix)
+    factors = np.zeros((len(players), len(gameweeks)))
+    factors[known] = matrix[team[known]]
+    xp = players["preds"].to_numpy(np.float64)[:, None] * factors
+    frame = pd.DataFrame(
+        xp.astype(np.float32), columns=[f"xp_gw{gw}" for gw in gameweeks]
+    )
+    frame.insert(0, "id", players["id"].to_numpy())
+    return frame
@@ -0,0 +1,77 @@
+import threading
+
+
+class LazyResource:
+    """Value built on first use and kept for the rest of the process
+
+    Failed loads aren't cached, so the next get() tries again. Tests inject a
+    value with set() so the loader never runs.
+
+    Args:
+        name (str) : Name used in log messages
+        loader (callable) : Builds the value, called without arguments
+    """
+
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+        self._value = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def get(self):
+        if self._loaded:
+            return self._value
+        with self._lock:
+            if not self._loaded:
+                self._value = self.loader()
+                self._loaded = True
+        return self._value
+
+    def set(self, value):
+        """Use value instead of loading it"""
+        with self._lock:
+            self._value = value
+            self._loaded = True
+
+    def reset(self):
+        """Forget the value, the next get() loads it again"""
+        with self._lock:
+            self._value = None
+            self._loaded = False
+
+
+class ResourceRegistry:
+    """Named lazy resources, loaded on first use or all at once by warm_up()"""
+
+    def __init__(self):
+        self._resources = {}
+
+    def register(self, name, loader):
+        resource = self._resources[name] = LazyResource(name, loader)
+        return resource
+
+    def __contains__(self, name):
+        return name in self._resources
+
+    def get(self, name):
+        return self._resources[name].get()
+
+    def inject(self, **values):
+        """Replace resources by name, e.g. inject(game_data=fixture)"""
+        for name, value in values.items():
+            self._resources[name].set(value)
+
+    def reset(self, *names):
+        """Forget the named resources, or every resource without names"""
+        for name in names or self._resources:
+            self._resources[name].reset()
+
+    def warm_up(self, *names):
+        """Load the named resources, or every resource without names"""
+        for name in names or self._resources:
+            self._resources[name].get()
@@ -0,0 +1,138 @@
+import threading
+from collections import OrderedDict
+from functools import partial
+
+from history import PlayerHistory
+from payloads import PayloadCache
+from player_index import PlayerIndexCache
+from snapshots import PublishedSnapshots, snapshot_cache
+
+
+class UnknownSeason(ValueError):
+    """Raised when a request names a season there is no data directory for"""
+
+
+class Season:
+    """One season's published snapshots and everything served from them
+
+    Args:
+        name (str) : Season, e.g. 2023-24
+        root (str) : Its data directory, see storage.SEASONS
+    """
+
+    def __init__(self, name, root):
+        self.name = name
+        self.root = root
+        self.snapshots = PublishedSnapshots(root)
+        self.history = PlayerHistory(self.snapshots.directory)
+        self.payloads = PayloadCache()
+        self.players = PlayerIndexCache()
+
+    @property
+    def directory(self):
+        """Snapshot version currently served"""
+        return self.snapshots.directory
+
+    def nbytes(self):
+        """Memory held by the season's cached frames and rendered payloads"""
+        return snapshot_cache.nbytes(self.root) + self.payloads.nbytes()
+
+
+class SeasonCache:
+    """Seasons loaded on first use and kept in LRU order within a memory budget
+
+    The default season is never evicted. trim() evicts the least recently
+    used of the others until they fit in `max_bytes` together, dropping
+    their frames from the snapshot cache along with their payloads and
+    indexes; the next request for an evicted season loads it again.
+
+    Args:
+        directories (dict) : Season -> data directory
+        default (str) : Season of requests that don't name one
+        max_bytes (int) : Memory the seasons other than the default may hold
+    """
+
+    def __init__(self, directories, default, max_bytes):
+        self.directories = dict(directories)
+        self.default = default
+        self.max_bytes = max_bytes
+        self.loads = 0
+        self.evictions = 0
+        self._seasons = OrderedDict()
+        self._watch = None
+        self._lock = threading.Lock()
+
+    def get(self, name=None):
+        """Return a season, loading it on first use
+
+        Raises UnknownSeason for a season without a data directory.
+        """
+        name = name or self.default
+        if name not in self.directories:
+            raise UnknownSeason(
+                f"Unknown season '{name}', one of {', '.join(self.directories)}"
+            )
+        with self._lock:
+            season = self._seasons.get(name)
+            if season is None:
+                season = self._seasons[name] = Season(name, self.directories[name])
+                self.loads += 1
+                if self._watch is not None:
+                    self._start_watch(season)
+            self._seasons.move_to_end(name)
+        return season
+
+    def loaded(self):
+        with self._lock:
+            return list(self._seasons.values())
+
+    def watch(self, interval, prepare=None, retire=None):
+        """Follow the publishes of every loaded season, see PublishedSnapshots
+
+        `prepare` is called with the new directory and the season.
+        """
+        with self._lock:
+            self._watch = (interval, prepare, retire)
+            for season in self._seasons.values():
+                self._start_watch(season)
+
+    def forked(self):
+        """Stop watching the seasons a forked worker loads from now on
+
+        A worker inherits the master's watch settings, whose retire callback
+        may signal the master; seasons the worker loads itself keep the
+        version they loaded until the worker is replaced.
+        """
+        # the watch threads themselves don't survive the fork
+        self._watch = None
+
+    def _start_watch(self, season):
+        interval, prepare, retire = self._watch
+        if prepare is not None:
+            prepare = partial(prepare, season=season)
+        season.snapshots.watch(interval, prepare, retire)
+
+    def trim(self):
+        """Evict least recently used seasons until the others fit the budget"""
+        others = [season for season in self.loaded() if season.name != self.default]
+        sizes = [season.nbytes() for season in others]
+        used = sum(sizes)
+        for season, size in zip(others, sizes):
+            if used <= self.max_bytes:
+                break
+            self.evict(season.name)
+            used -= size
+
+    def evict(self, name):
+        """Forget a season and drop its cached frames
+
+        Requests still running on it carry on with their reference to it.
+        """
+        with self._lock:
+            season = self._seasons.pop(name, None)
+        if season is None:
+            return
+        season.snapshots.stop()
+        snapshot_cache.evict(season.root, recursive=True)
+        self.evictions += 1
+        print(f"Evicted season {name}")
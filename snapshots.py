@@ -0,0 +1,220 @@
+import os
+import threading
+
+import metrics
+import storage
+
+
+class SnapshotCache:
+    """Process-wide cache of the data frames published by fetch_data.py
+
+    Each file is read once and kept in memory until its mtime or size
+    changes on disk. Column subsets are cached separately, so callers that
+    need a few columns of a columnar snapshot never load the rest. A file
+    hard linked into a new snapshot version is found under its new path
+    without being read again. Cached frames are shared between requests, so
+    callers must treat them as read-only.
+    """
+
+    def __init__(self, reader=storage.read_path):
+        self._reader = reader
+        self._entries = {}
+        # (device, inode, signature, columns) -> entry, shared by every path
+        # the file is linked at
+        self._files = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def signature(path):
+        """Cheap version stamp of a file, changes whenever it is rewritten"""
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _entry(self, path, columns=None):
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        columns = None if columns is None else tuple(columns)
+        key = (path, columns)
+        file = (stat.st_dev, stat.st_ino, signature, columns)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["signature"] != signature:
+                # rewritten since it was read: its old frame is only kept
+                # while another path still links to the old file
+                del self._entries[key]
+                if all(other is not entry for other in self._entries.values()):
+                    self._files.pop(entry["file"], None)
+                entry = None
+            if entry is None:
+                entry = self._files.get(file)
+            if entry is not None:
+                self._entries[key] = entry
+                self.hits += 1
+                return entry
+            self.misses += 1
+        with metrics.stage("load"):
+            frame = self._reader(path, columns)
+        entry = {
+            "file": file,
+            "signature": signature,
+            "frame": frame,
+            "derived": {},
+            "nbytes": int(frame.memory_usage(deep=True).sum()),
+        }
+        with self._lock:
+            self._entries[key] = self._files[file] = entry
+        return entry
+
+    def load(self, path, columns=None):
+        """Return the frame stored at path, reading it only if it changed
+
+        Args:
+            path (str) : Absolute path of the snapshot to load
+            columns (list) : Columns to load, all of them when None
+        """
+        return self._entry(path, columns)["frame"]
+
+    def derive(self, path, func, columns=None):
+        """Return func(frame) for the frame at path, computed once per version
+
+        Args:
+            path (str) : Absolute path of the snapshot to load
+            func (callable) : Pure function of the frame, used as the cache key
+            columns (list) : Columns func needs, all of them when None
+        """
+        entry = self._entry(path, columns)
+        derived = entry["derived"]
+        if func not in derived:
+            derived[func] = func(entry["frame"])
+        return derived[func]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+            }
+
+    def _in(self, path, directory, recursive):
+        if recursive:
+            return path.startswith(os.path.join(directory, ""))
+        return os.path.dirname(path) == directory
+
+    def nbytes(self, directory, recursive=True):
+        """Memory held by the frames of the files in `directory`"""
+        with self._lock:
+            entries = {
+                id(entry): entry
+                for key, entry in self._entries.items()
+                if self._in(key[0], directory, recursive)
+            }
+        return sum(entry["nbytes"] for entry in entries.values())
+
+    def evict(self, directory, recursive=False):
+        """Drop the frames of the files in `directory`, e.g. a retired version
+
+        Args:
+            directory (str) : Directory the snapshot files are in
+            recursive (bool) : Also drop the files of its subdirectories,
+                e.g. every version of a season
+        """
+        with self._lock:
+            self._entries = {
+                key: entry
+                for key, entry in self._entries.items()
+                if not self._in(key[0], directory, recursive)
+            }
+            kept = {id(entry) for entry in self._entries.values()}
+            self._files = {
+                key: entry for key, entry in self._files.items() if id(entry) in kept
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._files.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+snapshot_cache = SnapshotCache()
+
+
+class PublishedSnapshots:
+    """The snapshot version readers use, following fetch_data.py's publishes
+
+    fetch_data.py writes each run into a new version directory and then
+    swaps a pointer to it (see storage.publish_version). check() notices the
+    swap and calls `prepare` with the new directory, e.g. to load and
+    pre-render what is served from it, before switching `directory` over,
+    so the first requests on a new version find warm caches. The version in
+    use is leased (see storage.hold_version), so publishing never removes it.
+
+    Args:
+        root (str) : Data directory holding the pointer and the versions
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.version = storage.current_version(root)
+        self.directory = storage.version_directory(root, self.version)
+        if self.version is not None:
+            storage.hold_version(root, self.version)
+        self.switches = 0
+        self._failed = None
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._stopped = threading.Event()
+
+    def check(self, prepare=None, retire=None):
+        """Switch to the published version if it moved, True if it did
+
+        Args:
+            prepare (callable) : Called with the new directory before the switch
+            retire (callable) : Called with the previous directory after the
+                switch, e.g. to drop what was cached for it
+        """
+        version = storage.current_version(self.root)
+        if version in (self.version, self._failed):
+            return False
+        with self._lock:
+            if version == self.version:
+                return False
+            directory = storage.version_directory(self.root, version)
+            try:
+                if prepare is not None:
+                    prepare(directory)
+            except Exception:
+                # stay on the working version until another one is published
+                self._failed = version
+                raise
+            previous = self.directory
+            self.version, self.directory = version, directory
+            self.switches += 1
+            storage.hold_version(self.root, version)
+        print(f"Switched to snapshot version {version}")
+        if retire is not None:
+            retire(previous)
+        return True
+
+    def watch(self, interval, prepare=None, retire=None):
+        """check() every `interval` seconds in a background thread"""
+        if self._watcher is not None:
+            return
+
+        def run():
+            while not self._stopped.wait(interval):
+                try:
+                    self.check(prepare, retire)
+                except Exception as e:
+                    print(f"Failed to switch to snapshot version {self._failed}: {e}")
+
+        self._watcher = threading.Thread(target=run, name="snapshots", daemon=True)
+        self._watcher.start()
+
+    def stop(self):
+        """Stop the watch() thread, if any"""
+        self._stopped.set()
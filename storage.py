@@ -0,0 +1,297 @@
+import json
+import os
+import shutil
+import socket
+import sys
+import threading
+import time
+
+import pandas as pd
+
+try:
+    import pyarrow
+except ImportError:  # without pyarrow everything is stored as pickles
+    pyarrow = None
+
+MANIFEST = "manifest.json"
+# published versions live in {root}/versions/{version}, the pointer names the
+# one readers should use
+VERSIONS_DIRECTORY = "versions"
+POINTER = "current.json"
+KEEP_VERSIONS = 3
+# {root}/readers/{host}-{pid}.json names the version a process serves, so
+# publish_version() never removes it from under that process
+READERS_DIRECTORY = "readers"
+# seconds a lease from another host counts without being renewed; leases
+# from this host count for as long as their process runs
+READER_TTL = 3600
+# season -> its data directory, relative to the working directory
+SEASONS = {
+    "2024-25": "data2425",
+    "2023-24": "data",
+}
+CURRENT_SEASON = "2024-25"
+
+_manifest_lock = threading.Lock()
+
+
+def resolve(directory, name):
+    """Return the path a snapshot is stored at, preferring columnar files
+
+    Args:
+        directory (str) : Data directory, e.g. data2425
+        name (str) : Snapshot name without extension, e.g. get_club_data
+    """
+    path = os.path.join(directory, f"{name}.parquet")
+    if pyarrow is not None and os.path.exists(path):
+        return path
+    return os.path.join(directory, f"{name}.pkl")
+
+
+def read_path(path, columns=None):
+    """Read a snapshot file, loading only the requested columns if possible
+
+    Args:
+        path (str) : Path returned by resolve()
+        columns (list) : Columns to load, all of them when None
+    """
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path, columns=columns)
+    frame = pd.read_pickle(path)
+    if columns is not None:
+        frame = frame[list(columns)]
+    return frame
+
+
+def read_frame(directory, name, columns=None):
+    return read_path(resolve(directory, name), columns)
+
+
+def write_frame(df, directory, name, meta=None):
+    """Store a snapshot in columnar form and record it in the manifest
+
+    Frames pyarrow can't represent, like the nested gameweek data, are
+    pickled instead. Any stale file in the other format is removed so
+    readers never pick up an outdated copy. `meta` adds fields to the
+    manifest entry, e.g. the version of the models behind a prediction.
+    """
+    parquet_path = os.path.join(directory, f"{name}.parquet")
+    pickle_path = os.path.join(directory, f"{name}.pkl")
+    path, fmt = pickle_path, "pickle"
+    if pyarrow is not None:
+        try:
+            _replace(parquet_path, lambda tmp: df.to_parquet(tmp, index=False))
+            path, fmt = parquet_path, "parquet"
+        except (pyarrow.ArrowException, ValueError, TypeError):
+            pass
+    if fmt == "pickle":
+        _replace(pickle_path, df.to_pickle)
+    stale = pickle_path if fmt == "parquet" else parquet_path
+    if os.path.exists(stale):
+        os.remove(stale)
+    update_manifest(
+        directory,
+        name,
+        {
+            "file": os.path.basename(path),
+            "format": fmt,
+            "rows": len(df),
+            "columns": [str(column) for column in df.columns],
+            "written_at": time.time(),
+            **(meta or {}),
+        },
+    )
+    return path
+
+
+def _replace(path, write):
+    # write next to the target and rename, so readers never see half a file
+    tmp = f"{path}.tmp"
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def load_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def update_manifest(directory, name, entry):
+    with _manifest_lock:
+        manifest = load_manifest(directory)
+        manifest[name] = entry
+        _replace(
+            os.path.join(directory, MANIFEST),
+            lambda tmp: _dump_json(manifest, tmp),
+        )
+
+
+def _dump_json(obj, path):
+    with open(path, "w") as f:
+        json.dump(obj, f, indent=2, sort_keys=True)
+
+
+def read_pointer(root):
+    try:
+        with open(os.path.join(root, POINTER)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def current_version(root):
+    """Name of the published version, None before the first publish"""
+    return read_pointer(root).get("version")
+
+
+def version_directory(root, version):
+    """Directory of a version; without one, the root's flat layout is used"""
+    if version is None:
+        return root
+    return os.path.join(root, VERSIONS_DIRECTORY, version)
+
+
+def current_directory(root):
+    return version_directory(root, current_version(root))
+
+
+def hold_version(root, version):
+    """Record that this process serves `version`, replacing its earlier lease
+
+    Best effort: on a read-only data directory nothing is recorded.
+    """
+    directory = os.path.join(root, READERS_DIRECTORY)
+    lease = {"version": version, "host": socket.gethostname(), "pid": os.getpid()}
+    try:
+        os.makedirs(directory, exist_ok=True)
+        _replace(
+            os.path.join(directory, f"{lease['host']}-{lease['pid']}.json"),
+            lambda tmp: _dump_json(lease, tmp),
+        )
+    except OSError as e:
+        print(f"Couldn't record the snapshot version in use: {e}")
+
+
+def _alive(lease, mtime):
+    if lease.get("host") != socket.gethostname():
+        return time.time() - mtime < READER_TTL
+    try:
+        os.kill(lease["pid"], 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # running as another user
+        pass
+    return True
+
+
+def held_versions(root):
+    """Versions some running process still serves; drops the stale leases"""
+    directory = os.path.join(root, READERS_DIRECTORY)
+    try:
+        files = os.listdir(directory)
+    except FileNotFoundError:
+        return set()
+    held = set()
+    for file in files:
+        path = os.path.join(directory, file)
+        try:
+            mtime = os.stat(path).st_mtime
+            with open(path) as f:
+                lease = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if _alive(lease, mtime):
+            held.add(lease.get("version"))
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    return held
+
+
+def stage_version(root):
+    """Start a new version as a copy of the published one, return its directory
+
+    Files are hard linked rather than copied where the filesystem allows it.
+    Every write goes through a rename (see _replace), so writing to the new
+    version never changes the files of the published one.
+
+    Args:
+        root (str) : Data directory holding the versions, e.g. data2425
+    """
+    source = current_directory(root)
+    version = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+    directory = version_directory(root, version)
+    suffix = 1
+    while os.path.exists(directory):
+        suffix += 1
+        directory = version_directory(root, f"{version}-{suffix}")
+    os.makedirs(directory)
+    for file in os.listdir(source):
+        path = os.path.join(source, file)
+        if file == POINTER or not os.path.isfile(path):
+            continue
+        try:
+            os.link(path, os.path.join(directory, file))
+        except OSError:
+            shutil.copy2(path, os.path.join(directory, file))
+    return directory
+
+
+def publish_version(root, directory, keep=KEEP_VERSIONS):
+    """Point readers at a staged version, then remove older versions
+
+    The pointer is replaced atomically, so readers see either the previous
+    version or the new one in full. The `keep` most recently published
+    versions stay on disk, and so does any version a running reader still
+    holds (see hold_version), e.g. a worker that failed to switch; other
+    versions, unpublished ones included, are removed.
+
+    Args:
+        root (str) : Data directory holding the versions
+        directory (str) : Directory returned by stage_version()
+        keep (int) : Versions kept on disk, the new one included
+    """
+    missing = [
+        entry["file"]
+        for entry in load_manifest(directory).values()
+        if not os.path.exists(os.path.join(directory, entry["file"]))
+    ]
+    if missing:
+        raise FileNotFoundError(f"Missing from {directory}: {', '.join(missing)}")
+    version = os.path.basename(directory)
+    history = [version] + [
+        other for other in read_pointer(root).get("history", []) if other != version
+    ]
+    history = history[:keep]
+    pointer = {"version": version, "published_at": time.time(), "history": history}
+    _replace(os.path.join(root, POINTER), lambda tmp: _dump_json(pointer, tmp))
+    versions = os.path.join(root, VERSIONS_DIRECTORY)
+    held = held_versions(root)
+    for other in os.listdir(versions):
+        if other not in history and other not in held:
+            shutil.rmtree(os.path.join(versions, other), ignore_errors=True)
+    return version
+
+
+def convert(directory):
+    """Rewrite every pickle in a data directory through write_frame"""
+    for file in sorted(os.listdir(directory)):
+        if file.endswith(".pkl"):
+            name = file[: -len(".pkl")]
+            path = write_frame(
+                pd.read_pickle(os.path.join(directory, file)), directory, name
+            )
+            print(f"{file} -> {os.path.basename(path)}")
+
+
+if __name__ == "__main__":
+    convert(sys.argv[1] if len(sys.argv) > 1 else "data2425")
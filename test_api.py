@@ -0,0 +1,149 @@
+"""Checks of the API's request validation and error paths
+
+The app runs in-process with its FPL API calls answered by the stand-in
+server of bench/stub_fpl.py, so no network is needed:
+
+    python test_api.py
+
+The test_* functions also run under pytest.
+"""
+
+import os
+
+from bench import stub_fpl
+
+API_KEY = "test"
+HEADERS = {"Authorization": API_KEY}
+
+_client = None
+
+
+def client():
+    """Flask test client of the app, with the stand-in server started once"""
+    global _client
+    if _client is None:
+        # any environment value is accepted as an API key
+        os.environ["Authorization"] = API_KEY
+        import app as app_module
+
+        # stub squads are drawn from the players the app serves
+        players = app_module.player_data()[["id", "element_type"]]
+        server = stub_fpl.serve(stub_fpl.StandIn(players=players))
+        app_module.fpl_client.base_url = f"http://127.0.0.1:{server.server_port}/api"
+        app_module.fpl_client.limiter = None
+        _client = app_module.app.test_client()
+    return _client
+
+
+def post(path, body):
+    return client().post(path, json=body, headers=HEADERS)
+
+
+def test_batch_defaults_to_current_gameweek():
+    response = post("/api/fpl/batch", {"entries": [101, 102]})
+    assert response.status_code == 200, response.data
+    assert isinstance(response.json["gameweek"], int)
+    assert list(response.json["teams"]) == ["101", "102"]
+    assert response.json["errors"] == {}
+
+
+def test_batch_rejects_non_integer_ids():
+    for body in (
+        {"entries": [True]},
+        {"entries": [1.5]},
+        {"entries": ["103"]},
+        {"entries": [103], "gameweek": True},
+        {"entries": [103], "gameweek": 1.5},
+    ):
+        assert post("/api/fpl/batch", body).status_code == 400, body
+
+
+def test_batch_rejects_non_object_body():
+    for body in ([104, 105], 104, "104"):
+        assert post("/api/fpl/batch", body).status_code == 400, body
+
+
+def test_optimize_rejects_invalid_constraints():
+    for body in (
+        [1],
+        {"budget": True},
+        {"budget": 1000.5},
+        {"max_per_team": True},
+        {"captain_multiplier": 0.5},
+        {"lock": [True]},
+        {"lock": [1.5]},
+        {"composition": {"5": 1}},
+        {"composition": {"4": -1}},
+        {"composition": {"4": True}},
+    ):
+        assert post("/api/optimize", body).status_code == 400, body
+
+
+def test_optimize_merges_partial_composition():
+    response = post("/api/optimize", {"composition": {"4": 3}, "lineup": False})
+    assert response.status_code == 200, response.data
+    assert len(response.json["squad"]) == 15
+
+
+def test_team_sheets_keep_their_order():
+    import app as app_module
+
+    for path, key, stored in (
+        ("/api/ai", "ai", app_module.ai_team_data),
+        ("/api/fpl-challenge", "ai", app_module.fpl_challenge_data),
+    ):
+        response = client().get(path, headers=HEADERS)
+        assert response.status_code == 200, response.data
+        ids = [player["id"] for player in response.json[key]]
+        assert ids == stored()["id"].tolist(), path
+    # rows of several clubs interleaved, as a team sheet sorted by position
+    sheet = app_module.ai_team_data().iloc[::-1]
+    assert app_module.with_clubs(sheet)["id"].tolist() == sheet["id"].tolist()
+
+
+class BrokenPicks(stub_fpl.StandIn):
+    """Answers picks requests with `body` instead of an entry's picks"""
+
+    def __init__(self, body, **kwargs):
+        super().__init__(**kwargs)
+        self.body = body
+
+    def respond(self, path, headers):
+        if path.rstrip("/").endswith("/picks"):
+            return 200, {"Content-Type": "application/json"}, self.body
+        return super().respond(path, headers)
+
+
+def test_transfers_rejects_invalid_parameters():
+    for query in ("free_transfers=-1", "free_transfers=9", "max_transfers=-1"):
+        response = client().get(f"/api/fpl/301/transfers?{query}", headers=HEADERS)
+        assert response.status_code == 400, query
+
+
+def test_bad_upstream_picks():
+    import app as app_module
+
+    client()
+    base_url = app_module.fpl_client.base_url
+    # entries not requested before, their picks aren't cached
+    for entry, body in ((302, b"{}"), (303, b"not json")):
+        server = stub_fpl.serve(BrokenPicks(body))
+        app_module.fpl_client.base_url = f"http://127.0.0.1:{server.server_port}/api"
+        try:
+            response = client().get(f"/api/fpl/{entry}/transfers", headers=HEADERS)
+            assert response.status_code == 502, response.data
+            response = post("/api/fpl/batch", {"entries": [entry + 100]})
+            assert response.status_code == 200, response.data
+            assert list(response.json["errors"]) == [str(entry + 100)]
+        finally:
+            app_module.fpl_client.base_url = base_url
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    print("API tests in progress!🔃")
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"{name} passed")
+    print("API tests passed!🚀")
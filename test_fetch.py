@@ -1,4 +1,15 @@
-from fetch_data import get_game_data, get_current_gameweek
+import os
+import sys
+
+if "--offline" in sys.argv:
+    # answer the upstream requests from the snapshots, see bench/stub_fpl.py
+    from bench import stub_fpl
+
+    server = stub_fpl.serve(stub_fpl.StandIn())
+    os.environ["FPL_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/api"
+    os.environ["FPL_DATA_URL"] = f"http://127.0.0.1:{server.server_port}/data"
+
+from fetch_data import get_game_data, get_current_gameweek  # noqa: E402
 
 
 print("Fetch game data in progress!🔃")
@@ -0,0 +1,66 @@
+"""Checks of the snapshot cache
+
+    python test_snapshots.py
+
+The test_* functions also run under pytest.
+"""
+
+import os
+import tempfile
+
+import pandas as pd
+
+from snapshots import SnapshotCache
+
+
+def read_text(path, columns=None):
+    with open(path) as f:
+        return pd.DataFrame({"text": [f.read()]})
+
+
+def write(path, text):
+    # a new file renamed over the old one, as storage.write_frame does
+    with open(path + ".tmp", "w") as f:
+        f.write(text)
+    os.replace(path + ".tmp", path)
+
+
+def test_rewritten_file_drops_old_frame():
+    cache = SnapshotCache(reader=read_text)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "snapshot")
+        for text in ("a", "bb", "ccc"):
+            write(path, text)
+            assert cache.load(path)["text"][0] == text
+        assert len(cache._files) == 1
+        # rewritten in place, the inode stays the same
+        with open(path, "w") as f:
+            f.write("dddd")
+        assert cache.load(path)["text"][0] == "dddd"
+        assert len(cache._files) == 1
+
+
+def test_linked_file_keeps_old_frame():
+    cache = SnapshotCache(reader=read_text)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "snapshot")
+        linked = os.path.join(directory, "linked")
+        write(path, "a")
+        os.link(path, linked)
+        assert cache.load(path)["text"][0] == "a"
+        assert cache.load(linked)["text"][0] == "a"
+        assert cache.hits == 1
+        write(path, "bb")
+        assert cache.load(path)["text"][0] == "bb"
+        # the old file is still linked, and cached, at the other path
+        assert cache.load(linked)["text"][0] == "a"
+        assert len(cache._files) == 2
+
+
+if __name__ == "__main__":
+    print("Snapshot cache tests in progress!🔃")
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"{name} passed")
+    print("Snapshot cache tests passed!🚀")
@@ -0,0 +1,143 @@
+"""Checks of the FPL API client and the upstream file cache
+
+Runs FPLClient and SourceCache against the stand-in server of
+bench/stub_fpl.py, so no network is needed:
+
+    python test_upstream.py
+
+The test_* functions also run under pytest.
+"""
+
+import tempfile
+import threading
+
+import requests
+
+from bench import stub_fpl
+from upstream import FPLClient, SourceCache
+
+
+class Flaky(stub_fpl.StandIn):
+    """Fails the first `failures` requests with a 503, records every status"""
+
+    def __init__(self, failures=0, **kwargs):
+        super().__init__(**kwargs)
+        self.failures = failures
+        self.statuses = []
+
+    def respond(self, path, headers):
+        with self._lock:
+            failed = self.failures > 0
+            if failed:
+                self.failures -= 1
+        if failed:
+            status, response_headers, content = 503, {}, b""
+        else:
+            status, response_headers, content = super().respond(path, headers)
+        self.statuses.append(status)
+        return status, response_headers, content
+
+
+def serve(stand_in):
+    """Start a stand-in server, return it with its base URL"""
+    server = stub_fpl.serve(stand_in)
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def picks_requests(stand_in):
+    return stand_in.stats()["requests"].get("picks", 0)
+
+
+def test_picks_are_cached():
+    stand_in = stub_fpl.StandIn()
+    server, base_url = serve(stand_in)
+    try:
+        client = FPLClient(base_url=f"{base_url}/api")
+        first = client.picks(1, 5)
+        assert client.picks(1, 5) == first
+        assert picks_requests(stand_in) == 1
+        client.picks(2, 5)
+        assert picks_requests(stand_in) == 2
+    finally:
+        server.shutdown()
+
+
+def test_concurrent_picks_share_one_request():
+    stand_in = stub_fpl.StandIn(latency=0.2)
+    server, base_url = serve(stand_in)
+    try:
+        client = FPLClient(base_url=f"{base_url}/api")
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(client.picks(3, 5)))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(results) == 8
+        assert all(result == results[0] for result in results)
+        assert picks_requests(stand_in) == 1
+    finally:
+        server.shutdown()
+
+
+def test_server_errors_are_retried():
+    stand_in = Flaky(failures=2)
+    server, base_url = serve(stand_in)
+    try:
+        client = FPLClient(base_url=f"{base_url}/api", retries=2, backoff=0.01)
+        assert "events" in client.get_json("bootstrap-static/")
+        assert client.retried == 2
+        assert stand_in.statuses == [503, 503, 200]
+
+        stand_in.failures = 2
+        client = FPLClient(base_url=f"{base_url}/api", retries=1, backoff=0.01)
+        try:
+            client.get_json("bootstrap-static/")
+        except requests.exceptions.HTTPError:
+            pass
+        else:
+            raise AssertionError("a 503 after the last retry must raise")
+        assert client.errors == 1
+    finally:
+        server.shutdown()
+
+
+def test_unchanged_files_are_not_downloaded_again():
+    stand_in = Flaky()
+    server, base_url = serve(stand_in)
+    url = f"{base_url}/data/2024-25/teams.csv"
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            first = SourceCache(directory).get(url)
+            assert first.changed
+            # a later run, with the body and its ETag kept on disk
+            second = SourceCache(directory).get(url)
+            assert second.content == first.content
+            assert not second.changed
+            assert stand_in.statuses == [200, 304]
+    finally:
+        server.shutdown()
+
+
+def test_injected_resources_are_not_loaded():
+    import fetch_data
+
+    game_data = {"events": [{"id": 1, "is_current": True}]}
+    fetch_data.resources.inject(game_data=game_data)
+    try:
+        # the loader would request bootstrap-static from the FPL API
+        assert fetch_data.get_game_data() is game_data
+    finally:
+        fetch_data.resources.reset("game_data")
+
+
+if __name__ == "__main__":
+    print("Upstream tests in progress!🔃")
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"{name} passed")
+    print("Upstream tests passed!🚀")
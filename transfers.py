@@ -0,0 +1,188 @@
+import numpy as np
+from scipy import sparse
+
+from optimizer import SQUAD_COMPOSITION, BinaryProblem, OptimizationError
+
+HIT_COST = 4
+MAX_FREE_TRANSFERS = 5
+# best players by horizon xp kept per position, besides the current squad
+CANDIDATES_PER_POSITION = 40
+
+
+def candidate_rows(players, xp, squad, per_position=CANDIDATES_PER_POSITION):
+    """Rows worth considering: the squad plus the best players per position
+
+    Args:
+        players (DataFrame) : Players with id and element_type
+        xp (array) : Player x gameweek expected points, rows as players
+        squad (list) : IDs of the current squad
+        per_position (int) : Players kept per position
+    """
+    total = xp.sum(axis=1)
+    keep = np.isin(players["id"].to_numpy(), list(squad))
+    positions = players["element_type"].to_numpy()
+    for position in np.unique(positions):
+        rows = np.flatnonzero(positions == position)
+        keep[rows[np.argsort(-total[rows], kind="stable")[:per_position]]] = True
+    return np.flatnonzero(keep)
+
+
+def plan_transfers(
+    players,
+    xp,
+    squad,
+    bank,
+    free_transfers=1,
+    max_transfers=None,
+    max_per_team=3,
+    hit_cost=HIT_COST,
+    candidates=CANDIDATES_PER_POSITION,
+    time_limit=None,
+    mip_gap=None,
+):
+    """Best transfers over the next gameweeks, as one MILP over the horizon
+
+    Every gameweek of the horizon has a squad, bought and sold variable per
+    candidate player, linked to the previous gameweek's squad and, for the
+    first one, to the current squad. Transfers beyond the free ones cost
+    `hit_cost` points each; unused free transfers roll over up to
+    MAX_FREE_TRANSFERS. Players are valued at now_cost, selling prices
+    aren't public.
+
+    Args:
+        players (DataFrame) : Players with id, now_cost, element_type and team
+        xp (array) : Player x gameweek expected points over the horizon
+        squad (list) : IDs of the current 15 players
+        bank (int) : Money in the bank, in now_cost units
+        free_transfers (int) : Free transfers available for the first gameweek
+        max_transfers (int) : Most transfers over the whole horizon
+        max_per_team (int) : Most players allowed from one club
+        hit_cost (int) : Points paid per transfer beyond the free ones
+        candidates (int) : Players kept per position, see candidate_rows()
+        time_limit (float) : Seconds to search before settling
+        mip_gap (float) : Relative optimality gap to settle for
+
+    Returns {"plan": [...], "stats": {...}}, the plan holding the transfers,
+    hits, squad, bank and expected points of each gameweek.
+    """
+    xp = np.asarray(xp, dtype=np.float64)
+    missing = set(squad) - set(players["id"])
+    if missing:
+        raise OptimizationError(f"Squad players not found: {sorted(missing)}")
+    rows = candidate_rows(players, xp, squad, candidates)
+    players, xp = players.iloc[rows], xp[rows]
+    n, horizon = xp.shape
+    ids = players["id"].to_numpy()
+    cost = players["now_cost"].to_numpy(np.float64)
+    owned = np.isin(ids, list(squad)).astype(np.float64)
+    budget = bank + cost @ owned
+
+    # variables: squad, bought and sold per (gameweek, player), then paid
+    # transfers and free transfers available per gameweek
+    block = horizon * n
+    squad_at = np.arange(block).reshape(horizon, n)
+    bought_at = squad_at + block
+    sold_at = squad_at + 2 * block
+    paid_at = 3 * block + np.arange(horizon)
+    free_at = paid_at + horizon
+    objective = np.zeros(3 * block + 2 * horizon)
+    objective[squad_at] = xp.T
+    objective[paid_at] = -hit_cost
+    upper = np.ones(len(objective))
+    upper[paid_at] = 15
+    upper[free_at] = MAX_FREE_TRANSFERS
+    problem = BinaryProblem(objective, upper=upper)
+
+    gameweek = np.repeat(np.arange(horizon), n)
+    position = np.tile(players["element_type"].to_numpy(), horizon)
+    labels = np.unique(position)
+    counts = np.array([SQUAD_COMPOSITION.get(label, 0) for label in labels])
+    problem.add_groups(
+        gameweek * 10 + position,
+        lower=np.tile(counts, horizon),
+        upper=np.tile(counts, horizon),
+        columns=squad_at.ravel(),
+    )
+    team = np.tile(players["team"].to_numpy(), horizon)
+    problem.add_groups(
+        gameweek * 100 + team, upper=max_per_team, columns=squad_at.ravel()
+    )
+    problem.add_groups(
+        gameweek,
+        upper=budget,
+        weights=np.tile(cost, horizon),
+        columns=squad_at.ravel(),
+    )
+
+    # squad[t] = squad[t - 1] + bought[t] - sold[t]
+    size = len(objective)
+    links = np.arange(block)
+    previous = squad_at[:-1].ravel()
+    balance = sparse.csr_matrix(
+        (
+            np.concatenate(
+                [
+                    np.ones(block),
+                    -np.ones(block),
+                    np.ones(block),
+                    -np.ones(len(previous)),
+                ]
+            ),
+            (
+                np.concatenate([links, links, links, links[n:]]),
+                np.concatenate(
+                    [squad_at.ravel(), bought_at.ravel(), sold_at.ravel(), previous]
+                ),
+            ),
+        ),
+        shape=(block, size),
+    )
+    start = np.zeros(block)
+    start[:n] = owned
+    problem.add_rows(balance, lower=start, upper=start)
+
+    # bought[t] - free[t] - paid[t] <= 0
+    transfers = sparse.lil_matrix((horizon, size))
+    # free[t + 1] - free[t] + bought[t] - paid[t] <= 1
+    rollover = sparse.lil_matrix((max(horizon - 1, 0), size))
+    for t in range(horizon):
+        transfers[t, bought_at[t]] = 1
+        transfers[t, free_at[t]] = -1
+        transfers[t, paid_at[t]] = -1
+        if t + 1 < horizon:
+            rollover[t, free_at[t + 1]] = 1
+            rollover[t, free_at[t]] = -1
+            rollover[t, bought_at[t]] = 1
+            rollover[t, paid_at[t]] = -1
+    problem.add_rows(transfers.tocsr(), upper=0)
+    if horizon > 1:
+        problem.add_rows(rollover.tocsr(), upper=1)
+    first = np.zeros(size)
+    first[free_at[0]] = 1
+    free_transfers = min(max(int(free_transfers), 0), MAX_FREE_TRANSFERS)
+    problem.add_rows(first, lower=free_transfers, upper=free_transfers)
+    if max_transfers is not None:
+        total = np.zeros(size)
+        total[bought_at.ravel()] = 1
+        problem.add_rows(total, upper=max_transfers)
+
+    x, stats = problem.solve(time_limit=time_limit, mip_gap=mip_gap)
+    plan = []
+    for t in range(horizon):
+        selected = x[squad_at[t]]
+        transfers_in = ids[x[bought_at[t]] == 1].tolist()
+        plan.append(
+            {
+                "transfers_in": transfers_in,
+                "transfers_out": ids[x[sold_at[t]] == 1].tolist(),
+                "free_transfers": free_transfers,
+                "hits": max(len(transfers_in) - free_transfers, 0),
+                "squad": ids[selected == 1].tolist(),
+                "bank": int(round(budget - cost @ selected)),
+                "xp": round(float(xp[:, t] @ selected), 2),
+            }
+        )
+        free_transfers = min(
+            max(free_transfers - len(transfers_in), 0) + 1, MAX_FREE_TRANSFERS
+        )
+    return {"plan": plan, "stats": stats}
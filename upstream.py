@@ -0,0 +1,369 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+FPL_BASE_URL = os.environ.get(
+    "FPL_BASE_URL", "https://fantasy.premierleague.com/api/"
+).rstrip("/")
+# root of vaastav/Fantasy-Premier-League's per-season CSVs, e.g.
+# {FPL_DATA_URL}/2024-25/teams.csv
+FPL_DATA_URL = os.environ.get(
+    "FPL_DATA_URL",
+    "https://raw.githubusercontent.com/vaastav/Fantasy-Premier-League/master/data/",
+).rstrip("/")
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries may also expire after a TTL
+
+    Entries stored with ttl=None never expire and are only dropped by LRU
+    eviction.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class RateLimiter:
+    """Token bucket allowing `rate` calls per second, in bursts of `burst`"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1, rate))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one execution"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+        else:
+            try:
+                call.result = func()
+            except Exception as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+class FPLClient:
+    """Shared client for the FPL API with a pooled keep-alive session
+
+    Args:
+        base_url (str) : Root of the API, overridable for local stub servers
+        timeout (tuple) : Connect and read timeouts in seconds
+        pool_size (int) : Number of keep-alive connections kept open
+        picks_ttl (float) : Seconds to cache picks of an unfinished gameweek
+        cache_size (int) : Maximum number of picks kept in memory
+        rate_limit (float) : Maximum upstream calls per second, if any
+        retries (int) : Retries of rate limited or failed calls
+        backoff (float) : Base delay in seconds of the exponential backoff
+        max_backoff (float) : Longest delay between two attempts
+    """
+
+    def __init__(
+        self,
+        base_url=FPL_BASE_URL,
+        timeout=(3.05, 10),
+        pool_size=32,
+        picks_ttl=60,
+        cache_size=4096,
+        rate_limit=None,
+        retries=0,
+        backoff=1.0,
+        max_backoff=60.0,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.picks_ttl = picks_ttl
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.picks_cache = TTLCache(cache_size)
+        self._flight = SingleFlight()
+        self.limiter = RateLimiter(rate_limit) if rate_limit else None
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.calls = 0
+        self.errors = 0
+        self.retried = 0
+
+    def get_json(self, path, params=None):
+        """GET base_url/path and return the decoded JSON body
+
+        Rate limited (429) and server error responses, timeouts and dropped
+        connections are retried up to `retries` times with jittered
+        exponential backoff, honouring Retry-After when the API sends it.
+        """
+        endpoint = path.strip("/").split("/")[0]
+        for attempt in range(self.retries + 1):
+            if self.limiter is not None:
+                self.limiter.acquire()
+            self.calls += 1
+            start = time.perf_counter()
+            delay = None
+            try:
+                with metrics.stage("upstream"):
+                    response = self.session.get(
+                        f"{self.base_url}/{path.lstrip('/')}",
+                        params=params,
+                        timeout=self.timeout,
+                    )
+                    if (
+                        response.status_code in RETRY_STATUSES
+                        and attempt < self.retries
+                    ):
+                        delay = self._retry_after(response, attempt)
+                    else:
+                        response.raise_for_status()
+                        data = response.json()
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+            ):
+                if attempt == self.retries:
+                    self._failed(endpoint, start)
+                    raise
+                delay = self._backoff(attempt)
+            except (requests.exceptions.RequestException, ValueError):
+                self._failed(endpoint, start)
+                raise
+            if delay is None:
+                metrics.upstream_seconds.observe(
+                    time.perf_counter() - start, endpoint, "ok"
+                )
+                return data
+            self.retried += 1
+            metrics.upstream_seconds.observe(
+                time.perf_counter() - start, endpoint, "retry"
+            )
+            time.sleep(delay)
+
+    def _failed(self, endpoint, start):
+        self.errors += 1
+        metrics.upstream_seconds.observe(time.perf_counter() - start, endpoint, "error")
+
+    def _backoff(self, attempt):
+        # "full jitter": spreads out retries of many concurrent workers
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+    def _retry_after(self, response, attempt):
+        try:
+            return min(self.max_backoff, float(response.headers["Retry-After"]))
+        except (KeyError, ValueError):
+            return self._backoff(attempt)
+
+    def picks(self, entry_id, gameweek, finished=False):
+        """Return the picks of an entry for a gameweek
+
+        Args:
+            entry_id (int) : ID of the team whose picks are to be retrieved
+            gameweek (int) : Specific gameweek
+            finished (bool) : Whether the gameweek is over, in which case the
+                picks can't change and are cached without expiry
+        """
+        key = (int(entry_id), int(gameweek))
+        data = self.picks_cache.get(key)
+        if data is not None:
+            return data
+
+        def fetch():
+            data = self.picks_cache.get(key)
+            if data is None:
+                data = self.get_json(f"entry/{key[0]}/event/{key[1]}/picks/")
+                ttl = None if finished else self.picks_ttl
+                self.picks_cache.set(key, data, ttl)
+            return data
+
+        return self._flight.do(key, fetch)
+
+
+fpl_client = FPLClient()
+
+
+# body of an upstream file, the sha1 of the body and whether that differs
+# from the body fetched on the previous run
+Fetched = namedtuple("Fetched", ["content", "digest", "changed"])
+
+
+class SourceCache:
+    """Conditional GETs of upstream files, with the last body kept on disk
+
+    Each URL is requested with the ETag and Last-Modified of its previous
+    response, so an unchanged file costs a 304 rather than a download. A URL
+    is requested at most once per process: later calls, e.g. from the stage
+    parsing a body the pipeline fingerprinted, get the same body.
+
+    Args:
+        directory (str) : Where the bodies and their validators are kept
+        timeout (tuple) : Connect and read timeouts in seconds
+    """
+
+    INDEX = "index.json"
+
+    def __init__(self, directory, timeout=(3.05, 30)):
+        self.directory = directory
+        self.timeout = timeout
+        self.session = requests.Session()
+        self._index = None
+        self._fetched = {}
+        self._flight = SingleFlight()
+        self._lock = threading.Lock()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _entry(self, url):
+        with self._lock:
+            if self._index is None:
+                try:
+                    with open(self._path(self.INDEX)) as f:
+                        self._index = json.load(f)
+                except (FileNotFoundError, ValueError):
+                    self._index = {}
+            return self._index.get(url, {})
+
+    def _store(self, url, entry, content):
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            _write_atomic(self._path(entry["file"]), content)
+            self._index[url] = entry
+            _write_atomic(
+                self._path(self.INDEX),
+                json.dumps(self._index, indent=2, sort_keys=True).encode(),
+            )
+
+    def get(self, url):
+        """Return the Fetched body of url, downloading it only if it changed"""
+        fetched = self._fetched.get(url)
+        if fetched is None:
+            fetched = self._flight.do(
+                url, lambda: self._fetched.get(url) or self._fetch(url)
+            )
+        return fetched
+
+    def _fetch(self, url):
+        entry = self._entry(url)
+        file = hashlib.sha1(url.encode()).hexdigest()
+        headers = {}
+        # validators are only worth sending while their body is still around
+        if os.path.exists(self._path(file)):
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+        if response.status_code == 304 and headers:
+            with open(self._path(file), "rb") as f:
+                content = f.read()
+            print(f"Not modified: {url}")
+        else:
+            response.raise_for_status()
+            content = response.content
+        digest = hashlib.sha1(content).hexdigest()
+        if response.status_code != 304:
+            self._store(
+                url,
+                {
+                    "file": file,
+                    "digest": digest,
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                },
+                content,
+            )
+        fetched = self._fetched[url] = Fetched(
+            content, digest, digest != entry.get("digest")
+        )
+        return fetched
+
+    def forget(self):
+        """Request every URL again on its next get()"""
+        self._fetched.clear()
+
+
+def _write_atomic(path, content):
+    with open(f"{path}.tmp", "wb") as f:
+        f.write(content)
+    os.replace(f"{path}.tmp", path)
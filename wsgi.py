@@ -0,0 +1,9 @@
+import gc
+
+from app import app, warm_up
+
+# Build the caches once before gunicorn forks its workers, then move
+# everything that exists so far out of the collector's reach so the workers'
+# garbage collections don't touch (and un-share) those pages.
+warm_up()
+gc.freeze()